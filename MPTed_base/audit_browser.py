@@ -0,0 +1,125 @@
+import base64
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.models import AuditLog
+from api.people_search import search_people
+
+
+LOGS_PER_PAGE = 50
+
+# До скольких записей считать число найденных при фильтрах
+FILTERED_COUNT_LIMIT = 10000
+
+CURSOR_PARAMS = ('after', 'before', 'page')
+
+
+def encode_cursor(log):
+    """Курсор страницы - (timestamp, id) записи"""
+    raw = f'{log.timestamp.isoformat()}|{log.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(value):
+    """(timestamp, id) из курсора или None, если курсор испорчен"""
+    if not value:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+        timestamp, log_id = raw.rsplit('|', 1)
+        timestamp = parse_datetime(timestamp)
+        return (timestamp, int(log_id)) if timestamp else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _day_start(value):
+    """Начало дня по времени проекта или None для неверной даты"""
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+    return timezone.make_aware(day)
+
+
+def filter_audit_logs(params):
+    """
+    Журнал с фильтрами страницы аудита. Даты превращаются в диапазон по
+    timestamp (а не timestamp__date), чтобы работали индекс и секции.
+    """
+    logs = AuditLog.objects.all()
+
+    if params.get('action'):
+        logs = logs.filter(action=params['action'])
+    if params.get('model'):
+        logs = logs.filter(model_name=params['model'])
+    if params.get('user', '').isdigit():
+        logs = logs.filter(user_id=int(params['user']))
+
+    date_from = _day_start(params.get('date_from', ''))
+    if date_from:
+        logs = logs.filter(timestamp__gte=date_from)
+    date_to = _day_start(params.get('date_to', ''))
+    if date_to:
+        logs = logs.filter(timestamp__lt=date_to + timedelta(days=1))
+
+    search = params.get('search', '')
+    if search:
+        logs = logs.filter(
+            Q(model_name__icontains=search) |
+            Q(object_id__icontains=search) |
+            Q(user__in=search_people(search).values('user'))
+        )
+    return logs
+
+
+def get_audit_page(logs, after=None, before=None, per_page=LOGS_PER_PAGE):
+    """
+    Страница журнала от новых к старым по курсору (timestamp, id): after -
+    записи старше курсора, before - новее. Вместо OFFSET - диапазон по
+    индексу (timestamp, id), поэтому глубина страницы не влияет на время.
+
+    Возвращает (записи, курсор следующей страницы, курсор предыдущей).
+    """
+    logs = logs.select_related('user')
+
+    if before:
+        timestamp, log_id = before
+        rows = list(logs.filter(timestamp__gte=timestamp).filter(
+            Q(timestamp__gt=timestamp) | Q(id__gt=log_id)
+        ).order_by('timestamp', 'id')[:per_page + 1])
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        has_next = True
+    else:
+        if after:
+            timestamp, log_id = after
+            logs = logs.filter(timestamp__lte=timestamp).filter(
+                Q(timestamp__lt=timestamp) | Q(id__lt=log_id)
+            )
+        rows = list(logs.order_by('-timestamp', '-id')[:per_page + 1])
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_previous = after is not None
+
+    next_cursor = encode_cursor(rows[-1]) if rows and has_next else None
+    previous_cursor = encode_cursor(rows[0]) if rows and has_previous else None
+    return rows, next_cursor, previous_cursor
+
+
+def count_filtered(logs, limit=FILTERED_COUNT_LIMIT):
+    """Число найденных записей, но не больше limit: (число, превышен ли limit)"""
+    count = logs.order_by()[:limit + 1].count()
+    return min(count, limit), count > limit
+
+
+def filters_query(params):
+    """GET-параметры фильтров без курсора - для ссылок на соседние страницы"""
+    return urlencode([
+        (key, value) for key, value in params.items()
+        if key not in CURSOR_PARAMS and value
+    ])
@@ -2,6 +2,8 @@ from django.shortcuts import redirect
 from functools import wraps
 from django.contrib import messages
 
+from .roles import get_user_roles
+
 
 def custom_login_required(view_func):
     """Просто проверяет, авторизован ли пользователь"""
@@ -21,7 +23,7 @@ def admin_required(view_func):
             return redirect('/')
         
         # Админ = суперпользователь ИЛИ пользователь в группе 'admin'
-        is_admin = request.user.is_superuser or request.user.groups.filter(name='admin').exists()
+        is_admin = get_user_roles(request.user).is_admin
         
         if not is_admin:
             messages.error(request, 'Доступ только для администраторов')
@@ -38,14 +40,14 @@ def student_required(view_func):
         if not request.user.is_authenticated:
             return redirect('/')
         
-        # Студент = пользователь в группе 'student'
-        is_student = request.user.groups.filter(name='student').exists()
+        roles = get_user_roles(request.user)
         
-        if not is_student:
+        # Студент = пользователь в группе 'student'
+        if not roles.is_student:
             messages.error(request, 'Доступ только для учеников')
             
             # Если не студент, отправляем в нужное место
-            if request.user.is_superuser or request.user.groups.filter(name='admin').exists():
+            if roles.is_admin:
                 return redirect('admin_dashboard_page')  # Админа - в админку
             else:
                 return redirect('dashboard_page')  # Остальных - на главную
@@ -63,15 +65,11 @@ def education_department_required(view_func):
             return redirect('login_page')
         
         # Проверяем права - суперпользователь, админ или учебный отдел
-        is_allowed = (
-            request.user.is_superuser or 
-            request.user.groups.filter(name='admin').exists() or
-            request.user.groups.filter(name='education_department').exists()
-        )
+        is_allowed = get_user_roles(request.user).has_education_department_access
         
         if not is_allowed:
             messages.error(request, 'Доступ только для сотрудников учебного отдела')
             return redirect('dashboard_page')
         
         return view_func(request, *args, **kwargs)
-    return _wrapped_view
\ No newline at end of file
+    return _wrapped_view
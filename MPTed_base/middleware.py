@@ -0,0 +1,38 @@
+from django.utils.functional import SimpleLazyObject
+
+from api.audit import bind_request, unbind_request
+
+from .roles import get_user_roles
+
+
+class UserRolesMiddleware:
+    """
+    Добавляет в запрос ленивый атрибут request.roles.
+    Группы пользователя загружаются только при первом обращении.
+    Должен стоять после AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.roles = SimpleLazyObject(lambda: get_user_roles(request.user))
+        return self.get_response(request)
+
+
+class AuditContextMiddleware:
+    """
+    Запоминает текущий запрос для журнала аудита: пользователь, IP,
+    User-Agent и путь попадают в события, записанные во время запроса.
+    Должен стоять после AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = bind_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            unbind_request(token)
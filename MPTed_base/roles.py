@@ -0,0 +1,58 @@
+class UserRoles:
+    """Набор ролей пользователя, загружаемый один раз за запрос"""
+
+    def __init__(self, user, group_names):
+        self.user = user
+        self.group_names = frozenset(group_names)
+        # Первая группа пользователя - по ней шаблоны выбирают меню и подпись роли
+        self.primary = group_names[0] if group_names else ''
+
+    def has(self, name):
+        return name in self.group_names
+
+    @property
+    def is_admin(self):
+        return self.user.is_superuser or 'admin' in self.group_names
+
+    @property
+    def is_teacher(self):
+        return 'teacher' in self.group_names
+
+    @property
+    def is_student(self):
+        return 'student' in self.group_names
+
+    @property
+    def is_education_department(self):
+        return 'education_department' in self.group_names
+
+    @property
+    def has_education_department_access(self):
+        return self.is_admin or self.is_education_department
+
+    def __repr__(self):
+        return f'<UserRoles {self.user.pk}: {sorted(self.group_names)}>'
+
+
+ANONYMOUS_ROLES = ()
+
+
+def get_user_roles(user):
+    """
+    Возвращает роли пользователя.
+    Имена групп загружаются одним запросом и запоминаются на объекте
+    пользователя до конца запроса. Между запросами роли не кэшируются:
+    кэш по умолчанию (LocMemCache) у каждого процесса свой, и снятые
+    права держались бы в других процессах до истечения кэша.
+    """
+    roles = getattr(user, '_mpted_roles', None)
+    if roles is not None:
+        return roles
+
+    if not user.is_authenticated:
+        roles = UserRoles(user, ANONYMOUS_ROLES)
+    else:
+        roles = UserRoles(user, list(user.groups.order_by('pk').values_list('name', flat=True)))
+
+    user._mpted_roles = roles
+    return roles
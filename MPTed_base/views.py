@@ -6,18 +6,20 @@ from django.contrib.auth import authenticate, login as django_login, logout as d
 from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 from .decorators import custom_login_required, admin_required, student_required
-from django.db.models import Q, Count, Avg,  Max, Min
+from .roles import get_user_roles
+from django.db.models import Q, Count,  Max, Min
 from .utils.email_sender import send_account_changes_email, send_student_credentials_email
 
 
 # Импортируем твои модели
 from api.models import *
+from api.people_search import search_people
 
 @require_http_methods(["GET"])
 def login_page(request):
     """HTML страница авторизации"""
     if request.user.is_authenticated:
-        if request.user.is_superuser or request.user.groups.filter(name='admin').exists():
+        if request.roles.is_admin:
             return redirect('admin_dashboard_page')
         return redirect('dashboard_page')  
     return render(request, 'index.html')
@@ -43,12 +45,13 @@ def login(request):
         django_login(request, user)
         
         # Определяем куда редиректить
-        if user.is_superuser or user.groups.filter(name='admin').exists():
+        roles = get_user_roles(user)
+        if roles.is_admin:
             return redirect('admin_dashboard_page')
-        elif user.groups.filter(name='teacher').exists():
+        elif roles.is_teacher:
             # ПЕРЕНАПРАВЛЯЕМ УЧИТЕЛЕЙ НА ИХ ПОРТАЛ
             return redirect('teacher_portal:dashboard')
-        elif user.groups.filter(name='student').exists():
+        elif roles.is_student:
             return redirect('student_dashboard')
         else:
             return redirect('dashboard_page')
@@ -62,15 +65,15 @@ def login(request):
 def dashboard_page(request):
     """HTML страница дашборда после авторизации"""
     # Проверяем роль пользователя
-    if request.user.is_superuser or request.user.groups.filter(name='admin').exists():
+    if request.roles.is_admin:
         return redirect('admin_dashboard_page')
     
     # Если пользователь - студент, перенаправляем на студенческий дашборд
-    if request.user.groups.filter(name='student').exists():
+    if request.roles.is_student:
         return redirect('student_dashboard')
     
     # Если пользователь - учитель, перенаправляем на учительский дашборд
-    if request.user.groups.filter(name='teacher').exists():
+    if request.roles.is_teacher:
         # ПЕРЕНАПРАВЛЯЕМ НА УЧИТЕЛЬСКИЙ ПОРТАЛ
         return redirect('teacher_portal:dashboard')  # Используем namespace микросервиса
     
@@ -512,13 +515,7 @@ def teachers_list(request):
     # Поиск
     search_query = request.GET.get('search', '').strip()
     if search_query:
-        teachers_qs = teachers_qs.filter(
-            Q(username__icontains=search_query) |
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query) |
-            Q(email__icontains=search_query) |
-            Q(teacher_profile__patronymic__icontains=search_query)
-        ).distinct()
+        teachers_qs = search_people(search_query, queryset=teachers_qs)
     
     # Фильтрация по статусу аккаунта
     status_filter = request.GET.get('status', '')
@@ -1013,14 +1010,7 @@ def students_list(request):
     # Поиск
     search_query = request.GET.get('search', '').strip()
     if search_query:
-        students_qs = students_qs.filter(
-            Q(user__first_name__icontains=search_query) |
-            Q(user__last_name__icontains=search_query) |
-            Q(patronymic__icontains=search_query) |
-            Q(user__username__icontains=search_query) |
-            Q(user__email__icontains=search_query) |
-            Q(phone__icontains=search_query)
-        )
+        students_qs = search_people(search_query, queryset=students_qs)
     
     # Фильтрация по классу
     group_filter = request.GET.get('group', '')
@@ -1424,7 +1414,9 @@ def student_delete(request, student_id):
 
 from datetime import datetime, date, timedelta
 from django.utils import timezone
-from django.db.models import Avg, Count, Sum
+from django.db.models import Count, Sum
+from api.attendance_rollup import rollup_stats, rollup_totals
+from api.grade_summary import summary_aggregates, summary_average, summary_histogram
 
 # ===== СТРАНИЦЫ ДЛЯ УЧЕНИКОВ =====
 
@@ -1475,18 +1467,14 @@ def student_dashboard(request):
         due_date__gte=today
     ).select_related('schedule_lesson__subject').order_by('due_date')[:5] if student_profile.student_group else []
     
-    # Считаем средний балл и общее количество оценок
-    all_grades = Grade.objects.filter(student=request.user)
-    total_grades = all_grades.count()
-    
-    # Вычисляем средний балл
-    avg_result = all_grades.aggregate(avg=Avg('value'))
-    average_grade = round(avg_result['avg'], 1) if avg_result['avg'] else 0
-    
-    # Количество предметов
-    subject_count = Subject.objects.filter(
-        grades__student=request.user
-    ).distinct().count()
+    # Средний балл, количество оценок и предметов - одним запросом к сводкам
+    grades_summary = GradeSummary.objects.filter(student=request.user).aggregate(
+        subject_count=Count('subject', distinct=True),
+        **summary_aggregates()
+    )
+    total_grades = grades_summary['grades_count'] or 0
+    average_grade = summary_average(grades_summary)
+    subject_count = grades_summary['subject_count']
     
     # === ИСПРАВЛЯЕМ ОШИБКУ: Получаем объявления для ученика ===
     announcements = []
@@ -1522,7 +1510,7 @@ def student_dashboard(request):
 @student_required 
 def student_schedule(request):
     """Расписание ученика"""
-    if not request.user.groups.filter(name='student').exists():
+    if not request.roles.is_student:
         messages.error(request, 'Доступ только для учеников')
         return redirect('dashboard_page')
     
@@ -1575,44 +1563,41 @@ def student_schedule(request):
 @student_required
 def student_grades(request):
     """Оценки ученика - таблица по предметам"""
-    # Получаем все предметы, по которым есть оценки
-    subjects_with_grades = Subject.objects.filter(
-        grades__student=request.user
-    ).distinct().order_by('name')
+    summaries = GradeSummary.objects.filter(student=request.user)
+    
+    # Средние и количество по предметам - по сводкам оценок
+    subject_rows = {
+        row['subject_id']: row
+        for row in summaries.order_by().values('subject_id').annotate(**summary_aggregates())
+    }
+    
+    # Сами оценки - одним запросом, раскладываем по предметам
+    grades_by_subject = {}
+    for grade in Grade.objects.filter(student=request.user).order_by('-date'):
+        grades_by_subject.setdefault(grade.subject_id, []).append(grade)
     
     # Подготавливаем данные для таблицы
     subject_data = []
-    for subject in subjects_with_grades:
-        # Получаем все оценки по предмету
-        grades = Grade.objects.filter(
-            student=request.user,
-            subject=subject
-        ).order_by('-date')
-        
-        # Вычисляем средний балл
-        average = grades.aggregate(avg=Avg('value'))['avg'] or 0
-        
+    for subject in Subject.objects.filter(id__in=subject_rows).order_by('name'):
+        row = subject_rows[subject.id]
         subject_data.append({
             'subject': subject,
-            'grades': grades,
-            'average': round(average, 1),
-            'count': grades.count(),
+            'grades': grades_by_subject.get(subject.id, []),
+            'average': summary_average(row),
+            'count': row['grades_count'],
         })
     
     # Статистика для круговой диаграммы
-    all_grades = Grade.objects.filter(student=request.user)
-    total_grades = all_grades.count()
+    totals = summaries.aggregate(**summary_aggregates())
+    total_grades = totals['grades_count'] or 0
     
     # Группируем оценки по значениям
     grade_stats = {}
-    for value in [2, 3, 4, 5]:
-        count = all_grades.filter(value=value).count()
-        if count > 0:
-            percentage = round((count / total_grades) * 100, 1) if total_grades > 0 else 0
-            grade_stats[value] = {
-                'count': count,
-                'percentage': percentage
-            }
+    for value, count in sorted(summary_histogram(totals).items()):
+        grade_stats[value] = {
+            'count': count,
+            'percentage': round((count / total_grades) * 100, 1) if total_grades > 0 else 0
+        }
     
     context = {
         'subject_data': subject_data,
@@ -1678,7 +1663,7 @@ def student_homework(request):
 @student_required 
 def student_attendance(request):
     """Посещаемость ученика"""
-    if not request.user.groups.filter(name='student').exists():
+    if not request.roles.is_student:
         messages.error(request, 'Доступ только для учеников')
         return redirect('dashboard_page')
     
@@ -1725,15 +1710,23 @@ def student_attendance(request):
             }
         attendance_by_date[date_str]['records'].append(record)
     
-    # Считаем статистику
-    total_lessons = attendance_qs.count()
-    present_count = attendance_qs.filter(status='P').count()
-    absent_count = attendance_qs.filter(status='A').count()
-    late_count = attendance_qs.filter(status='L').count()
+    # Считаем статистику - по дневным сводкам, а не по всем отметкам
+    rollups = AttendanceDaily.objects.filter(
+        student=request.user,
+        date__gte=start_date,
+        date__lt=end_date
+    )
+    if subject_filter:
+        rollups = rollups.filter(subject_id=subject_filter)
+    attendance_stats = rollup_stats(rollups.aggregate(**rollup_totals()))
+    total_lessons = attendance_stats['total']
+    present_count = attendance_stats['present']
+    absent_count = attendance_stats['absent']
+    late_count = attendance_stats['late']
     
     # Предметы для фильтра
     subjects = Subject.objects.filter(
-        schedule_lessons__attendances__student=request.user
+        attendance_days__student=request.user
     ).distinct().order_by('name')
     
     # Генерируем список месяцев для выбора
@@ -1763,7 +1756,7 @@ def student_attendance(request):
 @student_required 
 def student_profile_view(request):
     """Профиль ученика"""
-    if not request.user.groups.filter(name='student').exists():
+    if not request.roles.is_student:
         messages.error(request, 'Доступ только для учеников')
         return redirect('dashboard_page')
     
@@ -1808,7 +1801,7 @@ def student_profile_view(request):
 @student_required 
 def student_announcements(request):
     """Объявления для ученика"""
-    if not request.user.groups.filter(name='student').exists():
+    if not request.roles.is_student:
         messages.error(request, 'Доступ только для учеников')
         return redirect('dashboard_page')
     
@@ -1854,7 +1847,7 @@ def student_announcements(request):
 @student_required 
 def submit_homework(request):
     """Обработка сдачи домашнего задания с файлами"""
-    if not request.user.groups.filter(name='student').exists():
+    if not request.roles.is_student:
         messages.error(request, 'Доступ только для учеников')
         return redirect('student_homework')
     
@@ -2092,15 +2085,14 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
 from django.db.models import Q, Count
 from datetime import datetime, timedelta
+from api.audit_facets import get_audit_facets
+from api.audit_purge import is_active, run_purge_in_background, start_purge, unfinished_job
+from .audit_browser import count_filtered, decode_cursor, filter_audit_logs, filters_query, get_audit_page
 
 @custom_login_required
 @admin_required
 def audit_logs(request):
-    """Просмотр логов аудита"""
-    # Получаем все логи
-    logs_qs = AuditLog.objects.select_related('user').order_by('-timestamp')
-    
-    # Фильтры
+    """Просмотр логов аудита: страницы по курсору, статистика - из счетчиков"""
     action_filter = request.GET.get('action', '')
     model_filter = request.GET.get('model', '')
     user_filter = request.GET.get('user', '')
@@ -2108,66 +2100,31 @@ def audit_logs(request):
     date_to = request.GET.get('date_to', '')
     search_query = request.GET.get('search', '')
     
-    # Применяем фильтры
-    if action_filter:
-        logs_qs = logs_qs.filter(action=action_filter)
-    
-    if model_filter:
-        logs_qs = logs_qs.filter(model_name=model_filter)
-    
-    if user_filter and user_filter.isdigit():
-        logs_qs = logs_qs.filter(user_id=int(user_filter))
-    
-    if date_from:
-        try:
-            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
-            logs_qs = logs_qs.filter(timestamp__date__gte=date_from_obj)
-        except ValueError:
-            pass
-    
-    if date_to:
-        try:
-            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
-            logs_qs = logs_qs.filter(timestamp__date__lte=date_to_obj)
-        except ValueError:
-            pass
-    
-    if search_query:
-        logs_qs = logs_qs.filter(
-            Q(model_name__icontains=search_query) |
-            Q(object_id__icontains=search_query) |
-            Q(user__username__icontains=search_query) |
-            Q(user__first_name__icontains=search_query) |
-            Q(user__last_name__icontains=search_query)
-        )
-    
-    # Статистика
-    total_logs = logs_qs.count()
-    
-    # Статистика по действиям
-    action_stats = AuditLog.objects.values('action').annotate(
-        count=Count('id')
-    ).order_by('-count')
-    
-    # Статистика по моделям
-    model_stats = AuditLog.objects.values('model_name').annotate(
-        count=Count('id')
-    ).order_by('-count')
-    
-    # Пагинация
-    from django.core.paginator import Paginator
-    page_number = request.GET.get('page', 1)
-    paginator = Paginator(logs_qs, 50)  # 50 логов на странице
-    page_obj = paginator.get_page(page_number)
+    logs_qs = filter_audit_logs(request.GET)
+    page_logs, next_cursor, previous_cursor = get_audit_page(
+        logs_qs,
+        after=decode_cursor(request.GET.get('after')),
+        before=decode_cursor(request.GET.get('before')),
+    )
     
-    # Получаем уникальные значения для фильтров
+    # Статистика и списки для фильтров - из счетчиков AuditLogFacet
+    facets = get_audit_facets()
+    action_stats = [{'action': action, 'count': count} for action, count in facets['action']]
+    model_stats = [{'model_name': model, 'count': count} for model, count in facets['model']]
+    available_models = sorted(model for model, _ in facets['model'])
     users_with_logs = User.objects.filter(
-        audit_logs__isnull=False
-    ).distinct().order_by('username')
+        id__in=[int(user_id) for user_id, _ in facets['user']]
+    ).order_by('username')
+    
+    filtered = any(request.GET.get(key) for key in ('action', 'model', 'user', 'date_from', 'date_to', 'search'))
+    if filtered:
+        total_logs, total_logs_capped = count_filtered(logs_qs)
+    else:
+        total_logs, total_logs_capped = sum(count for _, count in facets['action']), False
     
     # Подготавливаем данные логов
     logs = []
-    for log in page_obj:
+    for log in page_logs:
         changes_summary = ''
         if log.action == 'CREATE':
             changes_summary = f'Создан объект {log.model_name}'
@@ -2219,20 +2176,19 @@ def audit_logs(request):
             'is_system_action': log.is_system_action,
         })
     
-    # Определяем доступные модели из логов
-    available_models = AuditLog.objects.values_list(
-        'model_name', flat=True
-    ).distinct().order_by('model_name')
-    
     context = {
         'logs': logs,
-        'page_obj': page_obj,
+        'next_cursor': next_cursor,
+        'previous_cursor': previous_cursor,
+        'filters_query': filters_query(request.GET),
         'total_logs': total_logs,
+        'total_logs_capped': total_logs_capped,
         'action_stats': action_stats,
         'model_stats': model_stats,
         'users_with_logs': users_with_logs,
         'available_models': available_models,
         'action_choices': AuditLog.ActionType.choices,
+        'purge_job': unfinished_job(),
         'action_filter': action_filter,
         'model_filter': model_filter,
         'user_filter': user_filter,
@@ -2284,19 +2240,28 @@ def clear_audit_logs(request):
             if days < 1:
                 days = 90
             
-            # Удаляем логи старше указанного количества дней
-            cutoff_date = timezone.now() - timedelta(days=days)
-            deleted_count, _ = AuditLog.objects.filter(
-                timestamp__lt=cutoff_date
-            ).delete()
+            # Удаление идет пакетами в фоне; незавершенная очистка продолжается
+            job = unfinished_job()
+            if job and is_active(job):
+                messages.warning(request, f'Очистка логов уже выполняется: {job.progress}%')
+                return redirect('audit_logs')
             
-            messages.success(request, f'Удалено {deleted_count} записей аудита старше {days} дней')
+            cutoff_date = timezone.now() - timedelta(days=days)
+            job, resumed = start_purge(cutoff_date, user=request.user)
+            if job.status == AuditPurgeJob.Status.DONE:
+                messages.info(request, f'Записей аудита старше {days} дней нет')
+            else:
+                run_purge_in_background(job)
+                if resumed:
+                    messages.success(request, f'Продолжена прерванная очистка логов до {job.cutoff:%d.%m.%Y}')
+                else:
+                    messages.success(request, f'Запущена очистка записей аудита старше {days} дней')
         except ValueError:
             messages.error(request, 'Неверное количество дней')
         
-        return redirect('admin/audit_logs')
+        return redirect('audit_logs')
     
-    return redirect('admin/audit_logs')
+    return redirect('audit_logs')
 
 
 # ===== ПРОСМОТР ОЦЕНОК И СТАТИСТИКИ ПО ГРУППАМ =====
@@ -2536,14 +2501,7 @@ def export_students_excel(request):
     
     # Применяем фильтры (как в students_list)
     if search_query:
-        students_qs = students_qs.filter(
-            Q(user__first_name__icontains=search_query) |
-            Q(user__last_name__icontains=search_query) |
-            Q(patronymic__icontains=search_query) |
-            Q(user__username__icontains=search_query) |
-            Q(user__email__icontains=search_query) |
-            Q(phone__icontains=search_query)
-        )
+        students_qs = search_people(search_query, queryset=students_qs)
     
     if group_filter:
         if group_filter == 'no_group':
@@ -0,0 +1,177 @@
+import zlib
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, Sum, When
+
+from .models import Attendance, AttendanceDaily, GroupAttendanceDaily, ScheduleLesson
+
+
+# Статус отметки -> счетчик в дневной сводке
+STATUS_COUNTERS = {'P': 'present', 'A': 'absent', 'L': 'late'}
+
+STUDENT_KEY = ('student_id', 'subject_id', 'date')
+GROUP_KEY = ('student_group_id', 'date')
+
+REBUILD_BATCH_SIZE = 1000
+
+# Пространства advisory-блокировок сводок: (ученик, дата) и (класс, дата)
+STUDENT_LOCK_SPACE = 0x61747331
+GROUP_LOCK_SPACE = 0x61747332
+
+
+def _status_counts():
+    return {
+        field: Count(Case(When(status=status, then=1)))
+        for status, field in STATUS_COUNTERS.items()
+    }
+
+
+def _student_rows(attendances):
+    return attendances.order_by().values(
+        'student_id', 'date', subject_id=F('schedule_lesson__subject_id'),
+    ).annotate(**_status_counts())
+
+
+def _group_rows(attendances):
+    return attendances.order_by().values(
+        'date', student_group_id=F('schedule_lesson__daily_schedule__student_group_id'),
+    ).annotate(**_status_counts())
+
+
+def _sync(model, key, scope, rows):
+    """
+    Записывает пересчитанные строки upsert'ом и удаляет строки из scope,
+    для которых отметок больше нет.
+    """
+    rows = list(rows)
+    if rows:
+        model.objects.bulk_create(
+            [model(**row) for row in rows],
+            update_conflicts=True,
+            unique_fields=list(key),
+            update_fields=list(STATUS_COUNTERS.values()),
+        )
+
+    fresh = {tuple(row[field] for field in key) for row in rows}
+    stale = [
+        pk for pk, *values in scope.values_list('pk', *key)
+        if tuple(values) not in fresh
+    ]
+    if stale:
+        model.objects.filter(pk__in=stale).delete()
+
+
+def _lock_keys(space, ids, dates):
+    """
+    Блокирует (до конца транзакции) пересчет сводок для пар (id, дата).
+    Ключи берутся по возрастанию, чтобы транзакции не ждали друг друга
+    по кругу; совпадение хэшей только лишний раз заставит подождать.
+    """
+    keys = sorted({
+        zlib.crc32(f'{pk}:{day}'.encode()) - 2 ** 31
+        for pk in ids for day in dates
+    })
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(%s, key) FROM unnest(%s::integer[]) AS key',
+            [space, keys],
+        )
+
+
+def refresh_attendance_rollups(dates, student_ids=(), group_ids=()):
+    """
+    Пересчитывает дневные сводки посещаемости для затронутых учеников и
+    классов за даты dates. Отметки этих дней читаются двумя
+    сгруппированными запросами, сводки пишутся пакетом в одной транзакции.
+
+    Пересчет идет под блокировкой затронутых пар (ученик/класс, дата) до
+    конца транзакции: параллельная запись отметок того же дня ждет ее и
+    пересчитывает сводку уже с нашими отметками, а не затирает ее своим
+    снимком без них.
+    """
+    dates = set(dates)
+    student_ids = set(student_ids) - {None}
+    group_ids = set(group_ids) - {None}
+    if not dates:
+        return
+
+    with transaction.atomic():
+        if student_ids:
+            _lock_keys(STUDENT_LOCK_SPACE, student_ids, dates)
+        if group_ids:
+            _lock_keys(GROUP_LOCK_SPACE, group_ids, dates)
+
+        if student_ids:
+            _sync(
+                AttendanceDaily, STUDENT_KEY,
+                AttendanceDaily.objects.filter(date__in=dates, student_id__in=student_ids),
+                _student_rows(Attendance.objects.filter(date__in=dates, student_id__in=student_ids)),
+            )
+        if group_ids:
+            _sync(
+                GroupAttendanceDaily, GROUP_KEY,
+                GroupAttendanceDaily.objects.filter(date__in=dates, student_group_id__in=group_ids),
+                _group_rows(Attendance.objects.filter(
+                    date__in=dates,
+                    schedule_lesson__daily_schedule__student_group_id__in=group_ids,
+                )),
+            )
+
+
+def lesson_group_ids(lesson_ids):
+    """Классы уроков одним запросом"""
+    return set(
+        ScheduleLesson.objects.filter(
+            id__in=set(lesson_ids)
+        ).values_list('daily_schedule__student_group_id', flat=True)
+    )
+
+
+def rebuild_attendance_rollups():
+    """
+    Пересобирает обе дневные сводки из таблицы посещаемости в одной
+    транзакции. Возвращает (строк по ученикам, строк по классам).
+    """
+    created = []
+    with transaction.atomic():
+        for model, rows in (
+            (AttendanceDaily, _student_rows(Attendance.objects.all())),
+            (GroupAttendanceDaily, _group_rows(Attendance.objects.all())),
+        ):
+            model.objects.all().delete()
+            count = 0
+            batch = []
+            for row in rows.iterator():
+                batch.append(model(**row))
+                if len(batch) >= REBUILD_BATCH_SIZE:
+                    count += len(model.objects.bulk_create(batch))
+                    batch = []
+            if batch:
+                count += len(model.objects.bulk_create(batch))
+            created.append(count)
+    return tuple(created)
+
+
+def rollup_totals():
+    """Аннотации для суммирования сводок: present_count, absent_count, late_count"""
+    return {
+        f'{field}_count': Sum(field) for field in STATUS_COUNTERS.values()
+    }
+
+
+def rollup_stats(row):
+    """
+    Статистика в формате отчетов посещаемости по строке rollup_totals():
+    {'total', 'present', 'absent', 'late', 'present_percentage'}.
+    """
+    present = (row or {}).get('present_count') or 0
+    absent = (row or {}).get('absent_count') or 0
+    late = (row or {}).get('late_count') or 0
+    total = present + absent + late
+    return {
+        'total': total,
+        'present': present,
+        'absent': absent,
+        'late': late,
+        'present_percentage': round((present / total) * 100, 1) if total else 0,
+    }
@@ -0,0 +1,358 @@
+"""
+Запись журнала аудита без задержки запросов.
+
+События складываются в ограниченную очередь процесса, фоновый поток
+пишет их в AuditLog пакетами через bulk_create - каждые AUDIT_BATCH_SIZE
+событий или раз в AUDIT_FLUSH_INTERVAL_MS миллисекунд. Если база
+недоступна, пакет дописывается в файл AUDIT_SPILL_PATH и загружается
+после следующей успешной записи. События, которые база отвергает
+(нарушение ограничений, неверные данные), пишутся по одному, а
+отвергнутые откладываются в AUDIT_SPILL_PATH.rejected, чтобы одна
+плохая запись не задерживала остальные.
+"""
+import atexit
+import contextvars
+import glob
+import ipaddress
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, DataError, IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+logger = logging.getLogger(__name__)
+
+AUDIT_ENABLED = getattr(settings, 'AUDIT_ENABLED', True)
+AUDIT_BATCH_SIZE = getattr(settings, 'AUDIT_BATCH_SIZE', 200)
+AUDIT_FLUSH_INTERVAL_MS = getattr(settings, 'AUDIT_FLUSH_INTERVAL_MS', 500)
+AUDIT_QUEUE_SIZE = getattr(settings, 'AUDIT_QUEUE_SIZE', 10000)
+AUDIT_SPILL_PATH = getattr(
+    settings, 'AUDIT_SPILL_PATH', os.path.join(settings.BASE_DIR, 'audit_spill.jsonl')
+)
+
+# Ошибки отдельного события: база его отвергла или его не разобрать
+REJECTED_EVENT_ERRORS = (IntegrityError, DataError, TypeError, ValueError, KeyError)
+
+# Поля, которые не попадают в журнал
+EXCLUDED_FIELDS = {'password', 'last_login'}
+
+_STOP = object()
+
+# Текущий запрос - ставится AuditContextMiddleware
+_current_request = contextvars.ContextVar('audit_request', default=None)
+
+
+def bind_request(request):
+    return _current_request.set(request)
+
+
+def unbind_request(token):
+    _current_request.reset(token)
+
+
+def _client_ip(request):
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    ip = forwarded.split(',')[0].strip() if forwarded else request.META.get('REMOTE_ADDR')
+    try:
+        return str(ipaddress.ip_address(ip)) if ip else None
+    except ValueError:
+        return None
+
+
+def _request_context(user=None):
+    request = _current_request.get()
+    if request is None:
+        return {'user_id': user.pk if user else None, 'is_system_action': True}
+
+    if user is None:
+        request_user = getattr(request, 'user', None)
+        if request_user is not None and request_user.is_authenticated:
+            user = request_user
+    return {
+        'user_id': user.pk if user else None,
+        'ip_address': _client_ip(request),
+        'user_agent': request.META.get('HTTP_USER_AGENT', ''),
+        'request_path': request.path[:500],
+        'request_method': request.method,
+        'is_system_action': False,
+    }
+
+
+class AuditJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder, который остальное (файлы и т.п.) пишет строкой"""
+
+    def default(self, o):
+        try:
+            return super().default(o)
+        except TypeError:
+            return str(o)
+
+
+def json_safe(values):
+    """Значения полей в виде, пригодном для JSONField (даты, Decimal -> строки)"""
+    if values is None:
+        return None
+    return json.loads(json.dumps(values, cls=AuditJSONEncoder))
+
+
+def instance_values(instance):
+    """Значения полей экземпляра без служебных (пароль, последний вход)"""
+    return {
+        field.attname: field.value_from_object(instance)
+        for field in instance._meta.concrete_fields
+        if field.name not in EXCLUDED_FIELDS
+    }
+
+
+def changed_values(instance, old_row):
+    """
+    Изменившиеся поля: (старые, новые) или (None, None), если изменений нет.
+    Новые значения приводятся к типу поля, чтобы '5' и Decimal('5.0') не
+    считались изменением.
+    """
+    old_values, new_values = {}, {}
+    for field in instance._meta.concrete_fields:
+        if field.name in EXCLUDED_FIELDS or field.attname not in old_row:
+            continue
+        value = field.value_from_object(instance)
+        try:
+            value = field.to_python(value)
+        except ValidationError:
+            pass
+        if value != old_row[field.attname]:
+            old_values[field.attname] = old_row[field.attname]
+            new_values[field.attname] = value
+    if not new_values:
+        return None, None
+    return old_values, new_values
+
+
+def record(action, model_name, object_id=None, old_values=None, new_values=None, user=None):
+    """
+    Ставит событие аудита в очередь после фиксации текущей транзакции.
+    Пользователь, IP и путь берутся из текущего запроса. Сама запись в
+    базу идет в фоновом потоке.
+    """
+    if not AUDIT_ENABLED:
+        return
+    event = {
+        'action': action,
+        'model_name': model_name,
+        'object_id': str(object_id) if object_id is not None else None,
+        'old_values': json_safe(old_values),
+        'new_values': json_safe(new_values),
+        'timestamp': timezone.now(),
+        **_request_context(user),
+    }
+    transaction.on_commit(partial(writer.submit, event))
+
+
+class AuditWriter:
+    """Очередь событий и фоновый поток, пишущий их пакетами"""
+
+    def __init__(self, batch_size, flush_interval, queue_size, spill_path):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.spill_path = spill_path
+        self.rejected_path = f'{spill_path}.rejected'
+        self.queue = queue.Queue(queue_size)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+
+    def submit(self, event):
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Поток не успевает - событие не теряем, но и запрос не ждет
+            self._spill([event])
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # После fork очередь родителя непригодна
+                self.queue = queue.Queue(self.queue_size)
+                self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self._recover()
+        if os.path.exists(self.spill_path):
+            self._replay()
+        while True:
+            event = self.queue.get()
+            if event is _STOP:
+                return
+            batch = [event]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval / 1000
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    event = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    stop = True
+                    break
+                batch.append(event)
+            self._write(batch)
+            if stop:
+                return
+
+    def _insert(self, events):
+        """
+        Пишет события в AuditLog. Возвращает события, не записанные из-за
+        недоступности базы. Если база отвергла пакет, события пишутся по
+        одному, а отвергнутые откладываются в rejected_path.
+        """
+        from .models import AuditLog
+
+        try:
+            AuditLog.objects.bulk_create(
+                [AuditLog(**event) for event in events], batch_size=self.batch_size
+            )
+            return []
+        except REJECTED_EVENT_ERRORS:
+            pass
+        except DatabaseError:
+            logger.exception('Журнал аудита: база недоступна')
+            # Следующая попытка откроет новое соединение
+            connection.close()
+            return events
+
+        rejected = []
+        for index, event in enumerate(events):
+            try:
+                with transaction.atomic():
+                    AuditLog.objects.create(**event)
+            except REJECTED_EVENT_ERRORS:
+                logger.exception('Журнал аудита: событие отвергнуто и отложено в %s', self.rejected_path)
+                rejected.append(json.dumps(event, cls=AuditJSONEncoder, ensure_ascii=False))
+            except DatabaseError:
+                logger.exception('Журнал аудита: база недоступна')
+                connection.close()
+                self._append(self.rejected_path, rejected)
+                return events[index:]
+        self._append(self.rejected_path, rejected)
+        return []
+
+    def _write(self, batch):
+        unwritten = self._insert(batch)
+        if unwritten:
+            logger.error('Журнал аудита: %s событий сохранено в файл', len(unwritten))
+            self._spill(unwritten)
+            return
+        if os.path.exists(self.spill_path):
+            self._replay()
+
+    def _append(self, path, lines):
+        if not lines:
+            return
+        with self._spill_lock:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as out:
+                for line in lines:
+                    out.write(line + '\n')
+
+    def _spill(self, events):
+        self._append(self.spill_path, [
+            json.dumps(event, cls=AuditJSONEncoder, ensure_ascii=False) for event in events
+        ])
+
+    def _replay_path(self, pid):
+        return f'{self.spill_path}.{pid}.replay'
+
+    def _replay(self):
+        """Загружает в базу события, сохраненные в файл, пока она была недоступна"""
+        replay_path = self._replay_path(os.getpid())
+        try:
+            # Файл забирает один процесс, остальные продолжают дописывать новый
+            os.replace(self.spill_path, replay_path)
+        except FileNotFoundError:
+            return
+        self._load(replay_path)
+
+    def _recover(self):
+        """
+        Загружает файлы .replay, брошенные процессами, которые завершились
+        посреди загрузки (между переименованием файла и его удалением)
+        """
+        own_path = self._replay_path(os.getpid())
+        if os.path.exists(own_path):
+            # Остался от прежнего процесса с тем же pid или упавшего потока
+            self._load(own_path)
+        for path in glob.glob(glob.escape(self.spill_path) + '.*.replay'):
+            pid = path[len(self.spill_path) + 1:-len('.replay')]
+            if not pid.isdigit() or int(pid) == os.getpid() or _process_alive(int(pid)):
+                continue
+            try:
+                # Переименование забирает файл у других процессов
+                os.replace(path, own_path)
+            except FileNotFoundError:
+                continue
+            self._load(own_path)
+
+    def _load(self, replay_path):
+        """Пишет события из файла .replay; недописанное возвращается в AUDIT_SPILL_PATH"""
+        events, broken = [], []
+        with open(replay_path, encoding='utf-8') as spill:
+            for line in spill:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                    event['timestamp'] = parse_datetime(event['timestamp'])
+                except REJECTED_EVENT_ERRORS:
+                    # Строка, оборванная при падении процесса
+                    broken.append(line.rstrip('\n'))
+                    continue
+                events.append(event)
+        self._append(self.rejected_path, broken)
+
+        unwritten = self._insert(events)
+        if unwritten:
+            logger.error('Журнал аудита: не удалось загрузить события из файла')
+            self._spill(unwritten)
+        os.remove(replay_path)
+
+    def stop(self, timeout=5):
+        """Дописывает очередь и останавливает поток (при завершении процесса)"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+writer = AuditWriter(AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL_MS, AUDIT_QUEUE_SIZE, AUDIT_SPILL_PATH)
+atexit.register(writer.stop)
@@ -0,0 +1,133 @@
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, Max
+
+from .models import AuditLog, AuditLogFacet
+
+
+# Как часто refresh_audit_facets --loop досчитывает новые записи, секунд
+AUDIT_FACETS_REFRESH_SECONDS = getattr(settings, 'AUDIT_FACETS_REFRESH_SECONDS', 60)
+
+# Сколько ждать транзакции, которые сейчас пишут в журнал
+SETTLE_LOCK_TIMEOUT = '2s'
+
+# Срез -> поле журнала
+FACET_FIELDS = {
+    AuditLogFacet.Kind.ACTION: 'action',
+    AuditLogFacet.Kind.MODEL: 'model_name',
+    AuditLogFacet.Kind.USER: 'user_id',
+}
+
+
+def _counts(logs):
+    """{(срез, значение): число записей} тремя сгруппированными запросами"""
+    counts = {}
+    for kind, field in FACET_FIELDS.items():
+        for row in logs.filter(**{f'{field}__isnull': False}).order_by().values(field).annotate(
+            count=Count('pk')
+        ):
+            counts[(kind, str(row[field]))] = row['count']
+    return counts
+
+
+def _apply(counts, sign=1):
+    """Прибавляет (sign=-1 - вычитает) счетчики; обнулившиеся строки удаляются"""
+    if not counts:
+        return
+    facets = {
+        (facet.kind, facet.value): facet
+        for facet in AuditLogFacet.objects.exclude(kind=AuditLogFacet.Kind.WATERMARK)
+    }
+    changed = []
+    for (kind, value), count in counts.items():
+        facet = facets.get((kind, value)) or AuditLogFacet(kind=kind, value=value, count=0)
+        facet.count += sign * count
+        changed.append(facet)
+
+    AuditLogFacet.objects.bulk_create(
+        changed,
+        update_conflicts=True,
+        unique_fields=['kind', 'value'],
+        update_fields=['count'],
+    )
+    AuditLogFacet.objects.exclude(kind=AuditLogFacet.Kind.WATERMARK).filter(count__lte=0).delete()
+
+
+def _lock_watermark():
+    """Строка с id последней учтенной записи; блокирует параллельные обновления"""
+    watermark, _ = AuditLogFacet.objects.select_for_update().get_or_create(
+        kind=AuditLogFacet.Kind.WATERMARK, value='id',
+    )
+    return watermark
+
+
+def settled_last_id():
+    """
+    Последний id журнала, меньше которого записей уже не появится, или
+    None, если пишущие транзакции не закончились за SETTLE_LOCK_TIMEOUT.
+
+    Id выдается при вставке, а запись видна после фиксации, поэтому
+    запись с меньшим id может появиться позже. Блокировка SHARE дожидается
+    транзакций, которые сейчас пишут в журнал, и не пускает новые, пока
+    читается Max(id). Вызывать вне транзакции - иначе блокировка
+    продержится до ее конца.
+    """
+    table = connection.ops.quote_name(AuditLog._meta.db_table)
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT set_config('lock_timeout', %s, true)", [SETTLE_LOCK_TIMEOUT])
+                cursor.execute(f'LOCK TABLE {table} IN SHARE MODE')
+            return AuditLog.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    except OperationalError:
+        return None
+
+
+def refresh_audit_facets(full=False):
+    """
+    Досчитывает записи журнала, появившиеся после прошлого обновления
+    (по id - быстро при любом размере журнала). full=True пересчитывает
+    счетчики по всему журналу. Возвращает False, если обновление отложено
+    из-за долгой пишущей транзакции.
+    """
+    last_id = settled_last_id()
+    if last_id is None:
+        return False
+
+    with transaction.atomic():
+        watermark = _lock_watermark()
+
+        if full:
+            AuditLogFacet.objects.exclude(kind=AuditLogFacet.Kind.WATERMARK).delete()
+            logs = AuditLog.objects.filter(id__lte=last_id)
+        else:
+            logs = AuditLog.objects.filter(id__gt=watermark.count, id__lte=last_id)
+
+        if full or last_id > watermark.count:
+            _apply(_counts(logs))
+            watermark.count = last_id
+            watermark.save(update_fields=['count'])
+    return True
+
+
+def subtract_audit_facets(logs):
+    """
+    Вычитает из счетчиков записи, которые сейчас будут удалены. Вызывать
+    в той же транзакции, что и удаление.
+    """
+    watermark = _lock_watermark()
+    _apply(_counts(logs.filter(id__lte=watermark.count)), sign=-1)
+
+
+def get_audit_facets():
+    """
+    Счетчики журнала: {'action': [(значение, число)], 'model': ..., 'user': ...},
+    по убыванию числа. Только читает сохраненные счетчики - их досчитывает
+    refresh_audit_facets, которому нужна блокировка журнала.
+    """
+    facets = {kind: [] for kind in FACET_FIELDS}
+    for kind, value, count in AuditLogFacet.objects.exclude(
+        kind=AuditLogFacet.Kind.WATERMARK
+    ).order_by('-count', 'value').values_list('kind', 'value', 'count'):
+        facets[kind].append((value, count))
+    return facets
@@ -0,0 +1,180 @@
+"""
+Очистка журнала аудита пакетами.
+
+Записи старше срока удаляются диапазонами id по AUDIT_PURGE_BATCH_SIZE,
+каждый диапазон - в своей короткой транзакции, с паузой между пакетами:
+таблица не блокируется надолго, запись новых событий не ждет. Перед
+удалением пакет может выгружаться в BACKUP_DIR/audit_archive в виде
+NDJSON.gz (каждый пакет - отдельный gzip-член того же файла).
+
+Докуда дошла очистка, хранит AuditPurgeJob: прерванное задание
+продолжается с последнего зафиксированного пакета, недописанный хвост
+архива при этом обрезается.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .audit import AuditJSONEncoder
+from .audit_facets import subtract_audit_facets
+from .models import AuditLog, AuditPurgeJob
+
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней хранить журнал; None - не удалять по расписанию
+AUDIT_RETENTION_DAYS = getattr(settings, 'AUDIT_RETENTION_DAYS', None)
+AUDIT_PURGE_BATCH_SIZE = getattr(settings, 'AUDIT_PURGE_BATCH_SIZE', 5000)
+AUDIT_PURGE_PAUSE_MS = getattr(settings, 'AUDIT_PURGE_PAUSE_MS', 100)
+AUDIT_PURGE_ARCHIVE = getattr(settings, 'AUDIT_PURGE_ARCHIVE', True)
+ARCHIVE_DIR = os.path.join(settings.BACKUP_DIR, 'audit_archive')
+
+# Задание, которое столько времени не продвигалось, считается прерванным
+STALE_AFTER = timedelta(minutes=5)
+
+UNFINISHED = [AuditPurgeJob.Status.RUNNING, AuditPurgeJob.Status.FAILED]
+
+
+def unfinished_job():
+    """Последнее незавершенное (выполняется, прервано или с ошибкой) задание"""
+    return AuditPurgeJob.objects.filter(status__in=UNFINISHED).order_by('-created_at').first()
+
+
+def is_active(job):
+    """Задание сейчас кем-то выполняется (недавно продвигалось)"""
+    return job.status == AuditPurgeJob.Status.RUNNING and job.updated_at > timezone.now() - STALE_AFTER
+
+
+def start_purge(cutoff, archive=AUDIT_PURGE_ARCHIVE, user=None):
+    """
+    Задание на очистку записей старше cutoff. Если есть незавершенное -
+    возвращается оно (со своим сроком), чтобы очистка продолжилась с места
+    остановки, а не началась заново; второе незавершенное задание не дает
+    создать ограничение audit_purge_one_unfinished. Возвращает (задание,
+    продолжено ли).
+    """
+    job = unfinished_job()
+    if job:
+        if job.status == AuditPurgeJob.Status.FAILED:
+            job.status = AuditPurgeJob.Status.RUNNING
+            job.error = ''
+            job.save(update_fields=['status', 'error', 'updated_at'])
+        return job, True
+
+    bounds = AuditLog.objects.filter(timestamp__lt=cutoff).aggregate(
+        first_id=Min('id'), max_id=Max('id'),
+    )
+    job = AuditPurgeJob(cutoff=cutoff, created_by=user)
+    if bounds['max_id'] is None:
+        job.status = AuditPurgeJob.Status.DONE
+        job.finished_at = timezone.now()
+        job.save()
+        return job, False
+
+    job.first_id = job.last_id = bounds['first_id'] - 1
+    job.max_id = bounds['max_id']
+    try:
+        with transaction.atomic():
+            job.save()
+            if archive:
+                job.archive_path = os.path.join(ARCHIVE_DIR, f'audit_{job.pk}_{cutoff:%Y%m%d}.ndjson.gz')
+                job.save(update_fields=['archive_path'])
+    except IntegrityError:
+        # Параллельный запрос (повторный клик) уже создал задание
+        return unfinished_job(), True
+    return job, False
+
+
+def _export(job, logs):
+    """
+    Дописывает пакет в архив задания отдельным gzip-членом и возвращает
+    новый размер файла. Все, что дальше archive_size, осталось от пакета,
+    который не был зафиксирован, и перезаписывается.
+    """
+    os.makedirs(os.path.dirname(job.archive_path), exist_ok=True)
+    with open(job.archive_path, 'ab') as raw:
+        raw.truncate(job.archive_size)
+        raw.seek(job.archive_size)
+        with gzip.GzipFile(fileobj=raw, mode='wb') as archive:
+            for row in logs.order_by('id').values().iterator():
+                line = json.dumps(row, cls=AuditJSONEncoder, ensure_ascii=False) + '\n'
+                archive.write(line.encode())
+        raw.flush()
+        os.fsync(raw.fileno())
+        return raw.tell()
+
+
+def purge_batch(job, batch_size=AUDIT_PURGE_BATCH_SIZE):
+    """
+    Удаляет (и архивирует) следующий диапазон id задания в одной
+    транзакции. Строка задания блокируется, поэтому два исполнителя одного
+    задания не обработают диапазон дважды. Возвращает обновленное задание.
+    """
+    with transaction.atomic():
+        job = AuditPurgeJob.objects.select_for_update().get(pk=job.pk)
+        if job.status != AuditPurgeJob.Status.RUNNING:
+            return job
+
+        upper = min(job.last_id + batch_size, job.max_id)
+        logs = AuditLog.objects.filter(
+            id__gt=job.last_id, id__lte=upper, timestamp__lt=job.cutoff,
+        )
+        if job.archive_path:
+            job.archive_size = _export(job, logs)
+        subtract_audit_facets(logs)
+        deleted, _ = logs.delete()
+
+        job.last_id = upper
+        job.deleted += deleted
+        if upper >= job.max_id:
+            job.status = AuditPurgeJob.Status.DONE
+            job.finished_at = timezone.now()
+        job.save()
+    return job
+
+
+def run_purge(job, batch_size=AUDIT_PURGE_BATCH_SIZE, pause_ms=AUDIT_PURGE_PAUSE_MS, progress=None):
+    """
+    Выполняет задание до конца. progress(job) вызывается после каждого
+    пакета. При ошибке задание помечается FAILED и может быть продолжено.
+    """
+    try:
+        while job.status == AuditPurgeJob.Status.RUNNING:
+            job = purge_batch(job, batch_size)
+            if progress:
+                progress(job)
+            if job.status == AuditPurgeJob.Status.RUNNING and pause_ms:
+                time.sleep(pause_ms / 1000)
+    except Exception as exc:
+        AuditPurgeJob.objects.filter(pk=job.pk).update(
+            status=AuditPurgeJob.Status.FAILED, error=str(exc), updated_at=timezone.now(),
+        )
+        raise
+    return job
+
+
+def _run_in_background(job):
+    try:
+        run_purge(job)
+    except Exception:
+        logger.exception('Очистка журнала аудита #%s прервана', job.pk)
+    finally:
+        connection.close()
+
+
+def run_purge_in_background(job):
+    """Выполняет задание в фоновом потоке, не задерживая запрос"""
+    thread = threading.Thread(
+        target=_run_in_background, args=(job,), name=f'audit-purge-{job.pk}', daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,154 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Max, Min, Q, Sum, When
+from django.db.models.functions import Greatest, Least, TruncMonth
+
+from .models import Grade, GradeSummary
+
+
+# Поля распределения по округленной оценке
+BUCKETS = {5: 'count_5', 4: 'count_4', 3: 'count_3', 2: 'count_2'}
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def period_for(day):
+    """Период сводки - первое число месяца"""
+    return day.replace(day=1)
+
+
+def bucket_for(value):
+    """Поле распределения для оценки: округление 4.5 -> 5, все ниже 2.5 - в 2"""
+    rounded = int(Decimal(value).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    return BUCKETS[min(max(rounded, 2), 5)]
+
+
+def summary_key(student_id, subject_id, grade_type, day):
+    return {
+        'student_id': student_id,
+        'subject_id': subject_id,
+        'grade_type': grade_type,
+        'period': period_for(day),
+    }
+
+
+def add_grade(key, value):
+    """Учитывает оценку в сводке: UPDATE с F(), при отсутствии строки - INSERT"""
+    value = Decimal(value)
+    bucket = bucket_for(value)
+    summaries = GradeSummary.objects.filter(**key)
+    changes = {
+        'count': F('count') + 1,
+        'total': F('total') + value,
+        'min_value': Least('min_value', value),
+        'max_value': Greatest('max_value', value),
+        bucket: F(bucket) + 1,
+    }
+
+    if summaries.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            GradeSummary.objects.create(
+                count=1, total=value, min_value=value, max_value=value, **{bucket: 1}, **key
+            )
+    except IntegrityError:
+        # Строку успела создать параллельная транзакция
+        summaries.update(**changes)
+
+
+def remove_grade(key, value):
+    """
+    Убирает оценку из сводки. Минимум и максимум пересчитываются по оценкам
+    ключа, только если удаленная оценка была крайней.
+    """
+    value = Decimal(value)
+    bucket = bucket_for(value)
+    summaries = GradeSummary.objects.filter(**key)
+    summaries.update(
+        count=F('count') - 1,
+        total=F('total') - value,
+        **{bucket: F(bucket) - 1},
+    )
+
+    summary = summaries.values('count', 'min_value', 'max_value').first()
+    if summary is None:
+        return
+    if summary['count'] <= 0:
+        summaries.delete()
+    elif value in (summary['min_value'], summary['max_value']):
+        period = key['period']
+        limits = Grade.objects.filter(
+            student_id=key['student_id'],
+            subject_id=key['subject_id'],
+            grade_type=key['grade_type'],
+            date__gte=period,
+            date__lt=_next_period(period),
+        ).aggregate(min_value=Min('value'), max_value=Max('value'))
+        summaries.update(**limits)
+
+
+def _next_period(period):
+    if period.month == 12:
+        return period.replace(year=period.year + 1, month=1)
+    return period.replace(month=period.month + 1)
+
+
+def rebuild_grade_summaries():
+    """
+    Пересобирает все сводки из таблицы оценок одним сгруппированным
+    запросом. Выполняется в транзакции - читатели видят либо старые,
+    либо новые сводки. Возвращает число созданных строк.
+    """
+    rows = Grade.objects.order_by().values(
+        'student_id', 'subject_id', 'grade_type', period=TruncMonth('date'),
+    ).annotate(
+        count=Count('id'),
+        total=Sum('value'),
+        min_value=Min('value'),
+        max_value=Max('value'),
+        count_5=Count(Case(When(value__gte=Decimal('4.5'), then=1))),
+        count_4=Count(Case(When(Q(value__gte=Decimal('3.5'), value__lt=Decimal('4.5')), then=1))),
+        count_3=Count(Case(When(Q(value__gte=Decimal('2.5'), value__lt=Decimal('3.5')), then=1))),
+        count_2=Count(Case(When(value__lt=Decimal('2.5'), then=1))),
+    )
+
+    created = 0
+    with transaction.atomic():
+        GradeSummary.objects.all().delete()
+        batch = []
+        for row in rows.iterator():
+            batch.append(GradeSummary(**row))
+            if len(batch) >= REBUILD_BATCH_SIZE:
+                created += len(GradeSummary.objects.bulk_create(batch))
+                batch = []
+        if batch:
+            created += len(GradeSummary.objects.bulk_create(batch))
+    return created
+
+
+def summary_aggregates():
+    """
+    Аннотации для суммирования сводок: grades_count, grades_sum и
+    grades_5..grades_2. Средний балл - см. summary_average.
+    """
+    return {
+        'grades_count': Sum('count'),
+        'grades_sum': Sum('total'),
+        **{f'grades_{value}': Sum(field) for value, field in BUCKETS.items()},
+    }
+
+
+def summary_average(row, digits=1):
+    """Средний балл по строке summary_aggregates() или 0"""
+    if not row or not row.get('grades_count'):
+        return 0
+    return round(row['grades_sum'] / row['grades_count'], digits)
+
+
+def summary_histogram(row):
+    """Распределение {оценка: число} по строке summary_aggregates() без нулей"""
+    if not row:
+        return {}
+    return {value: row[f'grades_{value}'] for value in BUCKETS if row.get(f'grades_{value}')}
@@ -0,0 +1,134 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.models import Attendance, Grade, Homework
+
+
+def _grade_sample():
+    return Grade.objects.order_by().values(
+        'student_id', 'subject_id', 'teacher_id', 'grade_type', 'value', 'date'
+    ).first()
+
+
+def _attendance_sample():
+    return Attendance.objects.order_by().values('student_id', 'schedule_lesson_id', 'date').first()
+
+
+def _homework_sample():
+    return Homework.objects.order_by().values('student_group_id', 'due_date').first()
+
+
+# (название, ожидаемый индекс, образец строки, запрос по образцу) -
+# те же фильтры, что в журнале, дневнике и кабинете учителя
+PLAN_CASES = [
+    (
+        'Оценки ученика по предмету за период',
+        'api_grade_stud_subj_date_idx',
+        _grade_sample,
+        lambda row: Grade.objects.filter(
+            student_id=row['student_id'],
+            subject_id=row['subject_id'],
+            date__range=[row['date'] - timedelta(days=30), row['date']],
+        ).order_by('date'),
+    ),
+    (
+        'Оценки учителя за день',
+        'api_grade_teacher_date_idx',
+        _grade_sample,
+        lambda row: Grade.objects.filter(teacher_id=row['teacher_id'], date=row['date']),
+    ),
+    (
+        'Оценки предмета по типу',
+        'api_grade_subj_type_idx',
+        _grade_sample,
+        lambda row: Grade.objects.filter(subject_id=row['subject_id'], grade_type=row['grade_type']),
+    ),
+    (
+        'Посещаемость ученика за месяц',
+        'api_att_student_date_idx',
+        _attendance_sample,
+        lambda row: Attendance.objects.filter(
+            student_id=row['student_id'],
+            date__gte=row['date'] - timedelta(days=30),
+            date__lt=row['date'] + timedelta(days=1),
+        ),
+    ),
+    (
+        'Отметки по уроку за день',
+        'api_att_lesson_date_idx',
+        _attendance_sample,
+        lambda row: Attendance.objects.filter(
+            schedule_lesson_id=row['schedule_lesson_id'], date=row['date']
+        ),
+    ),
+    (
+        'Задания класса по сроку сдачи',
+        'api_hw_group_due_idx',
+        _homework_sample,
+        lambda row: Homework.objects.filter(
+            student_group_id=row['student_group_id'], due_date__gte=row['due_date']
+        ).order_by('due_date'),
+    ),
+]
+
+
+def _index_names(index_name):
+    """Имя индекса и имена его копий на секциях секционированной таблицы"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [index_name],
+        )
+        return [index_name] + [name for (name,) in cursor.fetchall()]
+
+
+def plan_uses_index(plan, index_name):
+    """Читает ли план запроса таблицу через индекс или его копию на секции"""
+    return any(name in plan for name in _index_names(index_name))
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет планы основных запросов к оценкам, посещаемости и заданиям: '
+        'каждый должен читать таблицу через свой индекс (только PostgreSQL)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--disable-seqscan',
+            action='store_true',
+            help='Запретить планировщику полный просмотр таблиц (для маленьких баз, '
+                 'где он дешевле индекса) - проверяет, что индекс вообще применим',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Проверка планов запросов поддерживается только для PostgreSQL')
+
+        failures = []
+        for title, index_name, sample, build in PLAN_CASES:
+            row = sample()
+            if row is None:
+                self.stdout.write(self.style.WARNING(f'{title}: нет данных, пропущено'))
+                continue
+
+            with transaction.atomic():
+                if options['disable_seqscan']:
+                    with connection.cursor() as cursor:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = build(row).explain()
+
+            used = plan_uses_index(plan, index_name)
+            if used:
+                self.stdout.write(self.style.SUCCESS(f'{title}: {index_name}'))
+            else:
+                failures.append(title)
+                self.stdout.write(self.style.ERROR(f'{title}: не используется {index_name}'))
+            if options['verbosity'] > 1 or not used:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f'Запросы без ожидаемого индекса: {len(failures)}')
@@ -0,0 +1,89 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.partitioning import (
+    PARTITIONED_TABLES, detach_partitions, ensure_partitions, is_partitioned,
+    partition_table, unpartition_table,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Обслуживает секции посещаемости и журнала аудита: создает секции '
+        'на будущие периоды, отключает и архивирует старые (только PostgreSQL)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--table',
+            choices=sorted(PARTITIONED_TABLES),
+            help='Обработать только эту таблицу',
+        )
+        parser.add_argument(
+            '--ahead',
+            type=int,
+            help='Сколько будущих периодов создать (по умолчанию DB_PARTITIONS_AHEAD)',
+        )
+        parser.add_argument(
+            '--detach-before',
+            metavar='ГГГГ-ММ-ДД',
+            help='Отключить секции, период которых закончился до этой даты',
+        )
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='Удалять отключенные секции вместо переноса в архивную схему',
+        )
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument(
+            '--convert',
+            action='store_true',
+            help='Перевести обычные таблицы в секционированные',
+        )
+        mode.add_argument(
+            '--revert',
+            action='store_true',
+            help='Собрать секционированные таблицы обратно в обычные',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Секционирование поддерживается только для PostgreSQL')
+
+        before = None
+        if options['detach_before']:
+            try:
+                before = datetime.strptime(options['detach_before'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Дата --detach-before должна быть в формате ГГГГ-ММ-ДД')
+
+        tables = [options['table']] if options['table'] else list(PARTITIONED_TABLES)
+        for table in tables:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    partitioned = is_partitioned(cursor, table)
+
+                if options['revert']:
+                    if partitioned:
+                        unpartition_table(connection, table)
+                        self.stdout.write(self.style.SUCCESS(f'{table}: секции собраны в обычную таблицу'))
+                    continue
+
+                if not partitioned:
+                    if not options['convert']:
+                        self.stdout.write(self.style.WARNING(
+                            f'{table}: таблица не секционирована, пропущено (см. --convert)'
+                        ))
+                        continue
+                    partition_table(connection, table, ahead=options['ahead'])
+                    self.stdout.write(self.style.SUCCESS(f'{table}: таблица секционирована'))
+
+                for name in ensure_partitions(connection, table, ahead=options['ahead']):
+                    self.stdout.write(f'{table}: создана секция {name}')
+
+                if before:
+                    for name in detach_partitions(connection, table, before, drop=options['drop']):
+                        action = 'удалена' if options['drop'] else 'перенесена в архив'
+                        self.stdout.write(f'{table}: секция {name} отключена и {action}')
@@ -0,0 +1,85 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.audit_purge import (
+    AUDIT_PURGE_ARCHIVE, AUDIT_PURGE_BATCH_SIZE, AUDIT_PURGE_PAUSE_MS, AUDIT_RETENTION_DAYS,
+    is_active, run_purge, start_purge, unfinished_job,
+)
+from api.models import AuditPurgeJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет записи журнала аудита старше срока хранения пакетами, '
+        'с выгрузкой в архив NDJSON.gz; прерванная очистка продолжается '
+        'с места остановки. Для запуска по расписанию задайте AUDIT_RETENTION_DAYS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            help='Удалить записи старше стольких дней (по умолчанию AUDIT_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=AUDIT_PURGE_BATCH_SIZE,
+            help='Размер диапазона id в одном пакете',
+        )
+        parser.add_argument(
+            '--pause',
+            type=int,
+            default=AUDIT_PURGE_PAUSE_MS,
+            help='Пауза между пакетами, мс',
+        )
+        parser.add_argument(
+            '--no-archive',
+            action='store_true',
+            help='Удалять без выгрузки в архив',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Продолжить задание, даже если оно выглядит выполняющимся в другом процессе',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+
+        job = unfinished_job()
+        if job and is_active(job) and not options['force']:
+            raise CommandError(
+                f'Очистка #{job.pk} уже выполняется ({job.progress}%), см. --force'
+            )
+
+        days = options['days'] or AUDIT_RETENTION_DAYS
+        if not job and not days:
+            raise CommandError('Укажите --days или задайте AUDIT_RETENTION_DAYS')
+        if days is not None and days < 1:
+            raise CommandError('Срок хранения должен быть больше нуля')
+
+        cutoff = timezone.now() - timedelta(days=days) if days else None
+        job, resumed = start_purge(
+            cutoff, archive=AUDIT_PURGE_ARCHIVE and not options['no_archive'],
+        )
+        if resumed:
+            self.stdout.write(self.style.WARNING(
+                f'Продолжается очистка #{job.pk} записей до {job.cutoff:%d.%m.%Y %H:%M} '
+                f'с id {job.last_id}'
+            ))
+        if job.status == AuditPurgeJob.Status.DONE:
+            self.stdout.write(self.style.SUCCESS('Записей старше срока нет'))
+            return
+
+        def progress(job):
+            if options['verbosity'] > 0:
+                self.stdout.write(f'{job.progress}%: удалено {job.deleted}, id до {job.last_id}')
+
+        job = run_purge(job, batch_size=options['batch_size'], pause_ms=options['pause'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей: {job.deleted}'))
+        if job.archive_path:
+            self.stdout.write(f'Архив: {job.archive_path} ({job.archive_size} байт)')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.attendance_rollup import rebuild_attendance_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает дневные сводки посещаемости (AttendanceDaily, GroupAttendanceDaily)'
+
+    def handle(self, *args, **options):
+        students, groups = rebuild_attendance_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f'Сводки посещаемости пересобраны: {students} строк по ученикам, {groups} по классам'
+        ))
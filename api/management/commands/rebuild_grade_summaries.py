@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.grade_summary import rebuild_grade_summaries
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает сводки оценок (GradeSummary) из таблицы оценок'
+
+    def handle(self, *args, **options):
+        created = rebuild_grade_summaries()
+        self.stdout.write(self.style.SUCCESS(f'Сводки оценок пересобраны: {created} строк'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.people_search import rebuild_people_search
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковые документы пользователей (PersonSearch)'
+
+    def handle(self, *args, **options):
+        total = rebuild_people_search()
+        self.stdout.write(self.style.SUCCESS(f'Поисковые документы пересобраны: {total}'))
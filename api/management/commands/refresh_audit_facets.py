@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.audit_facets import AUDIT_FACETS_REFRESH_SECONDS, refresh_audit_facets
+
+
+class Command(BaseCommand):
+    help = (
+        'Обновляет счетчики журнала аудита (AuditLogFacet): досчитывает новые '
+        'записи, с --full - пересчитывает по всему журналу. Страница аудита '
+        'сама их не обновляет - команду запускают по расписанию или с --loop'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать счетчики по всему журналу',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Обновлять счетчики постоянно, раз в --interval секунд',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=AUDIT_FACETS_REFRESH_SECONDS,
+            help='Интервал обновления с --loop, с',
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            if not refresh_audit_facets(full=options['full']):
+                raise CommandError('Журнал аудита занят долгой транзакцией, повторите позже')
+            self.stdout.write(self.style.SUCCESS('Счетчики журнала аудита обновлены'))
+            return
+
+        if options['interval'] <= 0:
+            raise CommandError('--interval должен быть больше нуля')
+        full = options['full']
+        try:
+            while True:
+                if refresh_audit_facets(full=full):
+                    full = False
+                else:
+                    self.stderr.write('Журнал аудита занят долгой транзакцией, повтор через --interval')
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Обновление счетчиков остановлено')
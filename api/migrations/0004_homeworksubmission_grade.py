@@ -0,0 +1,50 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def link_existing_grades(apps, schema_editor):
+    """
+    Связывает уже сданные работы с оценками по прежнему правилу:
+    последняя оценка HW ученика по предмету урока, выставленная не раньше
+    даты сдачи.
+    """
+    HomeworkSubmission = apps.get_model('api', 'HomeworkSubmission')
+    Grade = apps.get_model('api', 'Grade')
+
+    used_grade_ids = set()
+    submissions = HomeworkSubmission.objects.select_related(
+        'homework__schedule_lesson'
+    ).order_by('-submitted_at')
+    for submission in submissions.iterator():
+        grade_id = Grade.objects.filter(
+            grade_type='HW',
+            student_id=submission.student_id,
+            subject_id=submission.homework.schedule_lesson.subject_id,
+            date__gte=submission.submitted_at.date(),
+        ).exclude(
+            id__in=used_grade_ids
+        ).order_by('-date', '-id').values_list('id', flat=True).first()
+
+        if grade_id:
+            used_grade_ids.add(grade_id)
+            HomeworkSubmission.objects.filter(pk=submission.pk).update(grade_id=grade_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_auditlog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='homeworksubmission',
+            name='grade',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='homework_submission', to='api.grade', verbose_name='Оценка'),
+        ),
+        migrations.AddIndex(
+            model_name='homeworksubmission',
+            index=models.Index(condition=models.Q(('grade__isnull', True)), fields=['homework'], name='api_hwsub_ungraded_idx'),
+        ),
+        migrations.RunPython(link_existing_grades, migrations.RunPython.noop),
+    ]
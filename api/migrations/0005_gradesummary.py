@@ -0,0 +1,64 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, Max, Min, Q, Sum, When
+from django.db.models.functions import TruncMonth
+
+
+def build_summaries(apps, schema_editor):
+    """Заполняет сводки по уже выставленным оценкам"""
+    Grade = apps.get_model('api', 'Grade')
+    GradeSummary = apps.get_model('api', 'GradeSummary')
+
+    rows = Grade.objects.order_by().values(
+        'student_id', 'subject_id', 'grade_type', period=TruncMonth('date'),
+    ).annotate(
+        count=Count('id'),
+        total=Sum('value'),
+        min_value=Min('value'),
+        max_value=Max('value'),
+        count_5=Count(Case(When(value__gte=4.5, then=1))),
+        count_4=Count(Case(When(Q(value__gte=3.5, value__lt=4.5), then=1))),
+        count_3=Count(Case(When(Q(value__gte=2.5, value__lt=3.5), then=1))),
+        count_2=Count(Case(When(value__lt=2.5, then=1))),
+    )
+    GradeSummary.objects.bulk_create(
+        (GradeSummary(**row) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0004_homeworksubmission_grade'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradeSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grade_type', models.CharField(choices=[('HW', 'Домашняя работа'), ('TEST', 'Контрольная работа'), ('CW', 'Классная работа'), ('EXAM', 'Экзамен'), ('PROJ', 'Проект'), ('ORAL', 'Устный ответ')], max_length=10, verbose_name='Тип оценки')),
+                ('period', models.DateField(verbose_name='Месяц')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество оценок')),
+                ('total', models.DecimalField(decimal_places=1, default=0, max_digits=10, verbose_name='Сумма оценок')),
+                ('min_value', models.DecimalField(decimal_places=1, max_digits=3, null=True, verbose_name='Минимальная оценка')),
+                ('max_value', models.DecimalField(decimal_places=1, max_digits=3, null=True, verbose_name='Максимальная оценка')),
+                ('count_5', models.PositiveIntegerField(default=0, verbose_name='Оценок 5')),
+                ('count_4', models.PositiveIntegerField(default=0, verbose_name='Оценок 4')),
+                ('count_3', models.PositiveIntegerField(default=0, verbose_name='Оценок 3')),
+                ('count_2', models.PositiveIntegerField(default=0, verbose_name='Оценок 2')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grade_summaries', to=settings.AUTH_USER_MODEL, verbose_name='Ученик')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grade_summaries', to='api.subject', verbose_name='Предмет')),
+            ],
+            options={
+                'verbose_name': 'Сводка оценок',
+                'verbose_name_plural': 'Сводки оценок',
+                'indexes': [models.Index(fields=['subject', 'period'], name='api_gradesummary_subj_idx')],
+                'unique_together': {('student', 'subject', 'grade_type', 'period')},
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, F, When
+
+
+def build_rollups(apps, schema_editor):
+    """Заполняет дневные сводки по уже выставленной посещаемости"""
+    Attendance = apps.get_model('api', 'Attendance')
+    AttendanceDaily = apps.get_model('api', 'AttendanceDaily')
+    GroupAttendanceDaily = apps.get_model('api', 'GroupAttendanceDaily')
+
+    counts = {
+        'present': Count(Case(When(status='P', then=1))),
+        'absent': Count(Case(When(status='A', then=1))),
+        'late': Count(Case(When(status='L', then=1))),
+    }
+    student_rows = Attendance.objects.order_by().values(
+        'student_id', 'date', subject_id=F('schedule_lesson__subject_id'),
+    ).annotate(**counts)
+    group_rows = Attendance.objects.order_by().values(
+        'date', student_group_id=F('schedule_lesson__daily_schedule__student_group_id'),
+    ).annotate(**counts)
+
+    AttendanceDaily.objects.bulk_create(
+        (AttendanceDaily(**row) for row in student_rows.iterator()),
+        batch_size=1000,
+    )
+    GroupAttendanceDaily.objects.bulk_create(
+        (GroupAttendanceDaily(**row) for row in group_rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0005_gradesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('present', models.PositiveIntegerField(default=0, verbose_name='Присутствовал')),
+                ('absent', models.PositiveIntegerField(default=0, verbose_name='Отсутствовал')),
+                ('late', models.PositiveIntegerField(default=0, verbose_name='Опоздал')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_days', to=settings.AUTH_USER_MODEL, verbose_name='Ученик')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_days', to='api.subject', verbose_name='Предмет')),
+            ],
+            options={
+                'verbose_name': 'Посещаемость ученика за день',
+                'verbose_name_plural': 'Посещаемость учеников по дням',
+                'unique_together': {('student', 'subject', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='GroupAttendanceDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('present', models.PositiveIntegerField(default=0, verbose_name='Присутствовал')),
+                ('absent', models.PositiveIntegerField(default=0, verbose_name='Отсутствовал')),
+                ('late', models.PositiveIntegerField(default=0, verbose_name='Опоздал')),
+                ('student_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_days', to='api.studentgroup', verbose_name='Учебный класс')),
+            ],
+            options={
+                'verbose_name': 'Посещаемость класса за день',
+                'verbose_name_plural': 'Посещаемость классов по дням',
+                'unique_together': {('student_group', 'date')},
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
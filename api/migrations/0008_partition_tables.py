@@ -0,0 +1,189 @@
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+
+# Копия секционирования из api.partitioning на момент миграции: миграция
+# не должна меняться вместе с текущим кодом
+YEAR = 'year'
+MONTH = 'month'
+
+PARTITIONED_TABLES = {
+    'api_attendance': ('date', YEAR),
+    'api_auditlog': ('timestamp', MONTH),
+}
+
+ACADEMIC_YEAR_START_MONTH = 9
+
+
+def _period_start(interval, day):
+    if interval == YEAR:
+        year = day.year if day.month >= ACADEMIC_YEAR_START_MONTH else day.year - 1
+        return date(year, ACADEMIC_YEAR_START_MONTH, 1)
+    return day.replace(day=1)
+
+
+def _next_period(interval, start):
+    if interval == YEAR:
+        return start.replace(year=start.year + 1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def _partition_name(table, interval, start):
+    if interval == YEAR:
+        return f'{table}_y{start.year}'
+    return f'{table}_m{start.year}_{start.month:02d}'
+
+
+def _bound(column_type, day):
+    if column_type == 'date':
+        return f"'{day.isoformat()}'"
+    midnight = timezone.make_aware(datetime(day.year, day.month, day.day))
+    return f"'{midnight.isoformat()}'"
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date()
+    return value
+
+
+def _is_partitioned(cursor, table):
+    cursor.execute(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+        [table],
+    )
+    return cursor.fetchone()[0]
+
+
+def _rebuild_table(connection, table, partition_by=None, before_copy=None):
+    """
+    Пересоздает таблицу как секционированную (partition_by - столбец) или
+    обычную с теми же данными, индексами, ограничениями и счетчиком id
+    """
+    qn = connection.ops.quote_name
+    old = f'{table}_rebuild'
+    sequence = f'{table}_id_seq'
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i '
+            'WHERE i.indrelid = to_regclass(%s) AND NOT EXISTS '
+            '(SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)',
+            [table],
+        )
+        indexes = [definition for (definition,) in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype IN ('u', 'f') ORDER BY contype DESC",
+            [table],
+        )
+        constraints = cursor.fetchall()
+
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        current_sequence = cursor.fetchone()[0]
+        last_id = 0
+        if current_sequence:
+            cursor.execute(f'SELECT last_value FROM {current_sequence}')
+            last_id = cursor.fetchone()[0]
+        cursor.execute(f'SELECT COALESCE(MAX("id"), 0) FROM {qn(table)}')
+        last_id = max(last_id, cursor.fetchone()[0])
+
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(old)}')
+        partitioning = f' PARTITION BY RANGE ({qn(partition_by)})' if partition_by else ''
+        cursor.execute(
+            f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING CONSTRAINTS){partitioning}'
+        )
+        if before_copy:
+            before_copy(cursor, old)
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(old)}')
+        cursor.execute(f'DROP TABLE {qn(old)}')
+
+        primary_key = ['id'] + ([partition_by] if partition_by else [])
+        cursor.execute(
+            f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + "_pkey")} '
+            f'PRIMARY KEY ({", ".join(qn(column) for column in primary_key)})'
+        )
+        for name, definition in constraints:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+        for definition in indexes:
+            cursor.execute(definition)
+
+        cursor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id')
+        if last_id:
+            cursor.execute('SELECT setval(%s, %s)', [sequence, last_id])
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')"
+        )
+
+
+def _partition_table(connection, table):
+    """Секции на период имеющихся данных, DB_PARTITIONS_AHEAD вперед и по умолчанию"""
+    column, interval = PARTITIONED_TABLES[table]
+    ahead = getattr(settings, 'DB_PARTITIONS_AHEAD', 2)
+    qn = connection.ops.quote_name
+
+    def create_partitions(cursor, old):
+        cursor.execute(
+            'SELECT data_type FROM information_schema.columns '
+            'WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s',
+            [old, column],
+        )
+        column_type = cursor.fetchone()[0]
+        cursor.execute(f'SELECT MIN({qn(column)}), MAX({qn(column)}) FROM {qn(old)}')
+        first, last = (_as_date(value) for value in cursor.fetchone())
+        today = timezone.localdate()
+
+        start = _period_start(interval, min(first or today, today))
+        end = _period_start(interval, max(last or today, today))
+        for _ in range(ahead):
+            end = _next_period(interval, end)
+
+        while start <= end:
+            following = _next_period(interval, start)
+            cursor.execute(
+                f'CREATE TABLE {qn(_partition_name(table, interval, start))} PARTITION OF {qn(table)} '
+                f'FOR VALUES FROM ({_bound(column_type, start)}) TO ({_bound(column_type, following)})'
+            )
+            start = following
+        cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+    _rebuild_table(connection, table, partition_by=column, before_copy=create_partitions)
+
+
+def partition_tables(apps, schema_editor):
+    """Секционирует посещаемость и журнал аудита, если это включено в настройках"""
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql' or not getattr(settings, 'DB_PARTITIONING_ENABLED', False):
+        return
+    for table in PARTITIONED_TABLES:
+        with connection.cursor() as cursor:
+            partitioned = _is_partitioned(cursor, table)
+        if not partitioned:
+            _partition_table(connection, table)
+
+
+def unpartition_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    for table in PARTITIONED_TABLES:
+        with connection.cursor() as cursor:
+            partitioned = _is_partitioned(cursor, table)
+        if partitioned:
+            _rebuild_table(connection, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
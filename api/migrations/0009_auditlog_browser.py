@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_partition_tables'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='auditlog',
+            name='api_auditlo_timesta_da87a7_idx',
+        ),
+        migrations.AddIndex(
+            model_name='auditlog',
+            index=models.Index(fields=['timestamp', 'id'], name='api_auditlog_ts_id_idx'),
+        ),
+        migrations.CreateModel(
+            name='AuditLogFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('action', 'Действие'), ('model', 'Модель'), ('user', 'Пользователь'), ('watermark', 'Последняя учтенная запись')], max_length=20, verbose_name='Срез')),
+                ('value', models.CharField(max_length=150, verbose_name='Значение')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Количество')),
+            ],
+            options={
+                'verbose_name': 'Счетчик журнала аудита',
+                'verbose_name_plural': 'Счетчики журнала аудита',
+                'unique_together': {('kind', 'value')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0009_auditlog_browser'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditPurgeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateTimeField(verbose_name='Удалять записи старше')),
+                ('first_id', models.BigIntegerField(default=0, verbose_name='Первый id')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Обработано до id')),
+                ('max_id', models.BigIntegerField(default=0, verbose_name='Последний id')),
+                ('deleted', models.BigIntegerField(default=0, verbose_name='Удалено записей')),
+                ('archive_path', models.CharField(blank=True, max_length=500, verbose_name='Файл архива')),
+                ('archive_size', models.BigIntegerField(default=0, verbose_name='Размер архива (байт)')),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('done', 'Завершено'), ('failed', 'Ошибка')], default='running', max_length=20, verbose_name='Статус')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='audit_purge_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Запустил')),
+            ],
+            options={
+                'verbose_name': 'Очистка журнала аудита',
+                'verbose_name_plural': 'Очистки журнала аудита',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
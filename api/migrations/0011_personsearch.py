@@ -0,0 +1,103 @@
+import re
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+# Копия сборки документа из api.people_search на момент миграции: миграция
+# не должна меняться вместе с текущим кодом
+BATCH_SIZE = 1000
+
+DOCUMENT_FIELDS = (
+    'pk', 'username', 'first_name', 'last_name', 'email',
+    'student_profile__pk', 'student_profile__patronymic', 'student_profile__phone',
+    'student_profile__student_group_id',
+    'teacher_profile__pk', 'teacher_profile__patronymic', 'teacher_profile__phone',
+)
+
+
+def _normalize(text):
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def _person_row(values):
+    if values['teacher_profile__pk'] or values['in_teacher_group']:
+        role = 'teacher'
+    elif values['student_profile__pk'] or values['in_student_group']:
+        role = 'student'
+    else:
+        role = 'other'
+
+    patronymic = values['student_profile__patronymic'] or values['teacher_profile__patronymic'] or ''
+    name = _normalize(f"{values['last_name']} {values['first_name']} {patronymic}")
+
+    parts = [name, values['username'], values['email']]
+    for phone in (values['student_profile__phone'], values['teacher_profile__phone']):
+        if phone:
+            parts += [phone, re.sub(r'\D', '', phone)]
+
+    return {
+        'user_id': values['pk'],
+        'role': role,
+        'student_group_id': values['student_profile__student_group_id'],
+        'name': name,
+        'document': _normalize(' '.join(part for part in parts if part)),
+    }
+
+
+def build_documents(apps, schema_editor):
+    """Заполняет поисковые документы уже существующих пользователей"""
+    User = apps.get_model('auth', 'User')
+    PersonSearch = apps.get_model('api', 'PersonSearch')
+    through = User.groups.through
+
+    def in_group(name):
+        return models.Exists(through.objects.filter(user_id=models.OuterRef('pk'), group__name=name))
+
+    last_pk = 0
+    while True:
+        rows = list(
+            User.objects.filter(pk__gt=last_pk).order_by('pk').values(
+                *DOCUMENT_FIELDS,
+                in_teacher_group=in_group('teacher'),
+                in_student_group=in_group('student'),
+            )[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        PersonSearch.objects.bulk_create([PersonSearch(**_person_row(row)) for row in rows])
+        last_pk = rows[-1]['pk']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('api', '0010_auditpurgejob'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='PersonSearch',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('role', models.CharField(choices=[('student', 'Ученик'), ('teacher', 'Учитель'), ('other', 'Другое')], default='other', max_length=20, verbose_name='Роль')),
+                ('name', models.CharField(blank=True, max_length=350, verbose_name='ФИО')),
+                ('document', models.TextField(blank=True, verbose_name='Поисковый текст')),
+                ('search_vector', models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.SearchVector('name', config='russian'), output_field=django.contrib.postgres.search.SearchVectorField())),
+                ('student_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.studentgroup', verbose_name='Учебный класс')),
+            ],
+            options={
+                'verbose_name': 'Поисковый документ',
+                'verbose_name_plural': 'Поисковые документы',
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['document'], name='api_person_document_trgm', opclasses=['gin_trgm_ops']), django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='api_person_vector_idx'), models.Index(fields=['role', 'student_group'], name='api_person_role_group_idx')],
+            },
+        ),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0011_personsearch'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='grade',
+            name='api_grade_value_idx',
+        ),
+        # Индексы внешних ключей, которые покрывают составные индексы 0007
+        migrations.AlterField(
+            model_name='grade',
+            name='student',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='grades', to=settings.AUTH_USER_MODEL, verbose_name='Ученик'),
+        ),
+        migrations.AlterField(
+            model_name='grade',
+            name='subject',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='grades', to='api.subject', verbose_name='Предмет'),
+        ),
+        migrations.AlterField(
+            model_name='grade',
+            name='teacher',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='given_grades', to=settings.AUTH_USER_MODEL, verbose_name='Учитель'),
+        ),
+        migrations.AlterField(
+            model_name='attendance',
+            name='student',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='attendances', to=settings.AUTH_USER_MODEL, verbose_name='Ученик'),
+        ),
+        migrations.AlterField(
+            model_name='attendance',
+            name='schedule_lesson',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='attendances', to='api.schedulelesson', verbose_name='Урок'),
+        ),
+        migrations.AlterField(
+            model_name='homework',
+            name='student_group',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='homeworks', to='api.studentgroup', verbose_name='Учебный класс'),
+        ),
+    ]
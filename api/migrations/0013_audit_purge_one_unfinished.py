@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def close_duplicate_jobs(apps, schema_editor):
+    """
+    Из нескольких незавершенных очисток продолжается последняя - остальные
+    закрываются, иначе ограничение не создать
+    """
+    AuditPurgeJob = apps.get_model('api', 'AuditPurgeJob')
+    unfinished = AuditPurgeJob.objects.filter(status__in=['running', 'failed']).order_by('-created_at')
+    latest = unfinished.first()
+    if latest is not None:
+        unfinished.exclude(pk=latest.pk).update(
+            status='done', error=f'Заменено заданием #{latest.pk}',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_drop_redundant_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='auditpurgejob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['running', 'failed'])), fields=('status',), name='audit_purge_one_unfinished'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 
@@ -62,7 +64,8 @@ class AuditLog(models.Model):
         indexes = [
             models.Index(fields=['user', 'timestamp']),
             models.Index(fields=['model_name', 'action']),
-            models.Index(fields=['timestamp']),
+            # Постраничный просмотр по курсору (timestamp, id)
+            models.Index(fields=['timestamp', 'id'], name='api_auditlog_ts_id_idx'),
         ]
     
     def __str__(self):
@@ -85,6 +88,95 @@ class AuditLog(models.Model):
         return self.get_action_display()
 
 
+class AuditLogFacet(models.Model):
+    """
+    Счетчики записей журнала аудита по действиям, моделям и пользователям -
+    для статистики и фильтров страницы аудита без просмотра всего журнала.
+    Строка WATERMARK хранит id последней учтенной записи.
+    """
+
+    class Kind(models.TextChoices):
+        ACTION = 'action', 'Действие'
+        MODEL = 'model', 'Модель'
+        USER = 'user', 'Пользователь'
+        WATERMARK = 'watermark', 'Последняя учтенная запись'
+
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name="Срез")
+    value = models.CharField(max_length=150, verbose_name="Значение")
+    count = models.BigIntegerField(default=0, verbose_name="Количество")
+
+    class Meta:
+        verbose_name = "Счетчик журнала аудита"
+        verbose_name_plural = "Счетчики журнала аудита"
+        unique_together = ['kind', 'value']
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.value} ({self.count})"
+
+
+class AuditPurgeJob(models.Model):
+    """
+    Очистка журнала аудита старше cutoff пакетами по диапазонам id.
+    Хранит, докуда дошла очистка, - прерванное задание продолжается с
+    last_id. Пакеты перед удалением могут выгружаться в архив NDJSON.gz.
+    """
+
+    class Status(models.TextChoices):
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Завершено'
+        FAILED = 'failed', 'Ошибка'
+
+    cutoff = models.DateTimeField(verbose_name="Удалять записи старше")
+    first_id = models.BigIntegerField(default=0, verbose_name="Первый id")
+    last_id = models.BigIntegerField(default=0, verbose_name="Обработано до id")
+    max_id = models.BigIntegerField(default=0, verbose_name="Последний id")
+    deleted = models.BigIntegerField(default=0, verbose_name="Удалено записей")
+    archive_path = models.CharField(max_length=500, blank=True, verbose_name="Файл архива")
+    archive_size = models.BigIntegerField(default=0, verbose_name="Размер архива (байт)")
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.RUNNING,
+        verbose_name="Статус"
+    )
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='audit_purge_jobs',
+        verbose_name="Запустил"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершено")
+
+    class Meta:
+        verbose_name = "Очистка журнала аудита"
+        verbose_name_plural = "Очистки журнала аудита"
+        ordering = ['-created_at']
+        constraints = [
+            # Незавершенная очистка одна: ее продолжают, а не начинают вторую
+            models.UniqueConstraint(
+                fields=['status'],
+                condition=models.Q(status__in=['running', 'failed']),
+                name='audit_purge_one_unfinished',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Очистка до {self.cutoff:%d.%m.%Y} - {self.get_status_display()}"
+
+    @property
+    def progress(self):
+        """Доля пройденного диапазона id, 0-100"""
+        total = self.max_id - self.first_id
+        if self.status == self.Status.DONE or total <= 0:
+            return 100
+        return min(100, round((self.last_id - self.first_id) * 100 / total))
+
+
 class Subject(models.Model):
     name = models.CharField(max_length=100, unique=True, verbose_name="Название предмета")
     description = models.TextField(blank=True, verbose_name="Описание")
@@ -215,6 +307,61 @@ class TeacherSubject(models.Model):
         return f"{self.teacher.get_full_name()} - {self.subject.name}"
 
 
+class PersonSearch(models.Model):
+    """
+    Поисковый документ пользователя для поиска людей (api/people_search.py):
+    ФИО, логин, email и телефоны одной строкой в нижнем регистре - под
+    GIN-индексом pg_trgm, и tsvector ФИО с русской морфологией.
+    Обновляется сигналами при сохранении пользователя, профиля и групп.
+    """
+
+    class Role(models.TextChoices):
+        STUDENT = 'student', 'Ученик'
+        TEACHER = 'teacher', 'Учитель'
+        OTHER = 'other', 'Другое'
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document',
+        verbose_name="Пользователь"
+    )
+    role = models.CharField(
+        max_length=20,
+        choices=Role.choices,
+        default=Role.OTHER,
+        verbose_name="Роль"
+    )
+    student_group = models.ForeignKey(
+        StudentGroup,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="Учебный класс"
+    )
+    name = models.CharField(max_length=350, blank=True, verbose_name="ФИО")
+    document = models.TextField(blank=True, verbose_name="Поисковый текст")
+    search_vector = models.GeneratedField(
+        expression=SearchVector('name', config='russian'),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        verbose_name = "Поисковый документ"
+        verbose_name_plural = "Поисковые документы"
+        indexes = [
+            GinIndex(fields=['document'], opclasses=['gin_trgm_ops'], name='api_person_document_trgm'),
+            GinIndex(fields=['search_vector'], name='api_person_vector_idx'),
+            models.Index(fields=['role', 'student_group'], name='api_person_role_group_idx'),
+        ]
+
+    def __str__(self):
+        return self.name or str(self.user_id)
+
+
 class DailySchedule(models.Model):
     class WeekDay(models.TextChoices):
         MONDAY = 'MON', _('Понедельник')
@@ -293,6 +440,8 @@ class Homework(models.Model):
         StudentGroup,
         on_delete=models.CASCADE,
         related_name='homeworks',
+        # Покрыт составным индексом, см. Meta.indexes
+        db_index=False,
         verbose_name="Учебный класс"
     )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
@@ -308,6 +457,10 @@ class Homework(models.Model):
         verbose_name = "Домашнее задание"
         verbose_name_plural = "Домашние задания"
         ordering = ['-created_at']
+        indexes = [
+            # Задания класса по сроку сдачи
+            models.Index(fields=['student_group', 'due_date'], name='api_hw_group_due_idx'),
+        ]
     
     def __str__(self):
         return self.title
@@ -332,11 +485,28 @@ class HomeworkSubmission(models.Model):
     )
     submission_text = models.TextField(blank=True, verbose_name="Текст работы")
     submitted_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата отправки")
+    # Оценка за работу; пусто - работа ждет проверки
+    grade = models.OneToOneField(
+        'Grade',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='homework_submission',
+        verbose_name="Оценка"
+    )
     
     class Meta:
         verbose_name = "Сданная работа"
         verbose_name_plural = "Сданные работы"
         unique_together = ['homework', 'student']
+        indexes = [
+            # Очередь непроверенных работ
+            models.Index(
+                fields=['homework'],
+                condition=models.Q(grade__isnull=True),
+                name='api_hwsub_ungraded_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.student.get_full_name()} - {self.homework.title}"
@@ -355,12 +525,16 @@ class Grade(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='grades',
+        # Покрыт составным индексом, см. Meta.indexes
+        db_index=False,
         verbose_name="Ученик"
     )
     subject = models.ForeignKey(
         Subject,
         on_delete=models.CASCADE,
         related_name='grades',
+        # Покрыт составным индексом, см. Meta.indexes
+        db_index=False,
         verbose_name="Предмет"
     )
     schedule_lesson = models.ForeignKey(
@@ -373,6 +547,8 @@ class Grade(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='given_grades',
+        # Покрыт составным индексом, см. Meta.indexes
+        db_index=False,
         verbose_name="Учитель"
     )
     value = models.DecimalField(
@@ -392,9 +568,68 @@ class Grade(models.Model):
         verbose_name = "Оценка"
         verbose_name_plural = "Оценки"
         ordering = ['-date']
+        indexes = [
+            # Оценки ученика по предмету за период (журнал, дневник)
+            models.Index(fields=['student', 'subject', 'date'], name='api_grade_stud_subj_date_idx'),
+            # Оценки учителя за период
+            models.Index(fields=['teacher', 'date'], name='api_grade_teacher_date_idx'),
+            # Оценки предмета по типу
+            models.Index(fields=['subject', 'grade_type'], name='api_grade_subj_type_idx'),
+        ]
     
     def __str__(self):
         return f"{self.student.get_full_name()}: {self.value} по {self.subject.name}"
+    
+    def save(self, *args, **kwargs):
+        # Сводка GradeSummary обновляется сигналами в этой же транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class GradeSummary(models.Model):
+    """
+    Сводка оценок ученика по предмету и типу оценки за месяц.
+    Поддерживается сигналами при изменении Grade (api/grade_summary.py),
+    пересобирается командой rebuild_grade_summaries.
+    """
+    student = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='grade_summaries',
+        verbose_name="Ученик"
+    )
+    subject = models.ForeignKey(
+        Subject,
+        on_delete=models.CASCADE,
+        related_name='grade_summaries',
+        verbose_name="Предмет"
+    )
+    grade_type = models.CharField(
+        max_length=10,
+        choices=Grade.GradeType.choices,
+        verbose_name="Тип оценки"
+    )
+    period = models.DateField(verbose_name="Месяц")  # первое число месяца
+    count = models.PositiveIntegerField(default=0, verbose_name="Количество оценок")
+    total = models.DecimalField(max_digits=10, decimal_places=1, default=0, verbose_name="Сумма оценок")
+    min_value = models.DecimalField(max_digits=3, decimal_places=1, null=True, verbose_name="Минимальная оценка")
+    max_value = models.DecimalField(max_digits=3, decimal_places=1, null=True, verbose_name="Максимальная оценка")
+    # Распределение: оценка, округленная до целого
+    count_5 = models.PositiveIntegerField(default=0, verbose_name="Оценок 5")
+    count_4 = models.PositiveIntegerField(default=0, verbose_name="Оценок 4")
+    count_3 = models.PositiveIntegerField(default=0, verbose_name="Оценок 3")
+    count_2 = models.PositiveIntegerField(default=0, verbose_name="Оценок 2")
+    
+    class Meta:
+        verbose_name = "Сводка оценок"
+        verbose_name_plural = "Сводки оценок"
+        unique_together = ['student', 'subject', 'grade_type', 'period']
+        indexes = [
+            models.Index(fields=['subject', 'period'], name='api_gradesummary_subj_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.student_id} / {self.subject_id} / {self.grade_type} / {self.period:%m.%Y}: {self.count}"
 
 
 class Comment(models.Model):
@@ -433,12 +668,16 @@ class Attendance(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='attendances',
+        # Покрыт составным индексом, см. Meta.indexes
+        db_index=False,
         verbose_name="Ученик"
     )
     schedule_lesson = models.ForeignKey(
         ScheduleLesson,
         on_delete=models.CASCADE,
         related_name='attendances',
+        # Покрыт составным индексом, см. Meta.indexes
+        db_index=False,
         verbose_name="Урок"
     )
     date = models.DateField(verbose_name="Дата")
@@ -452,11 +691,71 @@ class Attendance(models.Model):
         verbose_name = "Посещаемость"
         verbose_name_plural = "Посещаемость"
         unique_together = ['student', 'schedule_lesson', 'date']
+        indexes = [
+            # Посещаемость ученика за период
+            models.Index(fields=['student', 'date'], name='api_att_student_date_idx'),
+            # Отметки по уроку за день (журнал учителя)
+            models.Index(fields=['schedule_lesson', 'date'], name='api_att_lesson_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.student.get_full_name()} - {self.date} - {self.get_status_display()}"
 
 
+class AttendanceDaily(models.Model):
+    """
+    Отметки ученика по предмету за день: счетчики P/A/L.
+    Поддерживается при записи посещаемости (api/attendance_rollup.py),
+    пересобирается командой rebuild_attendance_rollups.
+    """
+    student = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='attendance_days',
+        verbose_name="Ученик"
+    )
+    subject = models.ForeignKey(
+        Subject,
+        on_delete=models.CASCADE,
+        related_name='attendance_days',
+        verbose_name="Предмет"
+    )
+    date = models.DateField(verbose_name="Дата")
+    present = models.PositiveIntegerField(default=0, verbose_name="Присутствовал")
+    absent = models.PositiveIntegerField(default=0, verbose_name="Отсутствовал")
+    late = models.PositiveIntegerField(default=0, verbose_name="Опоздал")
+    
+    class Meta:
+        verbose_name = "Посещаемость ученика за день"
+        verbose_name_plural = "Посещаемость учеников по дням"
+        unique_together = ['student', 'subject', 'date']
+    
+    def __str__(self):
+        return f"{self.student_id} / {self.subject_id} / {self.date}: {self.present}/{self.absent}/{self.late}"
+
+
+class GroupAttendanceDaily(models.Model):
+    """Отметки по урокам класса за день: счетчики P/A/L"""
+    student_group = models.ForeignKey(
+        StudentGroup,
+        on_delete=models.CASCADE,
+        related_name='attendance_days',
+        verbose_name="Учебный класс"
+    )
+    date = models.DateField(verbose_name="Дата")
+    present = models.PositiveIntegerField(default=0, verbose_name="Присутствовал")
+    absent = models.PositiveIntegerField(default=0, verbose_name="Отсутствовал")
+    late = models.PositiveIntegerField(default=0, verbose_name="Опоздал")
+    
+    class Meta:
+        verbose_name = "Посещаемость класса за день"
+        verbose_name_plural = "Посещаемость классов по дням"
+        unique_together = ['student_group', 'date']
+    
+    def __str__(self):
+        return f"{self.student_group_id} / {self.date}: {self.present}/{self.absent}/{self.late}"
+
+
 class Announcement(models.Model):
     title = models.CharField(max_length=200, verbose_name="Заголовок")
     content = models.TextField(verbose_name="Содержание")
@@ -0,0 +1,284 @@
+"""
+Секционирование больших таблиц PostgreSQL (PARTITION BY RANGE).
+
+Посещаемость делится по учебным годам (с 1 сентября), журнал аудита - по
+месяцам. Запросы с границами по дате читают только нужные секции, а
+старые секции отключаются (DETACH) и переносятся в архивную схему без
+DELETE по всей таблице. Включается настройкой DB_PARTITIONING_ENABLED.
+"""
+import re
+from datetime import date, datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+
+YEAR = 'year'
+MONTH = 'month'
+
+# Таблица -> (столбец секционирования, период секции)
+PARTITIONED_TABLES = {
+    'api_attendance': ('date', YEAR),
+    'api_auditlog': ('timestamp', MONTH),
+}
+
+# Учебный год начинается 1 сентября
+ACADEMIC_YEAR_START_MONTH = 9
+
+
+def partitioning_enabled(connection):
+    return connection.vendor == 'postgresql' and getattr(settings, 'DB_PARTITIONING_ENABLED', False)
+
+
+def period_start(interval, day):
+    if interval == YEAR:
+        year = day.year if day.month >= ACADEMIC_YEAR_START_MONTH else day.year - 1
+        return date(year, ACADEMIC_YEAR_START_MONTH, 1)
+    return day.replace(day=1)
+
+
+def next_period(interval, start):
+    if interval == YEAR:
+        return start.replace(year=start.year + 1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def partition_name(table, interval, start):
+    if interval == YEAR:
+        return f'{table}_y{start.year}'
+    return f'{table}_m{start.year}_{start.month:02d}'
+
+
+def _partition_start(table, name):
+    """Начало периода секции по ее имени или None (секция по умолчанию)"""
+    match = re.fullmatch(rf'{re.escape(table)}_(?:y(\d{{4}})|m(\d{{4}})_(\d{{2}}))', name)
+    if not match:
+        return None
+    if match.group(1):
+        return date(int(match.group(1)), ACADEMIC_YEAR_START_MONTH, 1)
+    return date(int(match.group(2)), int(match.group(3)), 1)
+
+
+def _bound(column_type, day):
+    """Литерал границы секции: дата или полночь по времени проекта"""
+    if column_type == 'date':
+        return f"'{day.isoformat()}'"
+    midnight = timezone.make_aware(datetime(day.year, day.month, day.day))
+    return f"'{midnight.isoformat()}'"
+
+
+def _column_type(cursor, table, column):
+    cursor.execute(
+        'SELECT data_type FROM information_schema.columns '
+        'WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s',
+        [table, column],
+    )
+    return cursor.fetchone()[0]
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date()
+    return value
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+        [table],
+    )
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor, table):
+    """Секции таблицы: [(имя, начало периода или None для секции по умолчанию)]"""
+    cursor.execute(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname',
+        [table],
+    )
+    return [(name, _partition_start(table, name)) for (name,) in cursor.fetchall()]
+
+
+def _index_definitions(cursor, table):
+    """Индексы таблицы, кроме индексов под ограничениями (PK, UNIQUE)"""
+    cursor.execute(
+        'SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i '
+        'WHERE i.indrelid = to_regclass(%s) AND NOT EXISTS '
+        '(SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)',
+        [table],
+    )
+    return [definition for (definition,) in cursor.fetchall()]
+
+
+def _constraint_definitions(cursor, table):
+    """Ограничения UNIQUE и внешние ключи таблицы"""
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype IN ('u', 'f') ORDER BY contype DESC",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def _last_id(cursor, table):
+    """Последний выданный id: по последовательности столбца или по данным"""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    last_value = 0
+    if sequence:
+        cursor.execute(f'SELECT last_value FROM {sequence}')
+        last_value = cursor.fetchone()[0]
+    cursor.execute(f'SELECT COALESCE(MAX("id"), 0) FROM "{table}"')
+    return max(last_value, cursor.fetchone()[0])
+
+
+def _rebuild_table(connection, table, partition_by=None, before_copy=None):
+    """
+    Пересоздает таблицу как секционированную (partition_by - столбец) или
+    обычную с теми же данными, индексами, ограничениями и счетчиком id.
+    before_copy(cursor, old_table) вызывается перед копированием строк -
+    для создания секций.
+    """
+    qn = connection.ops.quote_name
+    old = f'{table}_rebuild'
+    sequence = f'{table}_id_seq'
+
+    with connection.cursor() as cursor:
+        indexes = _index_definitions(cursor, table)
+        constraints = _constraint_definitions(cursor, table)
+        last_id = _last_id(cursor, table)
+
+        cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(old)}')
+        partitioning = f' PARTITION BY RANGE ({qn(partition_by)})' if partition_by else ''
+        cursor.execute(
+            f'CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING CONSTRAINTS){partitioning}'
+        )
+        if before_copy:
+            before_copy(cursor, old)
+        cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(old)}')
+        cursor.execute(f'DROP TABLE {qn(old)}')
+
+        primary_key = ['id'] + ([partition_by] if partition_by else [])
+        cursor.execute(
+            f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + "_pkey")} '
+            f'PRIMARY KEY ({", ".join(qn(column) for column in primary_key)})'
+        )
+        for name, definition in constraints:
+            cursor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
+        for definition in indexes:
+            cursor.execute(definition)
+
+        cursor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id')
+        if last_id:
+            cursor.execute('SELECT setval(%s, %s)', [sequence, last_id])
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')"
+        )
+
+
+def partition_table(connection, table, ahead=None):
+    """
+    Переводит обычную таблицу в секционированную. Секции создаются на весь
+    период имеющихся данных и на ahead периодов вперед, плюс секция по
+    умолчанию для строк вне созданных периодов.
+    """
+    column, interval = PARTITIONED_TABLES[table]
+    ahead = getattr(settings, 'DB_PARTITIONS_AHEAD', 2) if ahead is None else ahead
+    qn = connection.ops.quote_name
+
+    def create_partitions(cursor, old):
+        column_type = _column_type(cursor, old, column)
+        cursor.execute(f'SELECT MIN({qn(column)}), MAX({qn(column)}) FROM {qn(old)}')
+        first, last = (_as_date(value) for value in cursor.fetchone())
+        today = timezone.localdate()
+
+        start = period_start(interval, min(first or today, today))
+        end = period_start(interval, max(last or today, today))
+        for _ in range(ahead):
+            end = next_period(interval, end)
+
+        while start <= end:
+            following = next_period(interval, start)
+            cursor.execute(
+                f'CREATE TABLE {qn(partition_name(table, interval, start))} PARTITION OF {qn(table)} '
+                f'FOR VALUES FROM ({_bound(column_type, start)}) TO ({_bound(column_type, following)})'
+            )
+            start = following
+        cursor.execute(f'CREATE TABLE {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT')
+
+    _rebuild_table(connection, table, partition_by=column, before_copy=create_partitions)
+
+
+def unpartition_table(connection, table):
+    """Собирает секции таблицы обратно в обычную таблицу"""
+    _rebuild_table(connection, table)
+
+
+def ensure_partitions(connection, table, ahead=None, today=None):
+    """
+    Создает секции текущего периода и ahead следующих, если их еще нет.
+    Строки этих периодов, попавшие в секцию по умолчанию, переносятся в
+    новую секцию. Возвращает имена созданных секций.
+    """
+    column, interval = PARTITIONED_TABLES[table]
+    ahead = getattr(settings, 'DB_PARTITIONS_AHEAD', 2) if ahead is None else ahead
+    qn = connection.ops.quote_name
+    created = []
+
+    with connection.cursor() as cursor:
+        column_type = _column_type(cursor, table, column)
+        existing = {name for name, _ in list_partitions(cursor, table)}
+        has_default = f'{table}_default' in existing
+
+        start = period_start(interval, today or timezone.localdate())
+        for _ in range(ahead + 1):
+            following = next_period(interval, start)
+            name = partition_name(table, interval, start)
+            if name not in existing:
+                lower, upper = _bound(column_type, start), _bound(column_type, following)
+                cursor.execute(f'CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING CONSTRAINTS)')
+                if has_default:
+                    cursor.execute(
+                        f'WITH moved AS (DELETE FROM {qn(table + "_default")} '
+                        f'WHERE {qn(column)} >= {lower} AND {qn(column)} < {upper} RETURNING *) '
+                        f'INSERT INTO {qn(name)} SELECT * FROM moved'
+                    )
+                cursor.execute(
+                    f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} '
+                    f'FOR VALUES FROM ({lower}) TO ({upper})'
+                )
+                created.append(name)
+            start = following
+
+    return created
+
+
+def detach_partitions(connection, table, before, drop=False):
+    """
+    Отключает секции, период которых закончился не позже before. Секции
+    переносятся в архивную схему (DB_PARTITION_ARCHIVE_SCHEMA) или
+    удаляются при drop=True. Возвращает имена отключенных секций.
+    """
+    _, interval = PARTITIONED_TABLES[table]
+    schema = getattr(settings, 'DB_PARTITION_ARCHIVE_SCHEMA', 'archive')
+    qn = connection.ops.quote_name
+    detached = []
+
+    with connection.cursor() as cursor:
+        for name, start in list_partitions(cursor, table):
+            if start is None or next_period(interval, start) > before:
+                continue
+            cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+            # Умолчание id ссылается на последовательность основной таблицы
+            cursor.execute(f'ALTER TABLE {qn(name)} ALTER COLUMN id DROP DEFAULT')
+            if drop:
+                cursor.execute(f'DROP TABLE {qn(name)}')
+            else:
+                cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {qn(schema)}')
+                cursor.execute(f'ALTER TABLE {qn(name)} SET SCHEMA {qn(schema)}')
+            detached.append(name)
+
+    return detached
@@ -0,0 +1,163 @@
+"""
+Поиск людей: учеников, учителей и остальных пользователей.
+
+Для каждого пользователя хранится PersonSearch - ФИО, логин, email и
+телефоны одной строкой в нижнем регистре (ё -> е). По ней работает
+GIN-индекс pg_trgm: поиск по подстроке (LIKE '%...%') и по похожим словам
+с опечатками (word_similarity). По ФИО дополнительно строится tsvector с
+русской морфологией: "Иванова" находит "Иванов". Результаты упорядочены
+по сходству.
+"""
+import re
+
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import Exists, F, OuterRef, Q
+
+from .models import PersonSearch, StudentProfile, TeacherProfile
+
+
+SEARCH_CONFIG = 'russian'
+
+REBUILD_BATCH_SIZE = 1000
+
+# Модель, среди объектов которой ищут, -> путь от нее к PersonSearch
+SEARCH_PATHS = {
+    PersonSearch: '',
+    User: 'search_document__',
+    StudentProfile: 'user__search_document__',
+    TeacherProfile: 'user__search_document__',
+}
+
+# Поля пользователя и профилей, из которых собирается документ
+DOCUMENT_FIELDS = (
+    'pk', 'username', 'first_name', 'last_name', 'email',
+    'student_profile__pk', 'student_profile__patronymic', 'student_profile__phone',
+    'student_profile__student_group_id',
+    'teacher_profile__pk', 'teacher_profile__patronymic', 'teacher_profile__phone',
+)
+
+
+def normalize(text):
+    """Нижний регистр, ё -> е и одиночные пробелы - для документа и запроса"""
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def person_row(values):
+    """
+    Поля PersonSearch по строке DOCUMENT_FIELDS (+ in_teacher_group,
+    in_student_group). Роль определяется так же, как в списках: учитель -
+    группа teacher или профиль учителя, ученик - группа student или профиль.
+    """
+    if values['teacher_profile__pk'] or values['in_teacher_group']:
+        role = PersonSearch.Role.TEACHER
+    elif values['student_profile__pk'] or values['in_student_group']:
+        role = PersonSearch.Role.STUDENT
+    else:
+        role = PersonSearch.Role.OTHER
+
+    patronymic = values['student_profile__patronymic'] or values['teacher_profile__patronymic'] or ''
+    name = normalize(f"{values['last_name']} {values['first_name']} {patronymic}")
+
+    parts = [name, values['username'], values['email']]
+    for phone in (values['student_profile__phone'], values['teacher_profile__phone']):
+        if phone:
+            # И как записан, и одними цифрами - чтобы находился в любом формате
+            parts += [phone, re.sub(r'\D', '', phone)]
+
+    return {
+        'user_id': values['pk'],
+        'role': role,
+        'student_group_id': values['student_profile__student_group_id'],
+        'name': name,
+        'document': normalize(' '.join(part for part in parts if part)),
+    }
+
+
+def _role_groups(through, group_name):
+    return Exists(through.objects.filter(user_id=OuterRef('pk'), group__name=group_name))
+
+
+def document_rows(users):
+    """Строки PersonSearch для пользователей из queryset одним запросом"""
+    through = users.model.groups.through
+    return [
+        person_row(values)
+        for values in users.order_by().values(
+            *DOCUMENT_FIELDS,
+            in_teacher_group=_role_groups(through, 'teacher'),
+            in_student_group=_role_groups(through, 'student'),
+        )
+    ]
+
+
+def _save_rows(rows):
+    if rows:
+        PersonSearch.objects.bulk_create(
+            [PersonSearch(**row) for row in rows],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=['role', 'student_group', 'name', 'document'],
+        )
+
+
+def sync_people(user_ids):
+    """Обновляет документы пользователей; документы удаленных - удаляет"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    rows = document_rows(User.objects.filter(pk__in=user_ids))
+    _save_rows(rows)
+    PersonSearch.objects.filter(
+        user_id__in=user_ids - {row['user_id'] for row in rows}
+    ).delete()
+
+
+def rebuild_people_search():
+    """Пересобирает документы всех пользователей пачками по id"""
+    last_pk, total = 0, 0
+    PersonSearch.objects.exclude(user__in=User.objects.all()).delete()
+    while True:
+        users = User.objects.filter(pk__gt=last_pk).order_by('pk')[:REBUILD_BATCH_SIZE]
+        pks = list(users.values_list('pk', flat=True))
+        if not pks:
+            return total
+        _save_rows(document_rows(User.objects.filter(pk__in=pks)))
+        last_pk = pks[-1]
+        total += len(pks)
+
+
+def search_people(query, role=None, group=None, queryset=None):
+    """
+    Люди по запросу - от лучших совпадений к худшим.
+
+    Совпадением считается подстрока документа (ФИО, логин, email, телефон),
+    похожее слово (опечатка) или словоформа ФИО. queryset - пользователи
+    или профили учеников/учителей, среди которых искать (по умолчанию все
+    PersonSearch); к нему добавляется аннотация search_rank, прежний
+    порядок остается вторичным. role - PersonSearch.Role, group - id
+    учебного класса.
+    """
+    if queryset is None:
+        queryset = PersonSearch.objects.all()
+    path = SEARCH_PATHS[queryset.model]
+
+    if role:
+        queryset = queryset.filter(**{f'{path}role': role})
+    if group:
+        queryset = queryset.filter(**{f'{path}student_group': group})
+
+    text = normalize(query)
+    if not text:
+        return queryset
+
+    search_query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    rank = (
+        TrigramWordSimilarity(text, F(f'{path}document'))
+        + SearchRank(F(f'{path}search_vector'), search_query)
+    )
+    return queryset.filter(
+        Q(**{f'{path}document__contains': text})
+        | Q(**{f'{path}document__trigram_word_similar': text})
+        | Q(**{f'{path}search_vector': search_query})
+    ).annotate(search_rank=rank).order_by('-search_rank', *queryset.query.order_by)
@@ -0,0 +1,183 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import audit
+from .attendance_rollup import lesson_group_ids, refresh_attendance_rollups
+from .grade_summary import add_grade, remove_grade, summary_key
+from .people_search import sync_people
+from .models import (
+    Announcement, Attendance, AuditLog, Comment, DailySchedule, Grade, Homework,
+    HomeworkSubmission, ScheduleLesson, StudentGroup, StudentProfile, Subject,
+    TeacherProfile, TeacherSubject,
+)
+
+
+def _grade_key(grade):
+    return summary_key(grade.student_id, grade.subject_id, grade.grade_type, grade.date)
+
+
+@receiver(pre_save, sender=Grade)
+def grade_summary_pre_save(sender, instance, **kwargs):
+    # Прежнее состояние оценки - чтобы вычесть его из сводки (вся строка -
+    # ее же использует аудит)
+    instance._summary_old = None
+    if instance.pk:
+        instance._summary_old = sender.objects.filter(pk=instance.pk).values().first()
+
+
+@receiver(post_save, sender=Grade)
+def grade_summary_saved(sender, instance, **kwargs):
+    old = getattr(instance, '_summary_old', None)
+    if old is not None:
+        remove_grade(
+            summary_key(old['student_id'], old['subject_id'], old['grade_type'], old['date']),
+            old['value'],
+        )
+    add_grade(_grade_key(instance), instance.value)
+
+
+@receiver(post_delete, sender=Grade)
+def grade_summary_deleted(sender, instance, **kwargs):
+    remove_grade(_grade_key(instance), instance.value)
+
+
+@receiver(pre_save, sender=Attendance)
+def attendance_rollup_pre_save(sender, instance, **kwargs):
+    # Прежние ученик, урок и дата - их сводки тоже нужно пересчитать (вся
+    # строка - ее же использует аудит)
+    instance._rollup_old = None
+    if instance.pk:
+        instance._rollup_old = sender.objects.filter(pk=instance.pk).values().first()
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def attendance_rollup_changed(sender, instance, **kwargs):
+    marks = [{
+        'student_id': instance.student_id,
+        'schedule_lesson_id': instance.schedule_lesson_id,
+        'date': instance.date,
+    }]
+    old = getattr(instance, '_rollup_old', None)
+    if old is not None:
+        old = {key: old[key] for key in marks[0]}
+        if old != marks[0]:
+            marks.append(old)
+
+    refresh_attendance_rollups(
+        dates=[mark['date'] for mark in marks],
+        student_ids=[mark['student_id'] for mark in marks],
+        group_ids=lesson_group_ids(mark['schedule_lesson_id'] for mark in marks),
+    )
+
+
+# Поля пользователя, из которых собирается поисковый документ
+PERSON_SEARCH_USER_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+
+
+def _sync_people_on_commit(user_ids):
+    # После фиксации: при удалении пользователя профили удаляются раньше
+    # него, и документ не должен появиться снова
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: sync_people(user_ids))
+
+
+@receiver(post_save, sender=User)
+def person_search_user_saved(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields and not PERSON_SEARCH_USER_FIELDS & set(update_fields)):
+        # Вход пользователя (last_login) и т.п. документ не меняют
+        return
+    _sync_people_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=StudentProfile)
+@receiver(post_save, sender=TeacherProfile)
+@receiver(post_delete, sender=StudentProfile)
+@receiver(post_delete, sender=TeacherProfile)
+def person_search_profile_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _sync_people_on_commit([instance.user_id])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def person_search_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Группы teacher/student определяют роль в документе
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _sync_people_on_commit([instance.pk])
+    elif action == 'pre_clear':
+        instance._person_search_users = list(instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        _sync_people_on_commit(getattr(instance, '_person_search_users', []))
+    elif action in ('post_add', 'post_remove'):
+        _sync_people_on_commit(pk_set)
+
+
+# Модели, изменения которых попадают в журнал аудита
+AUDITED_MODELS = [
+    User, Subject, StudentGroup, StudentProfile, TeacherProfile, TeacherSubject,
+    DailySchedule, ScheduleLesson, Homework, HomeworkSubmission, Grade, Comment,
+    Attendance, Announcement,
+]
+
+# Строки, которые pre_save сводок уже прочитал: аудит берет прежние
+# значения оттуда, без второго запроса на пути записи оценок и посещаемости
+PREFETCHED_ROWS = {Grade: '_summary_old', Attendance: '_rollup_old'}
+
+
+def audit_pre_save(sender, instance, raw=False, **kwargs):
+    instance._audit_old = None
+    if raw or instance._state.adding:
+        return
+    if sender in PREFETCHED_ROWS:
+        instance._audit_old = getattr(instance, PREFETCHED_ROWS[sender], None)
+    else:
+        instance._audit_old = sender._default_manager.filter(pk=instance.pk).values().first()
+
+
+def audit_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        audit.record(
+            AuditLog.ActionType.CREATE, sender.__name__, instance.pk,
+            new_values=audit.instance_values(instance),
+        )
+        return
+
+    old_row = getattr(instance, '_audit_old', None)
+    if old_row is None:
+        return
+    old_values, new_values = audit.changed_values(instance, old_row)
+    if new_values:
+        audit.record(
+            AuditLog.ActionType.UPDATE, sender.__name__, instance.pk,
+            old_values=old_values, new_values=new_values,
+        )
+
+
+def audit_deleted(sender, instance, **kwargs):
+    audit.record(
+        AuditLog.ActionType.DELETE, sender.__name__, instance.pk,
+        old_values=audit.instance_values(instance),
+    )
+
+
+for model in AUDITED_MODELS:
+    pre_save.connect(audit_pre_save, sender=model, dispatch_uid=f'audit_pre_save_{model.__name__}')
+    post_save.connect(audit_saved, sender=model, dispatch_uid=f'audit_saved_{model.__name__}')
+    post_delete.connect(audit_deleted, sender=model, dispatch_uid=f'audit_deleted_{model.__name__}')
+
+
+@receiver(user_logged_in)
+def audit_login(sender, request, user, **kwargs):
+    audit.record(AuditLog.ActionType.LOGIN, 'User', user.pk, user=user)
+
+
+@receiver(user_logged_out)
+def audit_logout(sender, request, user, **kwargs):
+    if user is not None:
+        audit.record(AuditLog.ActionType.LOGOUT, 'User', user.pk, user=user)
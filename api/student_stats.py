@@ -0,0 +1,84 @@
+from django.db.models import Avg, Case, Count, Exists, Max, OuterRef, When
+
+from .attendance_rollup import rollup_stats, rollup_totals
+from .models import Attendance, AttendanceDaily, Grade
+
+
+def _empty_grade_stats():
+    return {'total': 0, 'average': None, 'latest': None}
+
+
+def _empty_attendance_stats():
+    return {'total': 0, 'present': 0, 'absent': 0, 'late': 0, 'present_percentage': 0}
+
+
+def get_student_stats(student_ids, teacher=None):
+    """
+    Сводка по оценкам и посещаемости для списка учеников.
+
+    Считается двумя сгруппированными запросами на весь список, а не по
+    запросу на ученика. Если передан teacher - учитываются только его
+    оценки и уроки, иначе посещаемость берется из дневных сводок.
+
+    Возвращает {student_id: {'grade_stats': {...}, 'attendance_stats': {...}}}.
+    """
+    student_ids = list(student_ids)
+    stats = {
+        student_id: {
+            'grade_stats': _empty_grade_stats(),
+            'attendance_stats': _empty_attendance_stats(),
+        }
+        for student_id in student_ids
+    }
+    if not student_ids:
+        return stats
+
+    grades = Grade.objects.filter(student_id__in=student_ids)
+    if teacher is not None:
+        grades = grades.filter(teacher=teacher)
+
+    for row in grades.order_by().values('student').annotate(
+        total=Count('id'),
+        average=Avg('value'),
+        latest=Max('date'),
+    ):
+        stats[row.pop('student')]['grade_stats'] = row
+
+    if teacher is None:
+        # Без учителя - по дневным сводкам посещаемости
+        for row in AttendanceDaily.objects.filter(
+            student_id__in=student_ids
+        ).order_by().values('student').annotate(**rollup_totals()):
+            stats[row['student']]['attendance_stats'] = rollup_stats(row)
+        return stats
+
+    for row in Attendance.objects.filter(
+        student_id__in=student_ids,
+        schedule_lesson__teacher=teacher,
+    ).order_by().values('student').annotate(
+        total=Count('id'),
+        present=Count(Case(When(status='P', then=1))),
+        absent=Count(Case(When(status='A', then=1))),
+        late=Count(Case(When(status='L', then=1))),
+    ):
+        row['present_percentage'] = (
+            round((row['present'] / row['total']) * 100, 1) if row['total'] else 0
+        )
+        stats[row.pop('student')]['attendance_stats'] = row
+
+    return stats
+
+
+def count_active_students(students_qs, since, teacher=None):
+    """
+    Число учеников из students_qs (StudentProfile), у которых с даты since
+    есть оценки или отметки посещаемости. Использует EXISTS-подзапросы
+    вместо соединения с таблицами оценок и посещаемости.
+    """
+    grades = Grade.objects.filter(student_id=OuterRef('user_id'), date__gte=since)
+    attendances = Attendance.objects.filter(student_id=OuterRef('user_id'), date__gte=since)
+    if teacher is not None:
+        grades = grades.filter(teacher=teacher)
+        attendances = attendances.filter(schedule_lesson__teacher=teacher)
+
+    return students_qs.order_by().filter(Exists(grades) | Exists(attendances)).count()
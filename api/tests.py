@@ -1,3 +1,255 @@
+import random
+import unittest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+
+from api.attendance_rollup import refresh_attendance_rollups
+from api.grade_summary import rebuild_grade_summaries
+from api.management.commands.check_query_plans import PLAN_CASES, plan_uses_index
+from api.models import (
+    Attendance, AttendanceDaily, DailySchedule, Grade, GradeSummary, GroupAttendanceDaily,
+    Homework, ScheduleLesson, StudentGroup, Subject,
+)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Планы запросов проверяются только на PostgreSQL')
+class QueryPlanTests(TestCase):
+    """
+    Основные запросы к оценкам, посещаемости и заданиям читают таблицу
+    через свой индекс на данных реального объема - без enable_seqscan=off
+    """
+
+    STUDENTS = 200
+    TEACHERS = 20
+    SUBJECTS = 40
+    GROUPS = 40
+    DAYS = 365
+    ROWS = 30000
+
+    @classmethod
+    def setUpTestData(cls):
+        rnd = random.Random(0)
+        first_day = date(2025, 9, 1)
+
+        users = User.objects.bulk_create([
+            User(username=f'plan{number}') for number in range(cls.STUDENTS + cls.TEACHERS)
+        ])
+        students, teachers = users[:cls.STUDENTS], users[cls.STUDENTS:]
+        subjects = Subject.objects.bulk_create([
+            Subject(name=f'Предмет {number}') for number in range(cls.SUBJECTS)
+        ])
+        groups = StudentGroup.objects.bulk_create([
+            StudentGroup(name=f'Класс {number}', year=1) for number in range(cls.GROUPS)
+        ])
+        schedules = DailySchedule.objects.bulk_create([
+            DailySchedule(student_group=group, week_day='MON') for group in groups
+        ])
+        lessons = ScheduleLesson.objects.bulk_create([
+            ScheduleLesson(
+                daily_schedule=schedule, lesson_number=number,
+                subject=rnd.choice(subjects), teacher=rnd.choice(teachers),
+            )
+            for schedule in schedules for number in range(1, 7)
+        ])
+
+        Grade.objects.bulk_create([
+            Grade(
+                student=rnd.choice(students),
+                subject=rnd.choice(subjects),
+                schedule_lesson=rnd.choice(lessons),
+                teacher=rnd.choice(teachers),
+                value=rnd.choice([2, 3, 4, 5]),
+                grade_type=rnd.choice(Grade.GradeType.values),
+                date=first_day + timedelta(days=rnd.randrange(cls.DAYS)),
+            )
+            for _ in range(cls.ROWS)
+        ], batch_size=5000)
+
+        marks = {
+            (rnd.choice(students).pk, rnd.choice(lessons).pk, first_day + timedelta(days=rnd.randrange(cls.DAYS)))
+            for _ in range(cls.ROWS)
+        }
+        Attendance.objects.bulk_create([
+            Attendance(student_id=student_id, schedule_lesson_id=lesson_id, date=day, status='P')
+            for student_id, lesson_id, day in marks
+        ], batch_size=5000)
+
+        start = timezone.make_aware(datetime.combine(first_day, datetime.min.time()))
+        Homework.objects.bulk_create([
+            Homework(
+                title='Задание', description='Описание',
+                schedule_lesson=lesson, student_group=lesson.daily_schedule.student_group,
+                due_date=start + timedelta(days=rnd.randrange(cls.DAYS)),
+            )
+            for lesson in rnd.choices(lessons, k=cls.ROWS // 10)
+        ])
+
+        with connection.cursor() as cursor:
+            for model in (Grade, Attendance, Homework):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+    def test_queries_use_their_indexes(self):
+        for title, index_name, sample, build in PLAN_CASES:
+            with self.subTest(title):
+                plan = build(sample()).explain()
+                self.assertTrue(
+                    plan_uses_index(plan, index_name),
+                    f'{title}: ожидался {index_name}\n{plan}',
+                )
+
+
+def _summaries():
+    return sorted(GradeSummary.objects.values(
+        'student_id', 'subject_id', 'grade_type', 'period', 'count', 'total',
+        'min_value', 'max_value', 'count_5', 'count_4', 'count_3', 'count_2',
+    ), key=lambda row: (row['student_id'], row['period'], row['grade_type']))
+
+
+class GradeSummaryTests(TestCase):
+    """Сводки оценок поддерживаются при сохранении и удалении оценок"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = User.objects.create(username='summary_student')
+        cls.teacher = User.objects.create(username='summary_teacher')
+        cls.subject = Subject.objects.create(name='Алгебра')
+        group = StudentGroup.objects.create(name='7А', year=7)
+        schedule = DailySchedule.objects.create(student_group=group, week_day='MON')
+        cls.lesson = ScheduleLesson.objects.create(
+            daily_schedule=schedule, lesson_number=1, subject=cls.subject, teacher=cls.teacher,
+        )
+
+    def grade(self, value, day=date(2025, 10, 3), grade_type=Grade.GradeType.HOMEWORK):
+        return Grade.objects.create(
+            student=self.student, subject=self.subject, schedule_lesson=self.lesson,
+            teacher=self.teacher, value=value, grade_type=grade_type, date=day,
+        )
+
+    def summary(self, period=date(2025, 10, 1)):
+        return GradeSummary.objects.filter(student=self.student, period=period).first()
+
+    def assertMatchesRebuild(self):
+        maintained = _summaries()
+        rebuild_grade_summaries()
+        self.assertEqual(maintained, _summaries())
+
+    def test_create_adds_to_month_summary(self):
+        self.grade(5)
+        self.grade(Decimal('3.5'))
+        self.grade(2, day=date(2025, 10, 31))
+
+        summary = self.summary()
+        self.assertEqual(summary.count, 3)
+        self.assertEqual(summary.total, Decimal('10.5'))
+        self.assertEqual((summary.min_value, summary.max_value), (2, 5))
+        # 3.5 округляется вверх
+        self.assertEqual(
+            (summary.count_5, summary.count_4, summary.count_3, summary.count_2), (1, 1, 0, 1),
+        )
+        self.assertMatchesRebuild()
+
+    def test_update_moves_grade_between_buckets_and_months(self):
+        low = self.grade(3)
+        self.grade(5)
+
+        low.value = 4
+        low.save()
+        summary = self.summary()
+        self.assertEqual((summary.count, summary.count_3, summary.count_4), (2, 0, 1))
+        self.assertEqual(summary.min_value, 4)
+
+        low.date = date(2025, 11, 5)
+        low.save()
+        self.assertEqual(self.summary().count, 1)
+        self.assertEqual(self.summary(date(2025, 11, 1)).count, 1)
+        self.assertMatchesRebuild()
+
+    def test_delete_recomputes_limits_and_drops_empty_rows(self):
+        low = self.grade(2)
+        high = self.grade(5)
+        self.grade(4)
+
+        low.delete()
+        self.assertEqual(self.summary().min_value, 4)
+        high.delete()
+        self.assertEqual(self.summary().max_value, 4)
+        self.assertMatchesRebuild()
+
+        Grade.objects.get().delete()
+        self.assertIsNone(self.summary())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Сводки посещаемости блокируются средствами PostgreSQL')
+class AttendanceRollupTests(TestCase):
+    """Дневные сводки посещаемости по ученикам и классам"""
+
+    DAY = date(2025, 10, 6)
+
+    @classmethod
+    def setUpTestData(cls):
+        teacher = User.objects.create(username='rollup_teacher')
+        cls.students = [User.objects.create(username=f'rollup{number}') for number in range(2)]
+        cls.subject = Subject.objects.create(name='Физика')
+        cls.group = StudentGroup.objects.create(name='8Б', year=8)
+        schedule = DailySchedule.objects.create(student_group=cls.group, week_day='MON')
+        cls.lessons = [
+            ScheduleLesson.objects.create(
+                daily_schedule=schedule, lesson_number=number, subject=cls.subject, teacher=teacher,
+            )
+            for number in (1, 2)
+        ]
+
+    def counts(self, model, day=DAY, **key):
+        return model.objects.filter(date=day, **key).values_list('present', 'absent', 'late').first()
+
+    def test_signals_keep_rollups_in_sync(self):
+        student = self.students[0]
+        mark = Attendance.objects.create(
+            student=student, schedule_lesson=self.lessons[0], date=self.DAY, status='P',
+        )
+        Attendance.objects.create(
+            student=student, schedule_lesson=self.lessons[1], date=self.DAY, status='L',
+        )
+        self.assertEqual(self.counts(AttendanceDaily, student=student), (1, 0, 1))
+        self.assertEqual(self.counts(GroupAttendanceDaily, student_group=self.group), (1, 0, 1))
+
+        mark.status = 'A'
+        mark.save()
+        self.assertEqual(self.counts(AttendanceDaily, student=student), (0, 1, 1))
+
+        mark.date = self.DAY + timedelta(days=7)
+        mark.save()
+        self.assertEqual(self.counts(AttendanceDaily, student=student), (0, 0, 1))
+        self.assertEqual(self.counts(AttendanceDaily, day=mark.date, student=student), (0, 1, 0))
+
+        Attendance.objects.all().delete()
+        self.assertFalse(AttendanceDaily.objects.exists())
+        self.assertFalse(GroupAttendanceDaily.objects.exists())
+
+    def test_refresh_after_bulk_write(self):
+        Attendance.objects.bulk_create([
+            Attendance(student=student, schedule_lesson=lesson, date=self.DAY, status=status)
+            for student, status in zip(self.students, 'PA')
+            for lesson in self.lessons
+        ])
+        self.assertFalse(AttendanceDaily.objects.exists())
+
+        refresh_attendance_rollups(
+            dates=[self.DAY],
+            student_ids=[student.pk for student in self.students],
+            group_ids=[self.group.pk],
+        )
+        self.assertEqual(self.counts(AttendanceDaily, student=self.students[0]), (2, 0, 0))
+        self.assertEqual(self.counts(AttendanceDaily, student=self.students[1]), (0, 2, 0))
+        self.assertEqual(self.counts(GroupAttendanceDaily, student_group=self.group), (2, 2, 0))
 
-# Create your tests here.
+        Attendance.objects.filter(student=self.students[1]).update(status='L')
+        refresh_attendance_rollups(dates=[self.DAY], student_ids=[self.students[1].pk])
+        self.assertEqual(self.counts(AttendanceDaily, student=self.students[1]), (0, 0, 2))
+        # Класс не указан - его сводка не пересчитывается
+        self.assertEqual(self.counts(GroupAttendanceDaily, student_group=self.group), (2, 2, 0))
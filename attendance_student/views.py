@@ -3,7 +3,7 @@ from django.shortcuts import render
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.db.models import Q
-from api.models import Attendance, StudentProfile, DailySchedule, ScheduleLesson, Subject
+from api.models import Attendance, AttendanceDaily, StudentProfile, DailySchedule, ScheduleLesson, Subject
 from MPTed_base.decorators import student_required
 
 
@@ -185,8 +185,7 @@ def attendance_dashboard(request):
 @student_required
 def attendance_history(request):
     """История посещаемости по всем предметам - оптимизированная версия"""
-    from django.db.models import Count, Q, Sum, Case, When, Value, IntegerField
-    from django.db.models.functions import TruncMonth
+    from django.db.models import Count, Sum
     
     student_profile, student_group = get_student_group_and_schedule(request.user)
     
@@ -198,82 +197,49 @@ def attendance_history(request):
     today = timezone.now().date()
     thirty_days_ago = today - timedelta(days=30)
     
-    # Получаем все уникальные даты за период, когда были уроки
-    dates_with_lessons = []
-    
-    # Проверяем каждый день
+    # Сколько раз каждый день недели встречается в периоде
+    week_days = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+    day_occurrences = {}
     current_date = thirty_days_ago
     while current_date <= today:
-        week_day = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN'][current_date.weekday()]
-        
-        # Есть ли расписание на этот день?
-        if DailySchedule.objects.filter(
-            student_group=student_group,
-            week_day=week_day,
-            is_active=True,
-            is_weekend=False
-        ).exists():
-            dates_with_lessons.append(current_date)
-        
+        week_day = week_days[current_date.weekday()]
+        day_occurrences[week_day] = day_occurrences.get(week_day, 0) + 1
         current_date += timedelta(days=1)
     
-    # Получаем все предметы из расписания группы
-    subjects = Subject.objects.filter(
-        schedule_lessons__daily_schedule__student_group=student_group
-    ).distinct()
-    
-    subjects_data = []
+    # Уроков каждого предмета по дням недели - одним запросом по расписанию
+    lessons_by_subject = {}
+    for row in ScheduleLesson.objects.filter(
+        daily_schedule__student_group=student_group,
+        daily_schedule__is_active=True,
+        daily_schedule__is_weekend=False
+    ).order_by().values('subject_id', 'daily_schedule__week_day').annotate(count=Count('id')):
+        lessons_by_subject[row['subject_id']] = (
+            lessons_by_subject.get(row['subject_id'], 0)
+            + row['count'] * day_occurrences.get(row['daily_schedule__week_day'], 0)
+        )
     
-    # Для каждого предмета собираем статистику
-    for subject in subjects:
-        # Получаем ID всех уроков этого предмета
-        lesson_ids = ScheduleLesson.objects.filter(
-            subject=subject,
-            daily_schedule__student_group=student_group
-        ).values_list('id', flat=True)
-        
-        if not lesson_ids:
-            continue
-        
-        # Считаем общее количество уроков за период
-        total_lessons_count = 0
-        
-        for date in dates_with_lessons:
-            # Находим день недели для этой даты
-            week_day = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN'][date.weekday()]
-            
-            # Получаем расписание на этот день
-            try:
-                schedule = DailySchedule.objects.get(
-                    student_group=student_group,
-                    week_day=week_day,
-                    is_active=True,
-                    is_weekend=False
-                )
-                
-                # Считаем уроки этого предмета в этот день
-                day_lessons_count = ScheduleLesson.objects.filter(
-                    subject=subject,
-                    daily_schedule=schedule
-                ).count()
-                
-                total_lessons_count += day_lessons_count
-                
-            except DailySchedule.DoesNotExist:
-                continue
-        
-        if total_lessons_count == 0:
-            continue
-        
-        # Получаем статистику посещаемости по этому предмету
-        attendances = Attendance.objects.filter(
+    # Отметки по предметам - из дневных сводок посещаемости
+    marks_by_subject = {
+        row['subject_id']: row
+        for row in AttendanceDaily.objects.filter(
             student=request.user,
-            schedule_lesson__in=lesson_ids,
+            subject_id__in=lessons_by_subject,
             date__range=[thirty_days_ago, today]
+        ).order_by().values('subject_id').annotate(
+            present_count=Sum('present'),
+            late_count=Sum('late')
         )
+    }
+    
+    subjects_data = []
+    for subject in Subject.objects.filter(id__in=lessons_by_subject):
+        total_lessons_count = lessons_by_subject[subject.id]
+        if total_lessons_count == 0:
+            continue
         
-        present_count = attendances.filter(status='P').count()
-        late_count = attendances.filter(status='L').count()
+        marks = marks_by_subject.get(subject.id, {})
+        present_count = marks.get('present_count') or 0
+        late_count = marks.get('late_count') or 0
         
         # Не был = всего уроков - (был + опоздал)
         absent_count = total_lessons_count - present_count - late_count
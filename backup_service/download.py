@@ -0,0 +1,302 @@
+"""
+Отдача резервных копий для скачивания.
+
+Файл копии отдается с поддержкой Range/If-Range (прерванное скачивание
+можно продолжить) и ETag из SHA-256 копии. При BACKUP_DOWNLOAD_OFFLOAD
+передачу берет на себя фронтенд-сервер: X-Accel-Redirect у nginx,
+X-Sendfile у Apache/lighttpd. Иначе файл отдается через
+wsgi.file_wrapper - gunicorn и uwsgi передают его os.sendfile, не
+пропуская данные через Python.
+
+Каталоги pg_dump и копии из хранилища отдаются tar-архивом, который
+собирается на лету, но его раскладка известна заранее - поэтому Range
+работает и для него. Такой архив всегда идет через Python-генератор:
+BACKUP_DOWNLOAD_OFFLOAD и sendfile действуют только для копий одним
+файлом (custom и старых SQL-скриптов). Старые несжатые SQL-скрипты по ?compress=gzip
+сжимаются на лету.
+"""
+import mimetypes
+import os
+import tarfile
+import zlib
+from functools import partial
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from . import store
+
+
+# None - отдает приложение, 'x-accel-redirect' - nginx, 'x-sendfile' - Apache/lighttpd
+BACKUP_DOWNLOAD_OFFLOAD = getattr(settings, 'BACKUP_DOWNLOAD_OFFLOAD', None)
+# internal-location nginx, в который отображен BACKUP_DIR
+BACKUP_ACCEL_REDIRECT_PREFIX = getattr(settings, 'BACKUP_ACCEL_REDIRECT_PREFIX', '/protected-backups/')
+
+BLOCK_SIZE = 1024 * 1024
+
+GZIP_LEVEL = 6
+
+
+class RangeNotSatisfiable(Exception):
+    """Запрошенный диапазон лежит за концом файла"""
+
+
+def backup_etag(backup, variant=''):
+    """Сильный ETag из контрольной суммы копии; variant - для tar и gzip-представлений"""
+    value = backup.checksum or backup.md5_hash
+    return f'"{value}{variant}"' if value else None
+
+
+def parse_range(header, size):
+    """
+    (начало, конец) включительно для "bytes=a-b", "bytes=a-" и "bytes=-n".
+    None - заголовок не разобран или диапазонов несколько: тогда
+    отдается весь файл, это допускает RFC 9110.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def requested_range(request, size, etag, last_modified):
+    """Диапазон из Range, если If-Range (при наличии) совпадает с текущей копией"""
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith(('"', 'W/')):
+            # Слабые ETag для If-Range не подходят
+            if etag is None or if_range != etag:
+                return None
+        else:
+            since = parse_http_date_safe(if_range)
+            if since is None or last_modified is None or int(last_modified.timestamp()) > since:
+                return None
+    return parse_range(header, size)
+
+
+def _not_satisfiable(size):
+    response = HttpResponse(status=416)
+    response['Content-Range'] = f'bytes */{size}'
+    return response
+
+
+def _finish(response, size, byte_range, etag, last_modified):
+    """Общие заголовки ответа с файлом или его частью"""
+    start, end = byte_range or (0, size - 1)
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+class _FileRange:
+    """
+    Часть открытого файла. read() не выходит за ее конец, fileno() нужен
+    WSGI-серверу для os.sendfile (gunicorn начинает с текущей позиции
+    файла и передает Content-Length байт).
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _offload_header(path):
+    """Заголовок передачи файла фронтенд-серверу или None"""
+    if BACKUP_DOWNLOAD_OFFLOAD == 'x-sendfile':
+        return 'X-Sendfile', os.path.abspath(path)
+    if BACKUP_DOWNLOAD_OFFLOAD == 'x-accel-redirect':
+        relative = os.path.relpath(path, settings.BACKUP_DIR)
+        # Файл вне BACKUP_DIR через internal-location не отдать
+        if relative.startswith(os.pardir):
+            return None
+        return 'X-Accel-Redirect', BACKUP_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+    return None
+
+
+def file_response(request, backup):
+    """Файл копии целиком или запрошенный диапазон"""
+    path = backup.file_path
+    filename = backup.filename or os.path.basename(path)
+    etag = backup_etag(backup)
+    last_modified = backup.completed_at
+
+    offload = _offload_header(path)
+    if offload:
+        # Range и If-Range фронтенд-сервер обработает сам
+        response = HttpResponse(content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response[offload[0]] = offload[1]
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        return _finish(response, os.path.getsize(path), None, etag, last_modified)
+
+    size = os.path.getsize(path)
+    try:
+        byte_range = requested_range(request, size, etag, last_modified)
+    except RangeNotSatisfiable:
+        return _not_satisfiable(size)
+    start, end = byte_range or (0, size - 1)
+    response = FileResponse(
+        _FileRange(open(path, 'rb'), start, end - start + 1),
+        as_attachment=True,
+        filename=filename,
+    )
+    return _finish(response, size, byte_range, etag, last_modified)
+
+
+def _read_file(path, offset=0):
+    with open(path, 'rb') as part:
+        part.seek(offset)
+        while True:
+            block = part.read(BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def _tar_members(backup):
+    """(имя, размер, mtime, читатель(offset)) файлов копии-каталога"""
+    if backup.manifest:
+        mtime = int((backup.completed_at or backup.created_at).timestamp())
+        return backup.filename, [
+            (entry['name'], entry['size'], mtime, partial(store.iter_file, entry))
+            for entry in backup.manifest['files']
+        ]
+    path = backup.file_path
+    members = []
+    for name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, name)
+        members.append((
+            name, os.path.getsize(file_path), int(os.path.getmtime(file_path)),
+            partial(_read_file, file_path),
+        ))
+    return os.path.basename(path), members
+
+
+def tar_layout(backup):
+    """
+    tar-архив копии как список частей: bytes (заголовки и выравнивание)
+    или (размер, читатель(offset)) для содержимого файлов
+    """
+    root, members = _tar_members(backup)
+    parts = []
+    for name, size, mtime, reader in members:
+        info = tarfile.TarInfo(f'{root}/{name}')
+        info.size = size
+        info.mtime = mtime
+        parts.append(info.tobuf(format=tarfile.PAX_FORMAT))
+        parts.append((size, reader))
+        if size % tarfile.BLOCKSIZE:
+            parts.append(tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+    parts.append(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+    return parts
+
+
+def _part_size(part):
+    return len(part) if isinstance(part, bytes) else part[0]
+
+
+def iter_parts(parts, start, end):
+    """Байты архива с start по end включительно; части до start не читаются"""
+    position = 0
+    for part in parts:
+        size = _part_size(part)
+        if position + size <= start:
+            position += size
+            continue
+        if position > end:
+            break
+        offset = max(start - position, 0)
+        remaining = min(end + 1 - position, size) - offset
+        if isinstance(part, bytes):
+            yield part[offset:offset + remaining]
+        else:
+            for block in part[1](offset):
+                if len(block) >= remaining:
+                    yield block[:remaining]
+                    break
+                yield block
+                remaining -= len(block)
+        position += size
+
+
+def tar_response(request, backup):
+    """Каталог pg_dump или копия из хранилища - tar-архивом, с поддержкой Range"""
+    parts = tar_layout(backup)
+    size = sum(_part_size(part) for part in parts)
+    etag = backup_etag(backup, '-tar')
+    last_modified = backup.completed_at
+    try:
+        byte_range = requested_range(request, size, etag, last_modified)
+    except RangeNotSatisfiable:
+        return _not_satisfiable(size)
+    start, end = byte_range or (0, size - 1)
+    response = StreamingHttpResponse(iter_parts(parts, start, end), content_type='application/x-tar')
+    response['Content-Disposition'] = content_disposition_header(True, f'{backup.filename}.tar')
+    return _finish(response, size, byte_range, etag, last_modified)
+
+
+def can_gzip(backup):
+    """Несжатый SQL-скрипт старого формата можно скачать сжатым на лету"""
+    return backup.dump_format == 'plain' and not backup.file_path.endswith('.gz')
+
+
+def _gzip_stream(path):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in _read_file(path):
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def gzip_response(backup):
+    """
+    SQL-скрипт, сжатый gzip на лету. Размер заранее неизвестен, поэтому
+    без Range - такой файл и так в несколько раз меньше исходного.
+    """
+    filename = backup.filename or os.path.basename(backup.file_path)
+    response = StreamingHttpResponse(_gzip_stream(backup.file_path), content_type='application/gzip')
+    response['Content-Disposition'] = content_disposition_header(True, f'{filename}.gz')
+    return response
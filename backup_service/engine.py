@@ -0,0 +1,400 @@
+"""
+Создание и восстановление резервных копий PostgreSQL.
+
+pg_dump и pg_restore берутся из BACKUP_PG_BIN_DIR или из PATH. Форматы:
+
+* custom - один сжатый архив. pg_dump пишет в канал, а копия сохраняется
+  в файл блоками по 1 МБ; SHA-256 и размер считаются в том же проходе.
+* directory - каталог, таблицы выгружаются параллельно (pg_dump -j
+  BACKUP_JOBS). Контрольная сумма - SHA-256 файлов каталога по порядку
+  имен, размер - их сумма.
+
+При BACKUP_STORE копии directory выгружаются без сжатия и переносятся в
+хранилище с дедупликацией (store.py), где сжимается каждый фрагмент.
+
+Число записей в таблицах берется из статистики PostgreSQL (reltuples,
+n_live_tup) - это оценка, зато без второго чтения всей базы.
+
+Таблицы самого сервиса (backup_service_*) в копию не входят и при
+восстановлении не трогаются: каталог копий и состояние заданий не
+откатываются вместе с базой.
+"""
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+from collections import deque
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import store
+
+
+BACKUP_PG_BIN_DIR = getattr(settings, 'BACKUP_PG_BIN_DIR', None)
+BACKUP_FORMAT = getattr(settings, 'BACKUP_FORMAT', 'custom')
+BACKUP_JOBS = getattr(settings, 'BACKUP_JOBS', 4)
+# Значение pg_dump -Z: уровень gzip или, для pg_dump 16+, "zstd:3", "lz4"
+BACKUP_COMPRESSION = getattr(settings, 'BACKUP_COMPRESSION', '6')
+# Складывать копии directory в хранилище с дедупликацией
+BACKUP_STORE = getattr(settings, 'BACKUP_STORE', False)
+
+BUFFER_SIZE = 1024 * 1024
+
+# Сколько последних строк вывода pg_dump сохранять для сообщения об ошибке
+ERROR_TAIL_LINES = 20
+
+# Таблицы сервиса копий: не выгружаются и не восстанавливаются
+SERVICE_TABLES = 'backup_service_*'
+SERVICE_TABLE_RE = re.compile(r'\bbackup_service_\w+')
+
+# Строки подробного вывода pg_dump и pg_restore с именем текущей таблицы
+TABLE_MARKERS = ('dumping contents of table', 'processing data for table')
+
+
+class BackupError(Exception):
+    """Ошибка создания или восстановления резервной копии"""
+
+
+def pg_tool(name):
+    """Путь к программе PostgreSQL: из BACKUP_PG_BIN_DIR или из PATH"""
+    path = shutil.which(name, path=BACKUP_PG_BIN_DIR) if BACKUP_PG_BIN_DIR else shutil.which(name)
+    if not path:
+        raise BackupError(f'Не найдена программа {name}: добавьте ее в PATH или задайте BACKUP_PG_BIN_DIR')
+    return path
+
+
+def _connection_args():
+    """Аргументы подключения для pg_dump/pg_restore/psql и окружение с паролем"""
+    cfg = connection.settings_dict
+    if connection.vendor != 'postgresql':
+        raise BackupError('Резервное копирование поддерживается только для PostgreSQL')
+
+    args = []
+    if cfg.get('HOST'):
+        args += ['-h', cfg['HOST']]
+    if cfg.get('PORT'):
+        args += ['-p', str(cfg['PORT'])]
+    if cfg.get('USER'):
+        args += ['-U', cfg['USER']]
+
+    env = os.environ.copy()
+    if cfg.get('PASSWORD'):
+        env['PGPASSWORD'] = cfg['PASSWORD']
+    return args, env
+
+
+def backup_path(backup, dump_format):
+    """Путь новой копии в BACKUP_DIR: файл .dump или каталог .dir"""
+    os.makedirs(settings.BACKUP_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = 'dir' if dump_format == 'directory' else 'dump'
+    return os.path.join(settings.BACKUP_DIR, f'backup_{backup.id}_{timestamp}.{extension}')
+
+
+def _table_row_estimates():
+    """
+    Оценка числа записей в таблицах схемы по статистике: reltuples после
+    ANALYZE, n_live_tup для таблиц, которые еще не анализировались.
+    Секции считаются в составе родительской таблицы.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname, (
+                SELECT COALESCE(SUM(
+                    CASE WHEN part.reltuples >= 0 THEN part.reltuples ELSE COALESCE(stat.n_live_tup, 0) END
+                ), 0)::bigint
+                FROM pg_class part
+                LEFT JOIN pg_stat_user_tables stat ON stat.relid = part.oid
+                WHERE part.oid = c.oid AND part.relkind = 'r'
+                   OR part.oid IN (SELECT relid FROM pg_partition_tree(c.oid) WHERE isleaf)
+            )
+            FROM pg_class c
+            WHERE c.relnamespace = current_schema()::regnamespace
+              AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+              AND c.relname NOT LIKE 'backup\\_service\\_%'
+            ORDER BY c.relname
+        """)
+        return dict(cursor.fetchall())
+
+
+def _watch_stderr(process, tail, progress):
+    """
+    Читает подробный вывод pg_dump/pg_restore: последние строки - для
+    ошибки, имя обрабатываемой таблицы - в progress(table=...).
+    """
+    for raw_line in process.stderr:
+        line = raw_line.decode(errors='replace').rstrip()
+        tail.append(line)
+        if progress and any(marker in line for marker in TABLE_MARKERS):
+            progress(table=line.rsplit(' ', 1)[-1].strip('"'))
+
+
+def _run_tool(cmd, env, out_path=None, progress=None):
+    """
+    Запускает pg_dump или pg_restore. Если out_path задан - вывод (архив
+    custom) пишется в файл с подсчетом SHA-256 и размера. Возвращает
+    (sha256, размер) или (None, 0).
+    """
+    tail = deque(maxlen=ERROR_TAIL_LINES)
+    process = subprocess.Popen(
+        cmd,
+        env=env,
+        stdout=subprocess.PIPE if out_path else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        # read(BUFFER_SIZE) ждет полный блок, а не отдельные 64 КБ канала
+        bufsize=BUFFER_SIZE,
+    )
+    watcher = threading.Thread(target=_watch_stderr, args=(process, tail, progress), daemon=True)
+    watcher.start()
+
+    digest, size = hashlib.sha256(), 0
+    try:
+        if out_path:
+            with open(out_path, 'wb', buffering=0) as out:
+                while True:
+                    chunk = process.stdout.read(BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+                    if progress:
+                        progress(bytes_written=size)
+    except BaseException:
+        # Запись не удалась (например, диск заполнен) - вывод больше никто не
+        # читает, и pg_dump навсегда встал бы на записи в канал
+        process.kill()
+        process.wait()
+        watcher.join()
+        if out_path and os.path.exists(out_path):
+            os.remove(out_path)
+        raise
+    finally:
+        if process.stdout:
+            process.stdout.close()
+    returncode = process.wait()
+    watcher.join()
+
+    if returncode != 0:
+        raise BackupError(
+            '\n'.join(line for line in tail if line)
+            or f'{os.path.basename(cmd[0])} завершился с кодом {returncode}'
+        )
+    return (digest.hexdigest(), size) if out_path else (None, 0)
+
+
+def _directory_checksum(path):
+    """SHA-256 и общий размер файлов каталога pg_dump в порядке имен"""
+    digest, size = hashlib.sha256(), 0
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb', buffering=0) as part:
+            digest.update(name.encode())
+            while True:
+                chunk = part.read(BUFFER_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _database_size():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_database_size(current_database())')
+        return cursor.fetchone()[0]
+
+
+def dump_database(backup, dump_format=None, compressed=True, progress=None):
+    """
+    Выгружает базу для записи DatabaseBackup. progress(bytes_written=...,
+    table=...) вызывается по ходу выгрузки. Возвращает поля для
+    сохранения в backup; при ошибке - BackupError, частичные файлы удаляются.
+    """
+    dump_format = dump_format or BACKUP_FORMAT
+    if dump_format not in ('custom', 'directory'):
+        raise BackupError(f'Неподдерживаемый формат резервной копии: {dump_format}')
+
+    args, env = _connection_args()
+    path = backup_path(backup, dump_format)
+    partial = f'{path}.part'
+    # В хранилище сжимаются фрагменты: сжатые pg_dump файлы не дедуплицируются
+    use_store = dump_format == 'directory' and BACKUP_STORE
+
+    cmd = [
+        pg_tool('pg_dump'), *args,
+        '-d', connection.settings_dict['NAME'],
+        '-Z', BACKUP_COMPRESSION if compressed and not use_store else '0',
+        '--verbose',
+        '--exclude-table', SERVICE_TABLES,
+    ]
+    if dump_format == 'directory':
+        cmd += ['-Fd', '-j', str(BACKUP_JOBS), '-f', partial]
+    else:
+        cmd += ['-Fc']
+
+    database_size = _database_size()
+    table_rows = _table_row_estimates()
+    try:
+        checksum, file_size = _run_tool(cmd, env, partial if dump_format == 'custom' else None, progress)
+    except Exception:
+        if os.path.isdir(partial):
+            shutil.rmtree(partial, ignore_errors=True)
+        elif os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    manifest, stored_size = None, file_size
+    if use_store:
+        try:
+            manifest, checksum, file_size, stored_size = store.ingest_directory(
+                partial,
+                level=store.BACKUP_STORE_COMPRESSION if compressed else 0,
+                progress=progress,
+            )
+        finally:
+            shutil.rmtree(partial, ignore_errors=True)
+    elif dump_format == 'directory':
+        checksum, file_size = _directory_checksum(partial)
+        stored_size = file_size
+    if not use_store:
+        os.replace(partial, path)
+
+    return {
+        'file_path': '' if use_store else path,
+        'filename': os.path.basename(path),
+        'file_size': file_size,
+        'manifest': manifest,
+        'stored_size': stored_size,
+        'dump_format': dump_format,
+        'compressed': compressed,
+        'checksum': checksum,
+        'database_name': connection.settings_dict['NAME'],
+        'table_rows': table_rows,
+        'tables_count': len(table_rows),
+        'row_count': sum(table_rows.values()),
+        'compression_ratio': round(database_size / file_size, 2) if file_size else None,
+    }
+
+
+def _restore_list(path, args, env):
+    """
+    Оглавление архива для pg_restore -L без объектов сервиса копий (они
+    есть в копиях, снятых до их исключения из выгрузки)
+    """
+    result = subprocess.run(
+        [pg_tool('pg_restore'), *args, '-l', path], env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise BackupError(result.stderr.strip() or 'Не удалось прочитать оглавление копии')
+    return ''.join(
+        line + '\n' for line in result.stdout.splitlines()
+        if not SERVICE_TABLE_RE.search(line)
+    )
+
+
+def _detach_service_tables(cursor):
+    """
+    Снимает внешние ключи таблиц сервиса на остальные таблицы (иначе
+    pg_restore --clean не удалит, например, auth_user). Возвращает
+    [(таблица, ограничение, определение, колонка, таблица ссылки, колонка ссылки)].
+    """
+    cursor.execute("""
+        SELECT c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid),
+               a.attname, c.confrelid::regclass::text, fa.attname
+        FROM pg_constraint c
+        JOIN pg_class t ON t.oid = c.conrelid
+        JOIN pg_class ft ON ft.oid = c.confrelid
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+        JOIN pg_attribute fa ON fa.attrelid = c.confrelid AND fa.attnum = c.confkey[1]
+        WHERE c.contype = 'f'
+          AND t.relnamespace = current_schema()::regnamespace
+          AND t.relname LIKE 'backup\\_service\\_%'
+          AND ft.relname NOT LIKE 'backup\\_service\\_%'
+    """)
+    keys = cursor.fetchall()
+    for table, name, _, _, _, _ in keys:
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {connection.ops.quote_name(name)}')
+    return keys
+
+
+def _attach_service_tables(cursor, keys):
+    """
+    Возвращает внешние ключи, снятые _detach_service_tables. Ссылки на
+    записи, которых в восстановленной базе нет (например, пользователь
+    создан после копии), обнуляются.
+    """
+    quote = connection.ops.quote_name
+    for table, name, definition, column, ref_table, ref_column in keys:
+        cursor.execute(
+            f'UPDATE {table} t SET {quote(column)} = NULL '
+            f'WHERE {quote(column)} IS NOT NULL AND NOT EXISTS '
+            f'(SELECT 1 FROM {ref_table} r WHERE r.{quote(ref_column)} = t.{quote(column)})'
+        )
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {quote(name)} {definition}')
+
+
+def _terminate_other_connections(database):
+    """Остальные соединения мешают удалению и созданию таблиц"""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT pg_terminate_backend(pid)
+            FROM pg_stat_activity
+            WHERE datname = %s AND pid <> pg_backend_pid()
+        """, [database])
+
+
+def restore_database(backup, progress=None):
+    """
+    Восстанавливает базу из копии: архивы custom и directory - через
+    pg_restore --clean (каталог - в BACKUP_JOBS потоков), старые
+    SQL-скрипты - через psql. Копия из хранилища сначала собирается во
+    временный каталог. progress(table=...) вызывается по ходу
+    восстановления архива.
+    """
+    if not backup.manifest and (not backup.file_path or not os.path.exists(backup.file_path)):
+        raise BackupError('Файл резервной копии не найден')
+
+    args, env = _connection_args()
+    database = connection.settings_dict['NAME']
+
+    if backup.dump_format == 'plain':
+        cmd = [pg_tool('psql'), *args, '-d', database, '-v', 'ON_ERROR_STOP=1', '-f', backup.file_path]
+        _terminate_other_connections(database)
+        result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise BackupError(result.stderr.strip() or f'Восстановление завершилось с кодом {result.returncode}')
+        return
+
+    source = backup.file_path
+    if backup.manifest:
+        source = os.path.join(settings.BACKUP_DIR, f'restore_{backup.id}.dir')
+        shutil.rmtree(source, ignore_errors=True)
+    list_path = f'{source.rstrip(os.sep)}.list'
+    cmd = [
+        pg_tool('pg_restore'), *args, '-d', database,
+        '--clean', '--if-exists', '--no-owner', '-j', str(BACKUP_JOBS),
+        '--verbose', '-L', list_path,
+        source,
+    ]
+    try:
+        if backup.manifest:
+            store.materialize(backup.manifest, source)
+        with open(list_path, 'w') as toc:
+            toc.write(_restore_list(source, args, env))
+        _terminate_other_connections(database)
+        with transaction.atomic(), connection.cursor() as cursor:
+            keys = _detach_service_tables(cursor)
+        try:
+            _run_tool(cmd, env, progress=progress)
+        finally:
+            with transaction.atomic(), connection.cursor() as cursor:
+                _attach_service_tables(cursor, keys)
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+        if backup.manifest:
+            shutil.rmtree(source, ignore_errors=True)
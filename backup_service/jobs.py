@@ -0,0 +1,333 @@
+"""
+Создание и восстановление копий как фоновые задания.
+
+Запрос только ставит задание: создание - запись DatabaseBackup со
+статусом 'pending', восстановление - перевод копии в 'restoring'.
+Выполняет их обработчик - команда run_backup_worker или, при
+BACKUP_RUN_IN_PROCESS, поток в процессе сайта. Обработчик забирает
+задание через SELECT ... FOR UPDATE SKIP LOCKED, поэтому несколько
+обработчиков не возьмут одно и то же, и раз в HEARTBEAT_SECONDS пишет в
+запись прогресс (байты, текущая таблица) - его отдает backup_status.
+Задание, обработчик которого перестал отзываться, забирает другой. Если
+обработчика нет (процесс сайта перезапустили посреди выгрузки), его
+запускают следующая попытка поставить задание и каждый шаг планировщика.
+
+Ограничение backup_one_active_job не дает поставить вторую копию, пока
+создается первая, - повторный клик по кнопке не запустит вторую выгрузку.
+Копию и восстановление ставят под одной advisory-блокировкой очереди:
+проверка "нет задания другого вида" и постановка своего не разойдутся.
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .engine import BackupError, dump_database, restore_database
+from .models import BackupLog, DatabaseBackup
+
+
+logger = logging.getLogger(__name__)
+
+# Выполнять задания в потоке процесса сайта; без этого нужен run_backup_worker
+BACKUP_RUN_IN_PROCESS = getattr(settings, 'BACKUP_RUN_IN_PROCESS', True)
+BACKUP_WORKER_POLL_SECONDS = getattr(settings, 'BACKUP_WORKER_POLL_SECONDS', 5)
+
+HEARTBEAT_SECONDS = 2
+
+# Задание, обработчик которого столько не отзывался, считается брошенным
+STALE_AFTER = timedelta(minutes=1)
+
+ACTIVE_STATUSES = ['pending', 'restoring']
+
+# Ключ advisory-блокировки очереди заданий, один для всех процессов
+QUEUE_LOCK_KEY = 0x62616B71
+
+_background_lock = threading.Lock()
+_background_thread = None
+_background_wakeup = threading.Event()
+
+
+def worker_name():
+    """Имя обработчика для записи: хост и pid"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def lock_queue():
+    """Блокировка очереди до конца транзакции"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [QUEUE_LOCK_KEY])
+
+
+def claimable_jobs(now=None):
+    """Задания, которые может забрать обработчик: еще не взятые или брошенные"""
+    now = now or timezone.now()
+    return DatabaseBackup.objects.filter(status__in=ACTIVE_STATUSES).filter(
+        Q(worker='') | Q(heartbeat_at__lt=now - STALE_AFTER)
+    )
+
+
+def resume_stale_jobs():
+    """
+    Запускает обработчик, если есть задание, которое никто не выполняет -
+    например, процесс сайта перезапустили посреди выгрузки. Без этого
+    задание оставалось бы активным навсегда и не давало поставить новое.
+    """
+    if claimable_jobs().exists():
+        start_background_worker()
+
+
+def enqueue_backup(name, description='', compressed=True, user=None, backup_type='manual', schedule=None):
+    """Ставит создание копии в очередь; BackupError, если копия уже создается"""
+    try:
+        with transaction.atomic():
+            lock_queue()
+            if DatabaseBackup.objects.filter(status='restoring').exists():
+                raise BackupError('Идет восстановление базы, дождитесь его завершения')
+            return DatabaseBackup.objects.create(
+                name=name,
+                description=description,
+                backup_type=backup_type,
+                status='pending',
+                compressed=compressed,
+                created_by=user,
+                schedule=schedule,
+            )
+    except BackupError:
+        resume_stale_jobs()
+        raise
+    except IntegrityError:
+        resume_stale_jobs()
+        raise BackupError('Резервная копия уже создается, дождитесь ее завершения')
+
+
+def enqueue_restore(backup, user=None):
+    """Ставит восстановление из копии в очередь; BackupError, если нельзя"""
+    try:
+        with transaction.atomic():
+            lock_queue()
+            if DatabaseBackup.objects.filter(status='pending').exists():
+                raise BackupError('Создается резервная копия, дождитесь ее завершения')
+            updated = DatabaseBackup.objects.filter(pk=backup.pk, status='completed').update(
+                status='restoring',
+                worker='',
+                started_at=None,
+                heartbeat_at=None,
+                progress_bytes=0,
+                progress_table='',
+                error_message='',
+                restore_requested_by=user,
+            )
+    except BackupError:
+        resume_stale_jobs()
+        raise
+    except IntegrityError:
+        resume_stale_jobs()
+        raise BackupError('Восстановление уже выполняется')
+    if not updated:
+        raise BackupError('Эта копия недоступна для восстановления')
+    backup.refresh_from_db()
+    return backup
+
+
+def delete_backup(backup_id):
+    """
+    Удаляет копию; BackupError, если по ней идет задание. Строка
+    блокируется, поэтому обработчик не заберет ее, пока идет удаление.
+    DatabaseBackup.DoesNotExist, если копии уже нет.
+    """
+    with transaction.atomic():
+        backup = DatabaseBackup.objects.select_for_update().get(pk=backup_id)
+        if backup.status in ACTIVE_STATUSES:
+            raise BackupError('По копии выполняется задание, дождитесь его завершения')
+        backup.delete()
+    return backup
+
+
+def claim_job(worker):
+    """
+    Забирает самое старое ожидающее задание (или брошенное другим
+    обработчиком). Заблокированные строки пропускаются - их уже забирает
+    другой обработчик. None, если заданий нет.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        backup = (
+            claimable_jobs(now).select_for_update(skip_locked=True)
+            .order_by('created_at')
+            .first()
+        )
+        if backup is None:
+            return None
+        backup.worker = worker
+        backup.started_at = backup.heartbeat_at = now
+        backup.progress_bytes = 0
+        backup.progress_table = ''
+        backup.save(update_fields=['worker', 'started_at', 'heartbeat_at', 'progress_bytes', 'progress_table'])
+    return backup
+
+
+class _Heartbeat(threading.Thread):
+    """
+    Раз в HEARTBEAT_SECONDS пишет в запись задания прогресс и время
+    отклика. Прогресс передается через update() - его вызывают движок и
+    поток чтения вывода pg_dump.
+    """
+
+    def __init__(self, backup, worker):
+        super().__init__(name=f'backup-heartbeat-{backup.pk}', daemon=True)
+        self.backup_id = backup.pk
+        self.worker = worker
+        self.bytes_written = 0
+        self.table = ''
+        self._finished = threading.Event()
+
+    def update(self, bytes_written=None, table=None):
+        if bytes_written is not None:
+            self.bytes_written = bytes_written
+        if table is not None:
+            self.table = table
+
+    def run(self):
+        try:
+            while not self._finished.wait(HEARTBEAT_SECONDS):
+                self._flush()
+        finally:
+            connection.close()
+
+    def _flush(self):
+        try:
+            DatabaseBackup.objects.filter(pk=self.backup_id, worker=self.worker).update(
+                heartbeat_at=timezone.now(),
+                progress_bytes=self.bytes_written,
+                progress_table=self.table[:255],
+            )
+        except DatabaseError:
+            # Восстановление обрывает чужие соединения - переподключимся
+            # на следующем шаге
+            connection.close()
+
+    def stop(self):
+        self._finished.set()
+        self.join()
+
+
+def run_job(backup, worker):
+    """Выполняет забранное задание и записывает результат"""
+    restoring = backup.status == 'restoring'
+    heartbeat = _Heartbeat(backup, worker)
+    heartbeat.start()
+    error, fields = None, {}
+    try:
+        if restoring:
+            restore_database(backup, progress=heartbeat.update)
+        else:
+            fields = dump_database(backup, compressed=backup.compressed, progress=heartbeat.update)
+    except BackupError as exc:
+        error = exc
+    except Exception as exc:
+        logger.exception('Задание резервного копирования #%s завершилось ошибкой', backup.pk)
+        error = exc
+    finally:
+        heartbeat.stop()
+
+    # После восстановления ссылки на пользователей могли обнулиться
+    try:
+        backup.refresh_from_db()
+    except DatabaseBackup.DoesNotExist:
+        # Запись удалили во время задания (например, в админке) - созданные
+        # файлы и фрагменты хранилища больше никому не принадлежат
+        logger.warning('Задание резервного копирования #%s: запись удалена во время выполнения', backup.pk)
+        for field, value in fields.items():
+            setattr(backup, field, value)
+        if fields:
+            backup.delete_files(backup.release_chunks())
+        return False
+    backup.worker = ''
+    backup.heartbeat_at = timezone.now()
+    backup.progress_table = ''
+
+    if restoring:
+        # Копия остается целой; ошибка последнего восстановления - в error_message
+        backup.status = 'completed'
+        backup.error_message = str(error) if error else ''
+        backup.save()
+        BackupLog.objects.create(
+            backup=backup,
+            action='restore',
+            user=backup.restore_requested_by,
+            details=f'Ошибка восстановления: {error}' if error else 'База данных восстановлена',
+        )
+    elif error:
+        backup.status = 'failed'
+        backup.error_message = str(error)
+        backup.save()
+    else:
+        for field, value in fields.items():
+            setattr(backup, field, value)
+        backup.status = 'completed'
+        backup.completed_at = timezone.now()
+        backup.progress_bytes = backup.file_size
+        backup.save()
+        BackupLog.objects.create(
+            backup=backup,
+            action='create',
+            user=backup.created_by,
+            details=f'Создана резервная копия {backup.filename}',
+        )
+    return error is None
+
+
+def run_pending_jobs(worker=None):
+    """Выполняет задания, пока они есть. Возвращает число выполненных"""
+    worker = worker or worker_name()
+    done = 0
+    while True:
+        backup = claim_job(worker)
+        if backup is None:
+            return done
+        run_job(backup, worker)
+        done += 1
+
+
+def _run_in_background():
+    global _background_thread
+    try:
+        while True:
+            _background_wakeup.clear()
+            run_pending_jobs()
+            # Задание, поставленное, пока поток заканчивал, не должно ждать
+            with _background_lock:
+                if not _background_wakeup.is_set():
+                    _background_thread = None
+                    return
+    except Exception:
+        logger.exception('Фоновый обработчик резервных копий остановлен')
+        with _background_lock:
+            _background_thread = None
+    finally:
+        connection.close()
+
+
+def start_background_worker():
+    """
+    Запускает обработку заданий в фоновом потоке процесса сайта, если это
+    разрешено BACKUP_RUN_IN_PROCESS; работающий поток просто проверит
+    очередь еще раз
+    """
+    global _background_thread
+    if not BACKUP_RUN_IN_PROCESS:
+        return None
+    with _background_lock:
+        _background_wakeup.set()
+        if _background_thread is None:
+            _background_thread = threading.Thread(
+                target=_run_in_background, name='backup-worker', daemon=True,
+            )
+            _background_thread.start()
+        return _background_thread
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from backup_service.store import StoreError, collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает ссылки на фрагменты хранилища копий по манифестам и '
+        'удаляет фрагменты и файлы, на которые никто не ссылается. Нужна '
+        'после сбоя процесса во время удаления или создания копии'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Хранилище копий работает только с PostgreSQL')
+        try:
+            fixed, removed, removed_files, missing = collect_garbage()
+        except StoreError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков: {fixed}, удалено фрагментов: {removed}, '
+            f'удалено лишних файлов: {removed_files}'
+        ))
+        if missing:
+            self.stderr.write(f'В хранилище нет фрагментов, на которые ссылаются копии: {missing}')
@@ -0,0 +1,83 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from backup_service.jobs import BACKUP_RUN_IN_PROCESS, run_pending_jobs, start_background_worker
+from backup_service.scheduler import (
+    BACKUP_SCHEDULER_POLL_SECONDS, acquire_leadership, apply_retention, release_leadership,
+    run_due_schedules, seconds_until_next_run,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Планировщик резервных копий: ставит в очередь копии по расписаниям '
+        'и удаляет копии сверх keep_last. Можно запускать на нескольких '
+        'серверах - работать будет один процесс, остальные ждут в резерве'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить один шаг и завершиться',
+        )
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=BACKUP_SCHEDULER_POLL_SECONDS,
+            help='Наибольший интервал между проверками расписаний, с',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Планировщик работает только с PostgreSQL')
+        if options['poll'] <= 0:
+            raise CommandError('--poll должен быть больше нуля')
+
+        leader = False
+        try:
+            while True:
+                try:
+                    if not leader:
+                        leader = acquire_leadership()
+                        if leader:
+                            self.stdout.write(self.style.SUCCESS('Планировщик запущен'))
+                        elif options['once']:
+                            raise CommandError('Планировщик уже работает в другом процессе')
+                    if leader:
+                        for backup in run_due_schedules():
+                            self.stdout.write(f'Поставлена копия "{backup.name}"')
+                        # Заодно забираются задания, брошенные упавшим процессом сайта;
+                        # без BACKUP_RUN_IN_PROCESS их выполнит run_backup_worker
+                        if options['once'] and BACKUP_RUN_IN_PROCESS:
+                            # Фоновый поток погиб бы вместе с командой посреди выгрузки
+                            done = run_pending_jobs()
+                            if done:
+                                self.stdout.write(f'Выполнено заданий: {done}')
+                        else:
+                            start_background_worker()
+                        removed = apply_retention()
+                        if removed:
+                            self.stdout.write(f'Удалено старых копий: {removed}')
+                    wait = seconds_until_next_run(options['poll']) if leader else options['poll']
+                except DatabaseError as exc:
+                    # Соединение оборвалось (например, при восстановлении базы),
+                    # блокировка пропала вместе с ним
+                    self.stderr.write(f'Ошибка базы данных: {exc}')
+                    connection.close()
+                    leader = False
+                    wait = options['poll']
+
+                if options['once']:
+                    return
+                time.sleep(wait)
+        except KeyboardInterrupt:
+            self.stdout.write('Планировщик остановлен')
+        finally:
+            if leader:
+                try:
+                    release_leadership()
+                except DatabaseError:
+                    pass
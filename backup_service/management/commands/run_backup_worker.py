@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backup_service.jobs import BACKUP_WORKER_POLL_SECONDS, run_pending_jobs, worker_name
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет задания резервного копирования и восстановления, '
+        'поставленные из интерфейса. Можно запускать несколько обработчиков: '
+        'каждое задание достанется одному из них'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Выполнить ожидающие задания и завершиться',
+        )
+        parser.add_argument(
+            '--poll',
+            type=float,
+            default=BACKUP_WORKER_POLL_SECONDS,
+            help='Интервал проверки очереди, с',
+        )
+
+    def handle(self, *args, **options):
+        if options['poll'] <= 0:
+            raise CommandError('--poll должен быть больше нуля')
+
+        worker = worker_name()
+        self.stdout.write(f'Обработчик {worker} запущен')
+        try:
+            while True:
+                done = run_pending_jobs(worker)
+                if done:
+                    self.stdout.write(self.style.SUCCESS(f'Выполнено заданий: {done}'))
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            self.stdout.write('Обработчик остановлен')
@@ -0,0 +1,42 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup_service', '0001_initial'),
+    ]
+
+    operations = [
+        # Существующие копии - несжатые SQL-скрипты pg_dump
+        migrations.AddField(
+            model_name='databasebackup',
+            name='dump_format',
+            field=models.CharField(choices=[('plain', 'SQL-скрипт'), ('custom', 'Архив pg_dump'), ('directory', 'Каталог pg_dump')], default='plain', max_length=20, verbose_name='Формат'),
+        ),
+        migrations.AlterField(
+            model_name='databasebackup',
+            name='dump_format',
+            field=models.CharField(choices=[('plain', 'SQL-скрипт'), ('custom', 'Архив pg_dump'), ('directory', 'Каталог pg_dump')], default='custom', max_length=20, verbose_name='Формат'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='compressed',
+            field=models.BooleanField(default=False, verbose_name='Сжатие'),
+        ),
+        migrations.AlterField(
+            model_name='databasebackup',
+            name='compressed',
+            field=models.BooleanField(default=True, verbose_name='Сжатие'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=64, verbose_name='SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='table_rows',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Записей по таблицам'),
+        ),
+    ]
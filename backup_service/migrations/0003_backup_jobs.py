@@ -0,0 +1,61 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def close_stuck_jobs(apps, schema_editor):
+    """
+    Копии, оставшиеся 'pending'/'restoring' после обрыва запроса, уже
+    никто не выполнит - иначе они помешают ограничению на одно задание
+    """
+    DatabaseBackup = apps.get_model('backup_service', 'DatabaseBackup')
+    DatabaseBackup.objects.filter(status='pending').update(
+        status='failed', error_message='Создание прервано',
+    )
+    DatabaseBackup.objects.filter(status='restoring').update(status='completed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('backup_service', '0002_backup_format_checksum'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_stuck_jobs, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='worker',
+            field=models.CharField(blank=True, max_length=100, verbose_name='Обработчик'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Начато'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последний отклик обработчика'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='progress_bytes',
+            field=models.BigIntegerField(default=0, verbose_name='Записано байт'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='progress_table',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Текущая таблица'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='restore_requested_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Запросил восстановление'),
+        ),
+        migrations.AddConstraint(
+            model_name='databasebackup',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'restoring'])), fields=('status',), name='backup_one_active_job'),
+        ),
+    ]
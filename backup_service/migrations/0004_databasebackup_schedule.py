@@ -0,0 +1,17 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup_service', '0003_backup_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='databasebackup',
+            name='schedule',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='backups', to='backup_service.backupschedule', verbose_name='Расписание'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backup_service', '0004_databasebackup_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackupChunk',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='SHA-256')),
+                ('size', models.BigIntegerField(verbose_name='Размер (байт)')),
+                ('stored_size', models.BigIntegerField(default=0, verbose_name='Размер на диске (байт)')),
+                ('refcount', models.IntegerField(default=0, verbose_name='Ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+            ],
+            options={
+                'verbose_name': 'Фрагмент копии',
+                'verbose_name_plural': 'Фрагменты копий',
+            },
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='manifest',
+            field=models.JSONField(blank=True, null=True, verbose_name='Состав копии в хранилище'),
+        ),
+        migrations.AddField(
+            model_name='databasebackup',
+            name='stored_size',
+            field=models.BigIntegerField(default=0, verbose_name='Записано новых данных (байт)'),
+        ),
+    ]
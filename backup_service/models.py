@@ -1,6 +1,17 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 import os
+import shutil
+
+
+def format_size(size):
+    """Форматирование размера"""
+    for unit in ['Б', 'КБ', 'МБ', 'ГБ']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} ТБ"
+
 
 class DatabaseBackup(models.Model):
     """Модель для хранения информации о резервных копиях"""
@@ -18,15 +29,27 @@ class DatabaseBackup(models.Model):
         ('restoring', 'Восстановление'),
     ]
     
+    FORMAT_CHOICES = [
+        ('plain', 'SQL-скрипт'),
+        ('custom', 'Архив pg_dump'),
+        ('directory', 'Каталог pg_dump'),
+    ]
+    
     name = models.CharField('Название', max_length=255)
     filename = models.CharField('Имя файла', max_length=255, blank=True)
     file_path = models.CharField('Путь к файлу', max_length=500, blank=True)
     file_size = models.BigIntegerField('Размер файла (байт)', default=0)
+    dump_format = models.CharField('Формат', max_length=20, choices=FORMAT_CHOICES, default='custom')
+    compressed = models.BooleanField('Сжатие', default=True)
     
     backup_type = models.CharField('Тип', max_length=20, choices=BACKUP_TYPES, default='manual')
     status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default='pending')
     
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, verbose_name='Создал')
+    schedule = models.ForeignKey(
+        'BackupSchedule', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='backups', verbose_name='Расписание'
+    )
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     completed_at = models.DateTimeField('Дата завершения', null=True, blank=True)
     
@@ -41,32 +64,100 @@ class DatabaseBackup(models.Model):
     # Метаданные
     compression_ratio = models.FloatField('Степень сжатия', null=True, blank=True)
     md5_hash = models.CharField('MD5 хеш', max_length=32, blank=True)
+    checksum = models.CharField('SHA-256', max_length=64, blank=True)
+    table_rows = models.JSONField('Записей по таблицам', default=dict, blank=True)
+    
+    # Копия в хранилище с дедупликацией (store.py): файлы каталога pg_dump
+    # как списки фрагментов; file_path у такой копии пустой
+    manifest = models.JSONField('Состав копии в хранилище', null=True, blank=True)
+    stored_size = models.BigIntegerField('Записано новых данных (байт)', default=0)
+    
+    # Выполнение задания (создание - status='pending', восстановление -
+    # status='restoring'), см. jobs.py
+    worker = models.CharField('Обработчик', max_length=100, blank=True)
+    started_at = models.DateTimeField('Начато', null=True, blank=True)
+    heartbeat_at = models.DateTimeField('Последний отклик обработчика', null=True, blank=True)
+    progress_bytes = models.BigIntegerField('Записано байт', default=0)
+    progress_table = models.CharField('Текущая таблица', max_length=255, blank=True)
+    restore_requested_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+        verbose_name='Запросил восстановление'
+    )
     
     class Meta:
         verbose_name = 'Резервная копия'
         verbose_name_plural = 'Резервные копии'
         ordering = ['-created_at']
+        constraints = [
+            # Одновременно создается не больше одной копии и идет не больше
+            # одного восстановления - повторный клик не запустит вторую выгрузку
+            models.UniqueConstraint(
+                fields=['status'],
+                condition=models.Q(status__in=['pending', 'restoring']),
+                name='backup_one_active_job',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.created_at.strftime('%d.%m.%Y %H:%M')}"
     
-    def delete(self, *args, **kwargs):
-        """Удаляем файл при удалении записи"""
+    def release_chunks(self):
+        """
+        Убирает ссылки копии на фрагменты хранилища - в транзакции удаления
+        записи. Возвращает фрагменты, оставшиеся без ссылок.
+        """
+        if not self.manifest:
+            return []
+        from .store import manifest_chunks, unreference_chunks
+        return unreference_chunks(manifest_chunks(self.manifest))
+    
+    def delete_files(self, unreferenced=()):
+        """Удаляет файл (или каталог pg_dump) копии и фрагменты хранилища, оставшиеся без ссылок"""
+        if unreferenced:
+            from .store import remove_unreferenced
+            remove_unreferenced(unreferenced)
         if self.file_path and os.path.exists(self.file_path):
             try:
-                os.remove(self.file_path)
+                if os.path.isdir(self.file_path):
+                    shutil.rmtree(self.file_path)
+                else:
+                    os.remove(self.file_path)
             except:
                 pass
-        super().delete(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        """
+        Удаляем файл (или каталог pg_dump) при удалении записи. Запись и
+        ссылки на фрагменты удаляются в одной транзакции, файлы - после ее
+        фиксации, поэтому откат не оставит запись без файлов.
+        """
+        with transaction.atomic():
+            unreferenced = self.release_chunks()
+            result = super().delete(*args, **kwargs)
+            transaction.on_commit(lambda: self.delete_files(unreferenced))
+        return result
     
     def get_file_size_display(self):
         """Форматирование размера файла"""
-        size = self.file_size
-        for unit in ['Б', 'КБ', 'МБ', 'ГБ']:
-            if size < 1024.0:
-                return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} ТБ"
+        return format_size(self.file_size)
+    
+    def get_stored_size_display(self):
+        """Сколько копия записала новых фрагментов в хранилище"""
+        return format_size(self.stored_size)
+
+
+class BackupChunk(models.Model):
+    """Фрагмент хранилища копий; refcount - число ссылок на него из манифестов"""
+    
+    hash = models.CharField('SHA-256', max_length=64, primary_key=True)
+    size = models.BigIntegerField('Размер (байт)')
+    stored_size = models.BigIntegerField('Размер на диске (байт)', default=0)
+    refcount = models.IntegerField('Ссылок', default=0)
+    created_at = models.DateTimeField('Создан', auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Фрагмент копии'
+        verbose_name_plural = 'Фрагменты копий'
 
 
 class BackupSchedule(models.Model):
@@ -136,6 +227,10 @@ class BackupSchedule(models.Model):
             return f"Еженедельно по {day_name} в {self.time.strftime('%H:%M')}"
         elif self.frequency == 'monthly':
             day = self.day_of_month if self.day_of_month else 1
+            if day == -1:
+                return f"Ежемесячно в последний день месяца в {self.time.strftime('%H:%M')}"
+            if day < 0:
+                return f"Ежемесячно за {-day - 1} дн. до конца месяца в {self.time.strftime('%H:%M')}"
             return f"Ежемесячно {day}-го числа в {self.time.strftime('%H:%M')}"
         return "Не задано"
 
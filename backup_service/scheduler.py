@@ -0,0 +1,215 @@
+"""
+Копии по расписанию BackupSchedule.
+
+Команда run_backup_scheduler раз в BACKUP_SCHEDULER_POLL_SECONDS ставит
+в очередь копии расписаний, у которых наступил next_run, и удаляет копии
+сверх keep_last. Планировщиком работает один процесс - тот, кто держит
+advisory-блокировку PostgreSQL; остальные ждут на случай его остановки.
+
+Время запуска считается по часовому поясу проекта. К нему добавляется
+постоянный для расписания сдвиг до BACKUP_SCHEDULE_JITTER_SECONDS, чтобы
+расписания на 03:00 не запускались одновременно. Если планировщик не
+работал и запуски пропущены, копия делается один раз сразу после старта,
+а следующий запуск - снова по расписанию.
+"""
+import calendar
+import logging
+import random
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_time
+
+from .engine import BackupError
+from .jobs import ACTIVE_STATUSES, enqueue_backup
+from .models import BackupSchedule, DatabaseBackup
+from .store import remove_unreferenced
+
+
+logger = logging.getLogger(__name__)
+
+BACKUP_SCHEDULER_POLL_SECONDS = getattr(settings, 'BACKUP_SCHEDULER_POLL_SECONDS', 30)
+BACKUP_SCHEDULE_JITTER_SECONDS = getattr(settings, 'BACKUP_SCHEDULE_JITTER_SECONDS', 300)
+
+# Ключ advisory-блокировки планировщика, один для всех процессов
+SCHEDULER_LOCK_KEY = 0x62616B73
+
+# Копии в этих статусах удаляются по keep_last; по остальным идет задание
+FINISHED_STATUSES = ['completed', 'failed']
+
+# От этой даты отсчитываются интервалы почасовых расписаний
+HOURLY_ANCHOR = date(2000, 1, 1)
+
+
+def _at(day, schedule):
+    """Время расписания в день day по часовому поясу проекта"""
+    # У только что созданной записи time может остаться строкой по умолчанию
+    return timezone.make_aware(datetime.combine(day, parse_time(str(schedule.time))))
+
+
+def _month_day(year, month, day_of_month):
+    """
+    День месяца расписания: отрицательные считаются с конца (-1 -
+    последний день), номера больше длины месяца - последний день
+    """
+    days = calendar.monthrange(year, month)[1]
+    day = day_of_month or 1
+    if day < 0:
+        day += days + 1
+    return date(year, month, min(max(day, 1), days))
+
+
+def next_slot(schedule, after):
+    """Ближайшее время по расписанию строго позже after, без сдвига"""
+    local = timezone.localtime(after)
+
+    if schedule.frequency == 'hourly':
+        # Считаем в UTC, чтобы переход на летнее время не сбивал интервал
+        interval = timedelta(hours=max(schedule.interval_hours, 1))
+        anchor = _at(HOURLY_ANCHOR, schedule).astimezone(dt_timezone.utc)
+        return anchor + ((after - anchor) // interval + 1) * interval
+
+    if schedule.frequency == 'monthly':
+        year, month = local.year, local.month
+        while True:
+            candidate = _at(_month_day(year, month, schedule.day_of_month), schedule)
+            if candidate > after:
+                return candidate
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    day = local.date()
+    step = timedelta(days=1)
+    if schedule.frequency == 'weekly':
+        day += timedelta(days=((schedule.day_of_week or 0) - day.weekday()) % 7)
+        step = timedelta(days=7)
+    candidate = _at(day, schedule)
+    return candidate if candidate > after else _at(day + step, schedule)
+
+
+def schedule_jitter(schedule):
+    """Постоянный для расписания сдвиг запуска от 0 до BACKUP_SCHEDULE_JITTER_SECONDS"""
+    if not BACKUP_SCHEDULE_JITTER_SECONDS or not schedule.pk:
+        return timedelta(0)
+    return timedelta(seconds=random.Random(schedule.pk).randrange(BACKUP_SCHEDULE_JITTER_SECONDS))
+
+
+def compute_next_run(schedule, after=None):
+    """Следующий запуск расписания после after (по умолчанию - после текущего момента)"""
+    after = after or timezone.now()
+    jitter = schedule_jitter(schedule)
+    return next_slot(schedule, after - jitter) + jitter
+
+
+def run_due_schedules(now=None):
+    """
+    Ставит в очередь копии расписаний, время которых наступило. Пропущенные
+    за время простоя запуски заменяются одной копией. Пока создается
+    другая копия, расписание остается наступившим и будет поставлено на
+    следующем шаге. Возвращает поставленные копии.
+    """
+    now = now or timezone.now()
+
+    # Новым и заново включенным расписаниям только назначается время
+    for schedule in BackupSchedule.objects.filter(is_active=True, next_run__isnull=True):
+        schedule.next_run = compute_next_run(schedule, now)
+        schedule.save(update_fields=['next_run'])
+
+    enqueued = []
+    for schedule in BackupSchedule.objects.filter(is_active=True, next_run__lte=now).order_by('next_run'):
+        description = f'Автоматическая копия по расписанию "{schedule.name}"'
+        following = compute_next_run(schedule, schedule.next_run)
+        if following <= now:
+            description += f', пропущены запуски с {timezone.localtime(schedule.next_run):%d.%m.%Y %H:%M}'
+            logger.warning('Расписание "%s": пропущены запуски с %s', schedule.name, schedule.next_run)
+        try:
+            with transaction.atomic():
+                backup = enqueue_backup(
+                    name=f'{schedule.name} {timezone.localtime(now):%d.%m.%Y %H:%M}',
+                    description=description,
+                    compressed=schedule.compression,
+                    backup_type='scheduled',
+                    schedule=schedule,
+                )
+                schedule.last_run = now
+                schedule.next_run = compute_next_run(schedule, now)
+                schedule.save(update_fields=['last_run', 'next_run'])
+        except BackupError as exc:
+            logger.info('Расписание "%s" ждет: %s', schedule.name, exc)
+            break
+        enqueued.append(backup)
+    return enqueued
+
+
+def _delete_files(backups, unreferenced):
+    remove_unreferenced(unreferenced)
+    for backup in backups:
+        backup.delete_files()
+
+
+def apply_retention():
+    """
+    Оставляет у каждого расписания keep_last последних завершенных копий.
+    Более старые копии (и неудачные попытки до них) удаляются одним
+    запросом вместе с их ссылками на фрагменты хранилища, файлы - после
+    фиксации. Возвращает число удаленных копий.
+    """
+    expired = []
+    for schedule in BackupSchedule.objects.filter(keep_last__gt=0):
+        backups = DatabaseBackup.objects.filter(schedule=schedule)
+        kept = list(
+            backups.filter(status='completed').order_by('-created_at')
+            .values_list('created_at', flat=True)[:schedule.keep_last]
+        )
+        if len(kept) < schedule.keep_last:
+            continue
+        expired += backups.filter(
+            status__in=FINISHED_STATUSES, created_at__lt=kept[-1],
+        ).values_list('pk', flat=True)
+
+    if not expired:
+        return 0
+    with transaction.atomic():
+        # Строки блокируются и статус проверяется заново: копию, из которой
+        # тем временем начали восстанавливать базу, не трогаем
+        expired = list(
+            DatabaseBackup.objects.select_for_update()
+            .filter(pk__in=expired, status__in=FINISHED_STATUSES)
+            .only('pk', 'file_path', 'manifest')
+        )
+        unreferenced = [digest for backup in expired for digest in backup.release_chunks()]
+        DatabaseBackup.objects.filter(pk__in=[backup.pk for backup in expired]).delete()
+        transaction.on_commit(lambda: _delete_files(expired, unreferenced))
+    if not expired:
+        return 0
+    logger.info('Удалено копий по keep_last: %s', len(expired))
+    return len(expired)
+
+
+def seconds_until_next_run(poll=BACKUP_SCHEDULER_POLL_SECONDS):
+    """Сколько ждать до следующего шага: до ближайшего запуска, но не дольше poll"""
+    nearest = BackupSchedule.objects.filter(is_active=True).aggregate(nearest=Min('next_run'))['nearest']
+    if nearest is None:
+        return poll
+    # Пока выполняется задание, наступившее расписание все равно не встанет
+    # в очередь - проверять его каждую секунду незачем
+    if DatabaseBackup.objects.filter(status__in=ACTIVE_STATUSES).exists():
+        return poll
+    return min(max((nearest - timezone.now()).total_seconds(), 1), poll)
+
+
+def acquire_leadership():
+    """
+    Пытается стать планировщиком. Блокировка держится соединением и
+    пропадает вместе с ним - тогда ее может взять другой процесс.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [SCHEDULER_LOCK_KEY])
+        return cursor.fetchone()[0]
+
+
+def release_leadership():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_unlock(%s)', [SCHEDULER_LOCK_KEY])
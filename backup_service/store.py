@@ -0,0 +1,287 @@
+"""
+Хранилище копий с дедупликацией.
+
+Копия в формате directory не хранится каталогом: каждый файл pg_dump
+(toc.dat и данные таблиц) режется на фрагменты, и фрагмент сохраняется
+в BACKUP_DIR/store под своим SHA-256, сжатым zlib. Сама копия - манифест
+DatabaseBackup.manifest: для каждого файла список фрагментов. Одинаковые
+фрагменты хранятся один раз, поэтому таблицы, которые не менялись с
+прошлой копии, заново не записываются.
+
+Границы фрагментов определяются содержимым. Данные таблиц pg_dump пишет
+построчно (COPY), и фрагмент заканчивается на строке, у которой младшие
+биты CRC32 нулевые, - но не раньше CHUNK_MIN_SIZE и не позже
+CHUNK_MAX_SIZE байт. Добавление строк в таблицу (журнал аудита, оценки)
+меняет только последние фрагменты ее файла.
+
+Сколько манифестов ссылается на фрагмент, хранит BackupChunk.refcount.
+Ссылки убираются в транзакции удаления копии, а фрагмент без ссылок
+удаляется после ее фиксации. Если процесс упал между ними (или во время
+выгрузки), счетчики и файлы приводит в порядок команда gc_backup_store.
+"""
+import hashlib
+import os
+import zlib
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import BackupChunk
+
+
+STORE_DIR = os.path.join(settings.BACKUP_DIR, 'store')
+# Уровень сжатия фрагментов zlib, 0-9
+BACKUP_STORE_COMPRESSION = getattr(settings, 'BACKUP_STORE_COMPRESSION', 6)
+
+CHUNK_MIN_SIZE = 256 * 1024
+CHUNK_MAX_SIZE = 8 * 1024 * 1024
+# Граница после строки с нулевыми 13 младшими битами CRC32: в среднем
+# раз в 8192 строки, для таблиц проекта - около мегабайта
+CHUNK_MASK = 0x1FFF
+
+# Сколько фрагментов обновлять одним запросом при освобождении
+RELEASE_BATCH_SIZE = 5000
+
+
+class StoreError(Exception):
+    """Фрагмент копии отсутствует или поврежден"""
+
+
+def chunk_path(digest):
+    return os.path.join(STORE_DIR, digest[:2], digest)
+
+
+def split_chunks(stream):
+    """Режет файл на фрагменты по строкам (см. описание модуля)"""
+    buffer = bytearray()
+    # Длина строки ограничена - в двоичных файлах переводов строк может не быть
+    for line in iter(lambda: stream.readline(CHUNK_MAX_SIZE), b''):
+        buffer += line
+        if len(buffer) >= CHUNK_MIN_SIZE and (
+            len(buffer) >= CHUNK_MAX_SIZE or not zlib.crc32(line) & CHUNK_MASK
+        ):
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def _write_chunk(digest, data, level):
+    """Записывает фрагмент атомарно (через временный файл); возвращает размер на диске"""
+    path = chunk_path(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    packed = zlib.compress(data, level)
+    partial = f'{path}.{os.getpid()}.part'
+    with open(partial, 'wb') as out:
+        out.write(packed)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(partial, path)
+    return len(packed)
+
+
+def _add_chunk(cursor, digest, data, level):
+    """
+    Добавляет ссылку на фрагмент и записывает его, если его еще нет.
+    Возвращает число записанных байт (0 - фрагмент уже был).
+
+    Ссылка добавляется до проверки файла: удаление фрагмента без ссылок
+    (release) держит его строку, пока не удалит файл, и этот INSERT ждет
+    его - поэтому файл не пропадет после того, как мы решили его не писать.
+    """
+    table = connection.ops.quote_name(BackupChunk._meta.db_table)
+    cursor.execute(f"""
+        INSERT INTO {table} (hash, size, stored_size, refcount, created_at)
+        VALUES (%s, %s, 0, 1, now())
+        ON CONFLICT (hash) DO UPDATE SET refcount = {table}.refcount + 1
+        RETURNING xmax = 0
+    """, [digest, len(data)])
+    inserted = cursor.fetchone()[0]
+    if not inserted and os.path.exists(chunk_path(digest)):
+        return 0
+    stored = _write_chunk(digest, data, level)
+    cursor.execute(f'UPDATE {table} SET stored_size = %s WHERE hash = %s', [stored, digest])
+    return stored
+
+
+def ingest_directory(path, level=BACKUP_STORE_COMPRESSION, progress=None):
+    """
+    Переносит каталог pg_dump в хранилище. Возвращает манифест, SHA-256
+    файлов каталога (как _directory_checksum), их общий размер и число
+    записанных байт. progress(bytes_written=...) - по обработанным данным.
+    """
+    checksum = hashlib.sha256()
+    files, added = [], []
+    size = stored = 0
+    try:
+        with connection.cursor() as cursor:
+            for name in sorted(os.listdir(path)):
+                checksum.update(name.encode())
+                entry = {'name': name, 'size': 0, 'chunks': []}
+                with open(os.path.join(path, name), 'rb') as part:
+                    for data in split_chunks(part):
+                        checksum.update(data)
+                        digest = hashlib.sha256(data).hexdigest()
+                        stored += _add_chunk(cursor, digest, data, level)
+                        added.append(digest)
+                        entry['chunks'].append(digest)
+                        entry['size'] += len(data)
+                        size += len(data)
+                        if progress:
+                            progress(bytes_written=size)
+                files.append(entry)
+    except Exception:
+        # Неполная копия не должна удерживать фрагменты
+        release_chunks(added)
+        raise
+    return {'files': files}, checksum.hexdigest(), size, stored
+
+
+def unreference_chunks(digests):
+    """
+    Убирает по ссылке на каждый фрагмент (повторы - несколько ссылок).
+    Вызывается в транзакции удаления копии, чтобы ссылки ушли вместе с
+    ее манифестом. Возвращает фрагменты, оставшиеся без ссылок.
+    """
+    counts = Counter(digests)
+    by_count = defaultdict(list)
+    for digest, count in counts.items():
+        by_count[count].append(digest)
+
+    unreferenced = []
+    with transaction.atomic():
+        for count, group in by_count.items():
+            for start in range(0, len(group), RELEASE_BATCH_SIZE):
+                batch = group[start:start + RELEASE_BATCH_SIZE]
+                BackupChunk.objects.filter(hash__in=batch).update(refcount=F('refcount') - count)
+                unreferenced += (
+                    BackupChunk.objects.filter(hash__in=batch, refcount__lte=0)
+                    .values_list('hash', flat=True)
+                )
+    return unreferenced
+
+
+def remove_unreferenced(digests):
+    """
+    Удаляет фрагменты, на которые больше никто не ссылается, и их файлы -
+    после фиксации удаления копии. Фрагмент, на который за это время
+    сослалась новая копия, остается.
+    """
+    digests = list(digests)
+    for start in range(0, len(digests), RELEASE_BATCH_SIZE):
+        batch = digests[start:start + RELEASE_BATCH_SIZE]
+        with transaction.atomic():
+            garbage = list(
+                BackupChunk.objects.select_for_update()
+                .filter(hash__in=batch, refcount__lte=0)
+                .values_list('hash', flat=True)
+            )
+            BackupChunk.objects.filter(hash__in=garbage).delete()
+            # Файлы удаляются до фиксации, пока строки заблокированы (см. _add_chunk)
+            for digest in garbage:
+                try:
+                    os.remove(chunk_path(digest))
+                except FileNotFoundError:
+                    pass
+
+
+def release_chunks(digests):
+    """Убирает ссылки на фрагменты и удаляет фрагменты, оставшиеся без ссылок"""
+    remove_unreferenced(unreference_chunks(digests))
+
+
+def manifest_chunks(manifest):
+    return [digest for entry in manifest['files'] for digest in entry['chunks']]
+
+
+def collect_garbage():
+    """
+    Пересчитывает refcount по манифестам всех копий и удаляет фрагменты
+    без ссылок, а также файлы хранилища без строки BackupChunk. Нужна
+    после сбоя: ссылки, которые не успели освободить, иначе держали бы
+    фрагменты вечно. Выполняется под блокировкой очереди заданий, когда
+    копии не создаются и не восстанавливаются.
+
+    Возвращает (исправлено счетчиков, удалено фрагментов, удалено файлов,
+    фрагментов из манифестов, которых нет в хранилище).
+    """
+    from .jobs import ACTIVE_STATUSES, lock_queue
+    from .models import DatabaseBackup
+
+    with transaction.atomic():
+        lock_queue()
+        if DatabaseBackup.objects.filter(status__in=ACTIVE_STATUSES).exists():
+            raise StoreError('Выполняется задание резервного копирования, повторите позже')
+        # Удаления копий, начатые до нас, должны зафиксироваться, новые - ждать
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {connection.ops.quote_name(DatabaseBackup._meta.db_table)} IN SHARE MODE'
+            )
+
+        counts = Counter()
+        manifests = DatabaseBackup.objects.exclude(manifest=None).values_list('manifest', flat=True)
+        for manifest in manifests.iterator():
+            counts.update(manifest_chunks(manifest))
+
+        known = dict(BackupChunk.objects.select_for_update().values_list('hash', 'refcount'))
+        missing = sum(1 for digest in counts if digest not in known)
+        by_count = defaultdict(list)
+        for digest, refcount in known.items():
+            if counts[digest] != refcount:
+                by_count[counts[digest]].append(digest)
+        fixed = 0
+        for count, group in by_count.items():
+            for start in range(0, len(group), RELEASE_BATCH_SIZE):
+                batch = group[start:start + RELEASE_BATCH_SIZE]
+                fixed += BackupChunk.objects.filter(hash__in=batch).update(refcount=count)
+
+        garbage = [digest for digest in known if not counts[digest]]
+        for start in range(0, len(garbage), RELEASE_BATCH_SIZE):
+            BackupChunk.objects.filter(hash__in=garbage[start:start + RELEASE_BATCH_SIZE]).delete()
+
+        kept = set(known) - set(garbage)
+        removed_files = 0
+        for directory, _, names in os.walk(STORE_DIR):
+            for name in names:
+                # Незаконченные записи (.part) тоже ничьи - заданий сейчас нет
+                if name not in kept:
+                    os.remove(os.path.join(directory, name))
+                    removed_files += 1
+    return fixed, len(garbage), removed_files, missing
+
+
+def iter_file(entry, offset=0):
+    """
+    Содержимое файла из манифеста блоками по фрагментам, с проверкой
+    SHA-256. offset - с какого байта (для докачки): фрагменты до него
+    пропускаются без чтения.
+    """
+    chunks, first = entry['chunks'], 0
+    if offset:
+        sizes = dict(BackupChunk.objects.filter(hash__in=set(chunks)).values_list('hash', 'size'))
+        while first < len(chunks) and sizes.get(chunks[first], offset + 1) <= offset:
+            offset -= sizes[chunks[first]]
+            first += 1
+    for digest in chunks[first:]:
+        try:
+            with open(chunk_path(digest), 'rb') as chunk:
+                data = zlib.decompress(chunk.read())
+        except FileNotFoundError:
+            raise StoreError(f'В хранилище нет фрагмента {digest} файла {entry["name"]}')
+        except zlib.error:
+            raise StoreError(f'Фрагмент {digest} файла {entry["name"]} поврежден')
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise StoreError(f'Фрагмент {digest} файла {entry["name"]} поврежден')
+        yield data[offset:] if offset else data
+        offset = 0
+
+
+def materialize(manifest, path):
+    """Собирает каталог pg_dump из хранилища - для pg_restore"""
+    os.makedirs(path)
+    for entry in manifest['files']:
+        with open(os.path.join(path, entry['name']), 'wb') as out:
+            for data in iter_file(entry):
+                out.write(data)
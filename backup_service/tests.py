@@ -1,3 +1,252 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from datetime import date, datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+from django.utils.http import http_date
+
+from . import store
+from .download import RangeNotSatisfiable, iter_parts, parse_range, requested_range, tar_layout
+from .models import BackupChunk, BackupSchedule, DatabaseBackup
+from .scheduler import _month_day, compute_next_run, next_slot, run_due_schedules, schedule_jitter
+
+
+def _at(year, month, day, hour=0, minute=0):
+    return timezone.make_aware(datetime(year, month, day, hour, minute))
+
+
+class ScheduleTests(SimpleTestCase):
+    """Время запусков по расписанию"""
+
+    def test_month_day(self):
+        self.assertEqual(_month_day(2025, 2, -1), date(2025, 2, 28))
+        self.assertEqual(_month_day(2024, 2, -1), date(2024, 2, 29))
+        self.assertEqual(_month_day(2025, 3, -2), date(2025, 3, 30))
+        self.assertEqual(_month_day(2025, 4, 31), date(2025, 4, 30))
+        self.assertEqual(_month_day(2025, 2, -40), date(2025, 2, 1))
+        self.assertEqual(_month_day(2025, 5, None), date(2025, 5, 1))
+
+    def test_next_slot(self):
+        daily = BackupSchedule(frequency='daily', time=time(3, 0))
+        self.assertEqual(next_slot(daily, _at(2025, 3, 10, 2)), _at(2025, 3, 10, 3))
+        # Строго позже after
+        self.assertEqual(next_slot(daily, _at(2025, 3, 10, 3)), _at(2025, 3, 11, 3))
+
+        weekly = BackupSchedule(frequency='weekly', time=time(3, 0), day_of_week=0)
+        self.assertEqual(next_slot(weekly, _at(2025, 3, 12, 12)), _at(2025, 3, 17, 3))
+
+        monthly = BackupSchedule(frequency='monthly', time=time(3, 0), day_of_month=-1)
+        self.assertEqual(next_slot(monthly, _at(2025, 1, 31, 4)), _at(2025, 2, 28, 3))
+        self.assertEqual(next_slot(monthly, _at(2025, 12, 31, 4)), _at(2026, 1, 31, 3))
+
+        hourly = BackupSchedule(frequency='hourly', time=time(3, 0), interval_hours=6)
+        self.assertEqual(next_slot(hourly, _at(2025, 3, 10, 4)), _at(2025, 3, 10, 9))
+        self.assertEqual(next_slot(hourly, _at(2025, 3, 10, 21)), _at(2025, 3, 11, 3))
+
+    @mock.patch('backup_service.scheduler.BACKUP_SCHEDULE_JITTER_SECONDS', 300)
+    def test_jitter_is_stable_and_does_not_drift(self):
+        schedule = BackupSchedule(pk=7, frequency='daily', time=time(3, 0))
+        jitter = schedule_jitter(schedule)
+        self.assertEqual(jitter, schedule_jitter(BackupSchedule(pk=7)))
+        self.assertTrue(timedelta(0) <= jitter < timedelta(seconds=300))
+        self.assertEqual(schedule_jitter(BackupSchedule()), timedelta(0))
+
+        first = compute_next_run(schedule, _at(2025, 3, 10, 2))
+        self.assertEqual(first, _at(2025, 3, 10, 3) + jitter)
+        self.assertEqual(compute_next_run(schedule, first), first + timedelta(days=1))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Очередь заданий работает только с PostgreSQL')
+class RunDueSchedulesTests(TestCase):
+
+    def test_missed_runs_are_caught_up_once(self):
+        now = timezone.now()
+        schedule = BackupSchedule.objects.create(
+            name='Ночная', frequency='daily', time=time(3, 0), next_run=now - timedelta(days=3),
+        )
+
+        with self.assertLogs('backup_service.scheduler', 'WARNING'):
+            enqueued = run_due_schedules(now)
+        self.assertEqual(len(enqueued), 1)
+        self.assertEqual(enqueued[0].status, 'pending')
+        self.assertEqual(enqueued[0].schedule, schedule)
+        self.assertIn('пропущены запуски', enqueued[0].description)
+
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.last_run, now)
+        self.assertGreater(schedule.next_run, now)
+        self.assertLessEqual(schedule.next_run, now + timedelta(days=1))
+        self.assertEqual(run_due_schedules(now), [])
+
+    def test_new_schedule_only_gets_next_run(self):
+        now = timezone.now()
+        schedule = BackupSchedule.objects.create(name='Новая', frequency='hourly', interval_hours=1)
+
+        self.assertEqual(run_due_schedules(now), [])
+        schedule.refresh_from_db()
+        self.assertGreater(schedule.next_run, now)
+        self.assertFalse(DatabaseBackup.objects.exists())
+
+
+class RangeTests(SimpleTestCase):
+    """Разбор Range и If-Range для докачки копий"""
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=990-5000', 1000), (990, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+        for header in ('bytes=0-1,5-6', 'items=0-1', 'bytes=abc', 'bytes=5-1', 'bytes=x-5'):
+            with self.subTest(header):
+                self.assertIsNone(parse_range(header, 1000))
+        for header in ('bytes=1000-', 'bytes=-0'):
+            with self.subTest(header):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_range(header, 1000)
+
+    def test_if_range(self):
+        factory = RequestFactory()
+        modified = _at(2025, 3, 10, 12)
+
+        def requested(**headers):
+            request = factory.get('/', HTTP_RANGE='bytes=10-19', **headers)
+            return requested_range(request, 100, '"abc"', modified)
+
+        self.assertEqual(requested(), (10, 19))
+        self.assertEqual(requested(HTTP_IF_RANGE='"abc"'), (10, 19))
+        self.assertIsNone(requested(HTTP_IF_RANGE='"old"'))
+        self.assertIsNone(requested(HTTP_IF_RANGE='W/"abc"'))
+        self.assertEqual(requested(HTTP_IF_RANGE=http_date(modified.timestamp())), (10, 19))
+        self.assertIsNone(requested(HTTP_IF_RANGE=http_date(modified.timestamp() - 60)))
+        self.assertIsNone(requested_range(factory.get('/'), 100, '"abc"', modified))
+
+
+def _write_files(path, files):
+    for name, data in files.items():
+        with open(os.path.join(path, name), 'wb') as out:
+            out.write(data)
+
+
+# Каталог pg_dump: строки, чтобы файлы резались на несколько фрагментов
+DUMP_FILES = {
+    'toc.dat': b'toc\n' * 50,
+    '3001.dat': b''.join(b'%d\tstudent %d\n' % (number, number) for number in range(200)),
+}
+
+
+class TarRangeTests(SimpleTestCase):
+    """Части tar-архива каталога отдаются с любого смещения"""
+
+    def test_iter_parts_matches_archive(self):
+        with tempfile.TemporaryDirectory() as path:
+            _write_files(path, DUMP_FILES)
+            backup = DatabaseBackup(file_path=path, filename='dump')
+            parts = tar_layout(backup)
+            size = sum(len(part) if isinstance(part, bytes) else part[0] for part in parts)
+            archive = b''.join(iter_parts(parts, 0, size - 1))
+
+            self.assertEqual(len(archive), size)
+            with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+                member = tar.extractfile(f'{os.path.basename(path)}/3001.dat')
+                self.assertEqual(member.read(), DUMP_FILES['3001.dat'])
+
+            for start, end in ((0, 0), (511, 512), (700, 1900), (size - 10, size - 1), (1000, 1000)):
+                with self.subTest(start=start, end=end):
+                    self.assertEqual(b''.join(iter_parts(parts, start, end)), archive[start:end + 1])
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Хранилище копий работает только с PostgreSQL')
+@mock.patch.multiple('backup_service.store', CHUNK_MIN_SIZE=64, CHUNK_MAX_SIZE=256)
+class StoreTests(TestCase):
+    """Ссылки на фрагменты хранилища, их освобождение и сборка мусора"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch('backup_service.store.STORE_DIR', directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def backup(self, files, **fields):
+        with tempfile.TemporaryDirectory() as path:
+            _write_files(path, files)
+            manifest, checksum, size, _ = store.ingest_directory(path)
+        return DatabaseBackup.objects.create(
+            name='Копия', status='completed', dump_format='directory',
+            manifest=manifest, checksum=checksum, file_size=size, **fields,
+        )
+
+    def refcounts(self):
+        return dict(BackupChunk.objects.values_list('hash', 'refcount'))
+
+    def stored_files(self):
+        return {name for _, _, names in os.walk(store.STORE_DIR) for name in names}
+
+    def test_shared_chunks_are_stored_once(self):
+        first = self.backup(DUMP_FILES)
+        second = self.backup({**DUMP_FILES, 'toc.dat': b'other toc\n' * 50})
+
+        shared = set(store.manifest_chunks(first.manifest)) & set(store.manifest_chunks(second.manifest))
+        self.assertTrue(shared)
+        self.assertTrue(all(self.refcounts()[digest] >= 2 for digest in shared))
+        self.assertEqual(self.stored_files(), set(self.refcounts()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        own = set(store.manifest_chunks(first.manifest)) - shared
+        self.assertFalse(own & set(self.refcounts()))
+        self.assertFalse(own & self.stored_files())
+        self.assertEqual(
+            set(self.refcounts()), set(store.manifest_chunks(second.manifest)),
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.refcounts(), {})
+        self.assertEqual(self.stored_files(), set())
+
+    def test_iter_file_from_offset(self):
+        backup = self.backup(DUMP_FILES)
+        entry = next(entry for entry in backup.manifest['files'] if entry['name'] == '3001.dat')
+        data = DUMP_FILES['3001.dat']
+        self.assertGreater(len(entry['chunks']), 2)
+
+        for offset in (0, 1, 63, 64, 300, len(data) - 1):
+            with self.subTest(offset=offset):
+                self.assertEqual(b''.join(store.iter_file(entry, offset)), data[offset:])
+
+        parts = tar_layout(backup)
+        size = sum(len(part) if isinstance(part, bytes) else part[0] for part in parts)
+        archive = b''.join(iter_parts(parts, 0, size - 1))
+        self.assertEqual(b''.join(iter_parts(parts, 900, 2500)), archive[900:2501])
+
+    def test_collect_garbage_fixes_refcounts_and_files(self):
+        backup = self.backup(DUMP_FILES)
+        digests = store.manifest_chunks(backup.manifest)
+        expected = self.refcounts()
+
+        BackupChunk.objects.filter(hash=digests[0]).update(refcount=100)
+        # Строка фрагмента от копии, удаление которой прервалось
+        orphan = hashlib.sha256(b'orphan').hexdigest()
+        BackupChunk.objects.create(hash=orphan, size=6, refcount=1)
+        stray = store.chunk_path(hashlib.sha256(b'stray').hexdigest())
+        os.makedirs(os.path.dirname(stray), exist_ok=True)
+        open(stray, 'wb').close()
+
+        fixed, removed, removed_files, missing = store.collect_garbage()
+        self.assertEqual((fixed, removed, removed_files, missing), (2, 1, 1, 0))
+        self.assertEqual(self.refcounts(), expected)
+        self.assertFalse(os.path.exists(stray))
+
+    def test_collect_garbage_waits_for_jobs(self):
+        DatabaseBackup.objects.create(name='Идет', status='pending')
+        with self.assertRaises(store.StoreError):
+            store.collect_garbage()
@@ -1,28 +1,29 @@
 import os
-import json
-import hashlib
-import subprocess
-import tempfile
-from datetime import datetime, timedelta
-from django.conf import settings
+from datetime import datetime
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.db import connection
-from django.http import HttpResponse, FileResponse, JsonResponse
+from django.db.models import Sum
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
-from django.urls import reverse
 from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 
-from .models import DatabaseBackup, BackupSchedule, BackupLog
+from MPTed_base.roles import get_user_roles
+
+from .download import can_gzip, file_response, gzip_response, tar_response
+from .engine import BackupError
+from .jobs import delete_backup, enqueue_backup, enqueue_restore, start_background_worker
+from .models import DatabaseBackup, BackupSchedule, BackupLog, BackupChunk, format_size
+from .scheduler import compute_next_run
 
 # Декоратор для проверки прав администратора
 def admin_required(view_func):
     def wrapper(request, *args, **kwargs):
         if not request.user.is_authenticated:
             return redirect('login_page')
-        if not (request.user.is_superuser or request.user.groups.filter(name='admin').exists()):
+        if not get_user_roles(request.user).is_admin:
             messages.error(request, 'Доступ запрещен. Требуются права администратора.')
             return redirect('dashboard_page')
         return view_func(request, *args, **kwargs)
@@ -51,7 +52,11 @@ def backup_list(request):
     
     # Статистика
     total_backups = backups.count()
-    total_size = sum(b.file_size for b in backups if b.file_size)
+    # Копии из хранилища делят фрагменты - их место считается по фрагментам
+    total_size = (
+        (backups.filter(manifest__isnull=True).aggregate(total=Sum('file_size'))['total'] or 0)
+        + (BackupChunk.objects.aggregate(total=Sum('stored_size'))['total'] or 0)
+    )
     last_backup = backups.filter(status='completed').first()
     
     context = {
@@ -81,55 +86,28 @@ def backup_create(request):
             messages.error(request, 'Введите название резервной копии')
             return redirect('backup_create')
         
-        # Создаем запись в БД
-        backup = DatabaseBackup.objects.create(
-            name=name,
-            description=description,
-            backup_type='manual',
-            status='pending',
-            created_by=request.user
-        )
-        
-        # Запускаем создание бэкапа в фоне
+        # Выгрузка идет в фоне, запрос только ставит задание
         try:
-            result = create_database_backup(backup)
-            
-            if result['success']:
-                backup.status = 'completed'
-                backup.completed_at = timezone.now()
-                backup.file_path = result['file_path']
-                backup.file_size = result['file_size']
-                backup.filename = os.path.basename(result['file_path'])
-                
-                # Получаем информацию о БД
-                backup.database_name = settings.DATABASES['default']['NAME']
-                backup.tables_count = result.get('tables_count', 0)
-                backup.row_count = result.get('row_count', 0)
-                
-                backup.save()
-                
-                # Логируем
-                BackupLog.objects.create(
-                    backup=backup,
-                    action='create',
-                    user=request.user,
-                    details=f"Создана резервная копия {backup.filename}",
-                    ip_address=get_client_ip(request)
-                )
-                
-                messages.success(request, f'✅ Резервная копия "{name}" успешно создана')
-            else:
-                backup.status = 'failed'
-                backup.error_message = result.get('error', 'Неизвестная ошибка')
-                backup.save()
-                messages.error(request, f'❌ Ошибка при создании бэкапа: {result.get("error")}')
-                
-        except Exception as e:
-            backup.status = 'failed'
-            backup.error_message = str(e)
-            backup.save()
-            messages.error(request, f'❌ Ошибка: {str(e)}')
+            backup = enqueue_backup(
+                name=name,
+                description=description,
+                compressed=request.POST.get('compression') == 'on',
+                user=request.user
+            )
+        except BackupError as e:
+            messages.warning(request, str(e))
+            return redirect('backup_service:backup_list')
         
+        BackupLog.objects.create(
+            backup=backup,
+            action='create',
+            user=request.user,
+            details="Запрошено создание резервной копии",
+            ip_address=get_client_ip(request)
+        )
+        start_background_worker()
+        
+        messages.info(request, f'Резервная копия "{name}" создается, прогресс - в списке копий')
         return redirect('backup_service:backup_list')
     
     # Информация о текущей БД
@@ -155,34 +133,64 @@ def backup_detail(request, backup_id):
     return render(request, 'backup_service/backup_detail.html', context)
 
 
+@login_required
+@admin_required
+def backup_status(request, backup_id):
+    """Состояние задания копии в JSON - для опроса со страницы списка"""
+    backup = get_object_or_404(
+        DatabaseBackup.objects.only(
+            'status', 'file_size', 'error_message', 'progress_bytes',
+            'progress_table', 'started_at', 'heartbeat_at',
+        ),
+        id=backup_id
+    )
+    return JsonResponse({
+        'id': backup.id,
+        'status': backup.status,
+        'status_display': backup.get_status_display(),
+        'active': backup.status in ('pending', 'restoring'),
+        'progress_bytes': backup.progress_bytes,
+        'progress_display': format_size(backup.progress_bytes),
+        'progress_table': backup.progress_table,
+        'file_size': backup.file_size,
+        'error_message': backup.error_message,
+        'started_at': backup.started_at.isoformat() if backup.started_at else None,
+        'heartbeat_at': backup.heartbeat_at.isoformat() if backup.heartbeat_at else None,
+    })
+
+
 @login_required
 @admin_required
 def backup_download(request, backup_id):
     """Скачивание резервной копии"""
     backup = get_object_or_404(DatabaseBackup, id=backup_id)
     
-    if backup.status != 'completed' or not backup.file_path:
+    if backup.status != 'completed' or not (backup.file_path or backup.manifest):
         messages.error(request, 'Файл резервной копии недоступен')
         return redirect('backup_detail', backup_id=backup.id)
     
-    if not os.path.exists(backup.file_path):
+    if not backup.manifest and not os.path.exists(backup.file_path):
         messages.error(request, 'Файл не найден на сервере')
         return redirect('backup_detail', backup_id=backup.id)
     
-    # Логируем скачивание
-    BackupLog.objects.create(
-        backup=backup,
-        action='download',
-        user=request.user,
-        ip_address=get_client_ip(request)
-    )
+    # Логируем скачивание; докачка (Range не с начала) - продолжение уже записанного
+    range_start = request.META.get('HTTP_RANGE', '').partition('=')[2].partition('-')[0].strip()
+    if range_start in ('', '0'):
+        BackupLog.objects.create(
+            backup=backup,
+            action='download',
+            user=request.user,
+            ip_address=get_client_ip(request)
+        )
     
-    response = FileResponse(
-        open(backup.file_path, 'rb'),
-        as_attachment=True,
-        filename=backup.filename or f"backup_{backup.id}.sql"
-    )
-    return response
+    if backup.manifest or os.path.isdir(backup.file_path):
+        # Каталог pg_dump и копию из хранилища отдаем одним tar-архивом
+        return tar_response(request, backup)
+    
+    if request.GET.get('compress') == 'gzip' and can_gzip(backup):
+        return gzip_response(backup)
+    
+    return file_response(request, backup)
 
 
 @login_required
@@ -192,19 +200,16 @@ def backup_delete(request, backup_id):
     """Удаление резервной копии"""
     backup = get_object_or_404(DatabaseBackup, id=backup_id)
     
-    # Логируем удаление
-    BackupLog.objects.create(
-        backup=backup,
-        action='delete',
-        user=request.user,
-        ip_address=get_client_ip(request)
-    )
-    
-    backup_name = backup.name
-    backup.delete()
+    try:
+        delete_backup(backup.pk)
+    except DatabaseBackup.DoesNotExist:
+        raise Http404
+    except BackupError as e:
+        messages.warning(request, str(e))
+        return redirect('backup_service:backup_list')
     
-    messages.success(request, f'Резервная копия "{backup_name}" удалена')
-    return redirect('backup_list')
+    messages.success(request, f'Резервная копия "{backup.name}" удалена')
+    return redirect('backup_service:backup_list')
 
 
 @login_required
@@ -218,38 +223,25 @@ def backup_restore(request, backup_id):
         
         if confirm != 'CONFIRM':
             messages.error(request, 'Подтверждение неверно')
-            return redirect('backup_restore', backup_id=backup.id)
-        
-        backup.status = 'restoring'
-        backup.save()
+            return redirect('backup_service:backup_restore', backup_id=backup.id)
         
         try:
-            result = restore_database_from_backup(backup)
-            
-            if result['success']:
-                backup.status = 'completed'
-                backup.save()
-                
-                BackupLog.objects.create(
-                    backup=backup,
-                    action='restore',
-                    user=request.user,
-                    details="База данных восстановлена",
-                    ip_address=get_client_ip(request)
-                )
-                
-                messages.success(request, '✅ База данных успешно восстановлена')
-            else:
-                backup.status = 'completed'
-                backup.save()
-                messages.error(request, f'❌ Ошибка восстановления: {result.get("error")}')
-                
-        except Exception as e:
-            backup.status = 'completed'
-            backup.save()
-            messages.error(request, f'❌ Ошибка: {str(e)}')
+            enqueue_restore(backup, user=request.user)
+        except BackupError as e:
+            messages.warning(request, str(e))
+            return redirect('backup_service:backup_list')
         
-        return redirect('backup_detail', backup_id=backup.id)
+        BackupLog.objects.create(
+            backup=backup,
+            action='restore',
+            user=request.user,
+            details="Запрошено восстановление базы данных",
+            ip_address=get_client_ip(request)
+        )
+        start_background_worker()
+        
+        messages.info(request, 'Восстановление базы данных запущено, прогресс - в списке копий')
+        return redirect('backup_service:backup_list')
     
     context = {
         'backup': backup,
@@ -304,6 +296,10 @@ def schedule_create(request):
             compression=compression,
             is_active=is_active
         )
+        # Сдвиг времени запуска зависит от id, поэтому - после создания
+        if schedule.is_active:
+            schedule.next_run = compute_next_run(schedule)
+            schedule.save(update_fields=['next_run'])
         
         messages.success(request, f'Расписание "{name}" создано')
         return redirect('schedule_list')
@@ -349,6 +345,7 @@ def schedule_edit(request, schedule_id):
         schedule.keep_last = int(keep_last)
         schedule.compression = compression
         schedule.is_active = is_active
+        schedule.next_run = compute_next_run(schedule) if is_active else None
         schedule.save()
         
         messages.success(request, f'Расписание "{name}" обновлено')
@@ -379,6 +376,8 @@ def schedule_toggle(request, schedule_id):
     """Включение/выключение расписания"""
     schedule = get_object_or_404(BackupSchedule, id=schedule_id)
     schedule.is_active = not schedule.is_active
+    # Включенное заново расписание не догоняет запуски, пропущенные, пока оно было выключено
+    schedule.next_run = compute_next_run(schedule) if schedule.is_active else None
     schedule.save()
     
     status = "активировано" if schedule.is_active else "деактивировано"
@@ -398,17 +397,6 @@ def get_client_ip(request):
     return ip
 
 
-def format_size(size):
-    """Форматирование размера"""
-    for unit in ['Б', 'КБ', 'МБ', 'ГБ']:
-        if size < 1024.0:
-            return f"{size:.1f} {unit}"
-        size /= 1024.0
-    return f"{size:.1f} ТБ"
-
-
-from django.db import connection
-
 def get_database_info():
     """Информация о реально подключенной БД (а не только settings.py)"""
     cfg = connection.settings_dict  # фактическое подключение
@@ -458,185 +446,3 @@ def get_database_info():
         info['total_rows'] = info['total_rows'] or 0
 
     return info
-
-
-
-def create_database_backup(backup):
-    """Создание резервной копии базы данных"""
-    try:
-        # Директория для бэкапов
-        backup_dir = os.path.join(settings.BASE_DIR, 'backups')
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        # Имя файла
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"backup_{backup.id}_{timestamp}.sql"
-        file_path = os.path.join(backup_dir, filename)
-        
-        db_config = settings.DATABASES['default']
-        
-        # Определяем тип БД
-        if 'postgresql' in db_config['ENGINE']:
-            # PostgreSQL
-            env = os.environ.copy()
-            if db_config.get('PASSWORD'):
-                env['PGPASSWORD'] = db_config['PASSWORD']
-            
-            cmd = [
-                r'C:\Program Files\PostgreSQL\16\bin\pg_dump.exe',
-                '-h', db_config.get('HOST', 'localhost'),
-                '-p', str(db_config.get('PORT', '5432')),
-                '-U', db_config['USER'],
-                '-d', db_config['NAME'],
-                '-f', file_path,
-                '--clean',
-                '--if-exists',
-            ]
-            
-            if db_config.get('PASSWORD'):
-                result = subprocess.run(cmd, env=env, capture_output=True, text=True)
-            else:
-                result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                return {'success': False, 'error': result.stderr}
-            
-            # Подсчет таблиц
-            tables_count = 0
-            row_count = 0
-            
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT COUNT(*) FROM information_schema.tables 
-                    WHERE table_schema = 'public'
-                """)
-                tables_count = cursor.fetchone()[0]
-                
-                cursor.execute("""
-                    SELECT SUM(reltuples) FROM pg_class 
-                    WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace
-                """)
-                row_count = int(cursor.fetchone()[0] or 0)
-            
-            file_size = os.path.getsize(file_path)
-            
-            # Вычисляем MD5
-            md5_hash = hashlib.md5()
-            with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b''):
-                    md5_hash.update(chunk)
-            
-            return {
-                'success': True,
-                'file_path': file_path,
-                'file_size': file_size,
-                'tables_count': tables_count,
-                'row_count': row_count,
-                'md5': md5_hash.hexdigest(),
-            }
-            
-        elif 'mysql' in db_config['ENGINE']:
-            # MySQL
-            cmd = [
-                'mysqldump',
-                '-h', db_config.get('HOST', 'localhost'),
-                '-P', str(db_config.get('PORT', '3306')),
-                '-u', db_config['USER'],
-                f'-p{db_config["PASSWORD"]}' if db_config.get('PASSWORD') else '',
-                db_config['NAME'],
-                '--result-file', file_path,
-                '--add-drop-table',
-                '--create-options',
-                '--quick',
-            ]
-            
-            # Убираем пустые аргументы
-            cmd = [arg for arg in cmd if arg]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                return {'success': False, 'error': result.stderr}
-            
-            file_size = os.path.getsize(file_path)
-            
-            return {
-                'success': True,
-                'file_path': file_path,
-                'file_size': file_size,
-                'tables_count': 0,
-                'row_count': 0,
-            }
-        else:
-            return {'success': False, 'error': 'Неподдерживаемый тип БД'}
-            
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
-
-
-def restore_database_from_backup(backup):
-    """Восстановление базы данных из резервной копии"""
-    try:
-        if not backup.file_path or not os.path.exists(backup.file_path):
-            return {'success': False, 'error': 'Файл резервной копии не найден'}
-        
-        db_config = settings.DATABASES['default']
-        
-        if 'postgresql' in db_config['ENGINE']:
-            # PostgreSQL
-            env = os.environ.copy()
-            if db_config.get('PASSWORD'):
-                env['PGPASSWORD'] = db_config['PASSWORD']
-            
-            # Сначала очищаем существующие соединения
-            with connection.cursor() as cursor:
-                cursor.execute("""
-                    SELECT pg_terminate_backend(pid)
-                    FROM pg_stat_activity
-                    WHERE datname = %s AND pid <> pg_backend_pid()
-                """, [db_config['NAME']])
-            
-            cmd = [
-                'psql',
-                '-h', db_config.get('HOST', 'localhost'),
-                '-p', str(db_config.get('PORT', '5432')),
-                '-U', db_config['USER'],
-                '-d', db_config['NAME'],
-                '-f', backup.file_path,
-            ]
-            
-            if db_config.get('PASSWORD'):
-                result = subprocess.run(cmd, env=env, capture_output=True, text=True)
-            else:
-                result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                return {'success': False, 'error': result.stderr}
-            
-            return {'success': True}
-            
-        elif 'mysql' in db_config['ENGINE']:
-            # MySQL
-            cmd = [
-                'mysql',
-                '-h', db_config.get('HOST', 'localhost'),
-                '-P', str(db_config.get('PORT', '3306')),
-                '-u', db_config['USER'],
-                f'-p{db_config["PASSWORD"]}' if db_config.get('PASSWORD') else '',
-                db_config['NAME'],
-                '-e', f'source {backup.file_path}',
-            ]
-            
-            cmd = [arg for arg in cmd if arg]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                return {'success': False, 'error': result.stderr}
-            
-            return {'success': True}
-        else:
-            return {'success': False, 'error': 'Неподдерживаемый тип БД'}
-            
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
\ No newline at end of file
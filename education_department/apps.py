@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class EducationDepartmentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'education_department'
-    verbose_name = 'Учебный отдел'
\ No newline at end of file
+    verbose_name = 'Учебный отдел'
+
+    def ready(self):
+        from . import signals  # noqa: F401
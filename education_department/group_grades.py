@@ -0,0 +1,222 @@
+from django.contrib.auth.models import User
+
+from api.grade_summary import summary_aggregates, summary_average, summary_histogram
+from api.models import Grade, GradeSummary, ScheduleLesson, StudentProfile, Subject
+
+
+# Оценки, для которых строится распределение (от лучшей к худшей)
+GRADE_VALUES = (5, 4, 3, 2)
+
+# Сколько последних оценок ученика показывать в журнале
+RECENT_GRADES = 5
+
+
+def _percentage(part, total):
+    return round((part / total * 100), 1) if total else 0
+
+
+def load_group_subject_teachers(group):
+    """
+    Предметы расписания класса и учителя, которые их ведут, одним запросом
+    values('subject_id', 'teacher_id') и двумя запросами за самими объектами.
+
+    Возвращает (subjects, {subject_id: [User, ...]}); subjects отсортированы
+    по названию.
+    """
+    pairs = list(
+        ScheduleLesson.objects.filter(
+            daily_schedule__student_group=group
+        ).order_by().values_list('subject_id', 'teacher_id').distinct()
+    )
+    subject_ids = {subject_id for subject_id, _ in pairs}
+    teacher_ids = {teacher_id for _, teacher_id in pairs}
+
+    subjects = list(Subject.objects.filter(id__in=subject_ids).order_by('name')) if subject_ids else []
+    users = User.objects.in_bulk(teacher_ids) if teacher_ids else {}
+
+    teachers = {}
+    for subject_id, teacher_id in sorted(pairs, key=lambda pair: pair[1]):
+        if teacher_id in users:
+            teachers.setdefault(subject_id, []).append(users[teacher_id])
+    return subjects, teachers
+
+
+def grade_type_stats(summaries):
+    """Число и средний балл по типам оценок одним запросом к сводкам"""
+    rows = {
+        row['grade_type']: row
+        for row in summaries.order_by().values('grade_type').annotate(**summary_aggregates())
+    }
+
+    stats = []
+    for code, name in Grade.GradeType.choices:
+        row = rows.get(code)
+        if not row or not row['grades_count']:
+            continue
+        stats.append({
+            'type': code,
+            'name': name,
+            'count': row['grades_count'],
+            'avg': summary_average(row),
+        })
+    return stats
+
+
+def build_group_grades_detail(group):
+    """
+    Статистика оценок класса по предметам и типам оценок.
+
+    Считается по сводкам GradeSummary, а не по всей истории оценок, и число
+    запросов не зависит от числа предметов: предметы с учителями (три
+    запроса), по одному сгруппированному запросу на предмет и тип оценки и
+    одна агрегация итогов класса.
+    """
+    subjects, teachers = load_group_subject_teachers(group)
+    summaries = GradeSummary.objects.filter(student__student_profile__student_group=group)
+
+    by_subject = {
+        row['subject_id']: row
+        for row in summaries.filter(
+            subject_id__in=[subject.id for subject in subjects]
+        ).order_by().values('subject_id').annotate(**summary_aggregates())
+    } if subjects else {}
+
+    subjects_stats = []
+    for subject in subjects:
+        row = by_subject.get(subject.id)
+        subjects_stats.append({
+            'subject': subject,
+            'teachers': teachers.get(subject.id, []),
+            'avg_grade': summary_average(row),
+            'grades_count': row['grades_count'] if row else 0,
+            'grade_distribution': summary_histogram(row),
+        })
+
+    totals = summaries.order_by().aggregate(**summary_aggregates())
+
+    return {
+        'subjects_stats': subjects_stats,
+        'total_grades': totals['grades_count'] or 0,
+        'overall_avg': summary_average(totals),
+        'grade_types_stats': grade_type_stats(summaries),
+    }
+
+
+def build_grade_matrix(group, subject, date_from=None, date_to=None):
+    """
+    Журнал оценок класса по предмету: матрица ученик x дата.
+
+    Все оценки (group, subject) за необязательный период date_from..date_to
+    загружаются одним упорядоченным запросом; списки и средние по ученикам,
+    распределение по классу и разбивка по типам считаются в том же проходе.
+    Ученики класса - еще один запрос, чтобы в журнал попали и те, у кого
+    оценок нет.
+
+    Возвращает словарь с ключами students_grades, dates, total_grades,
+    overall_avg, grade_distribution и grade_types_stats; в
+    grade_matrix_table() он превращается в таблицу для PDF и Excel.
+    """
+    students = StudentProfile.objects.filter(
+        student_group=group
+    ).select_related('user').order_by('user__last_name', 'user__first_name')
+
+    grades = Grade.objects.filter(
+        student__student_profile__student_group=group,
+        subject=subject,
+    )
+    if date_from:
+        grades = grades.filter(date__gte=date_from)
+    if date_to:
+        grades = grades.filter(date__lte=date_to)
+
+    rows = {}
+    for profile in students:
+        rows[profile.user_id] = {
+            'student': profile,
+            'grades': [],
+            'by_date': {},
+            'avg_grade': 0,
+            'grades_count': 0,
+            'recent_grades': [],
+            'grades_sum': 0,
+        }
+
+    dates = set()
+    histogram = dict.fromkeys(GRADE_VALUES, 0)
+    types = {}
+    total_grades = 0
+    total_sum = 0
+
+    # Новые оценки первыми - как в журнале ученика
+    for grade in grades.order_by('-date', '-id'):
+        row = rows.get(grade.student_id)
+        if row is None:
+            continue
+
+        row['grades'].append(grade)
+        row['by_date'].setdefault(grade.date, []).append(grade)
+        row['grades_sum'] += grade.value
+        dates.add(grade.date)
+
+        if grade.value in histogram:
+            histogram[grade.value] += 1
+        bucket = types.setdefault(grade.grade_type, [0, 0])
+        bucket[0] += 1
+        bucket[1] += grade.value
+
+        total_grades += 1
+        total_sum += grade.value
+
+    students_grades = list(rows.values())
+    for row in students_grades:
+        count = len(row['grades'])
+        row['grades_count'] = count
+        row['avg_grade'] = round(row.pop('grades_sum') / count, 1) if count else 0
+        row['recent_grades'] = row['grades'][:RECENT_GRADES]
+
+    grade_distribution = {
+        value: {'count': count, 'percentage': _percentage(count, total_grades)}
+        for value, count in histogram.items()
+        if count
+    }
+
+    grade_types_stats = []
+    for code, name in Grade.GradeType.choices:
+        if code in types:
+            count, value_sum = types[code]
+            grade_types_stats.append({
+                'type': code,
+                'name': name,
+                'count': count,
+                'avg': round(value_sum / count, 1),
+                'percentage': _percentage(count, total_grades),
+            })
+
+    return {
+        'students_grades': students_grades,
+        'dates': sorted(dates),
+        'total_grades': total_grades,
+        'overall_avg': round(total_sum / total_grades, 1) if total_grades else 0,
+        'grade_distribution': grade_distribution,
+        'grade_types_stats': grade_types_stats,
+    }
+
+
+def grade_matrix_table(matrix):
+    """
+    Журнал в виде списка строк для экспорта: заголовок (ученик, даты,
+    средний балл), затем строка на ученика. Такой список принимают
+    reportlab Table и openpyxl (ws.append построчно).
+    """
+    dates = matrix['dates']
+    table = [['Ученик'] + [f'{day:%d.%m}' for day in dates] + ['Средний балл']]
+
+    for row in matrix['students_grades']:
+        cells = [row['student'].get_full_name()]
+        for day in dates:
+            # В списке за день - от последней к первой, в ячейке - по порядку
+            cells.append(' '.join(f'{grade.value:g}' for grade in reversed(row['by_date'].get(day, []))))
+        cells.append(f"{row['avg_grade']:.1f}" if row['grades_count'] else '—')
+        table.append(cells)
+
+    return table
@@ -0,0 +1,124 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.db.models import Count, F, Sum
+
+from api.attendance_rollup import rollup_stats, rollup_totals
+from api.models import GradeSummary, GroupAttendanceDaily, StudentGroup, StudentProfile
+
+
+OVERVIEW_CACHE_TIMEOUT = getattr(settings, 'GRADES_OVERVIEW_CACHE_TIMEOUT', 300)
+
+OVERVIEW_CACHE_KEY = 'grades_overview:groups'
+
+# За сколько последних дней показывать посещаемость классов
+ATTENDANCE_DAYS = 30
+
+
+def _empty_totals():
+    return {'student_count': 0, 'grades_count': 0, 'grades_sum': Decimal(0)}
+
+
+def _average(total, count):
+    return round(float(total) / count, 1) if count else 0
+
+
+def compute_group_totals():
+    """
+    Итоги по всем классам двумя сгруппированными запросами:
+    число учеников и число/сумма оценок для каждого класса.
+
+    Возвращает {group_id: {'student_count', 'grades_count', 'grades_sum'}}.
+    """
+    totals = {}
+
+    for row in StudentProfile.objects.filter(
+        student_group__isnull=False
+    ).order_by().values('student_group').annotate(count=Count('pk')):
+        totals.setdefault(row['student_group'], _empty_totals())['student_count'] = row['count']
+
+    # Оценки - по сводкам GradeSummary, а не по всей истории оценок
+    for row in GradeSummary.objects.filter(
+        student__student_profile__student_group__isnull=False
+    ).order_by().values(
+        group_id=F('student__student_profile__student_group')
+    ).annotate(grades_count=Sum('count'), grades_sum=Sum('total')):
+        bucket = totals.setdefault(row['group_id'], _empty_totals())
+        bucket['grades_count'] = row['grades_count']
+        bucket['grades_sum'] = row['grades_sum'] or Decimal(0)
+
+    return totals
+
+
+def get_group_totals():
+    """Итоги по классам из кэша, при промахе - compute_group_totals()"""
+    totals = cache.get(OVERVIEW_CACHE_KEY)
+    if totals is None:
+        totals = compute_group_totals()
+        cache.set(OVERVIEW_CACHE_KEY, totals, OVERVIEW_CACHE_TIMEOUT)
+    return totals
+
+
+def invalidate_grades_overview():
+    """
+    Сбрасывает итоги: при новой оценке или смене состава классов они
+    пересчитываются по GradeSummary при следующем открытии страницы
+    """
+    cache.delete(OVERVIEW_CACHE_KEY)
+
+
+def group_attendance(days=ATTENDANCE_DAYS):
+    """
+    Посещаемость классов за последние days дней по дневным сводкам
+    (не больше days строк на класс). Возвращает {group_id: stats}.
+    """
+    since = timezone.now().date() - timedelta(days=days)
+    return {
+        row['student_group']: rollup_stats(row)
+        for row in GroupAttendanceDaily.objects.filter(
+            date__gte=since
+        ).order_by().values('student_group').annotate(**rollup_totals())
+    }
+
+
+def get_grades_overview():
+    """
+    Данные страницы "Оценки по группам": строка на каждый класс и итоги
+    по школе. Итоги школы складываются из тех же строк, средний балл -
+    сумма всех оценок на их число (а не среднее из средних).
+    """
+    totals = get_group_totals()
+    attendance = group_attendance()
+
+    groups_stats = []
+    total_students = 0
+    total_grades = 0
+    total_sum = Decimal(0)
+    groups_without_curator = 0
+
+    for group in StudentGroup.objects.select_related('curator').order_by('year', 'name'):
+        bucket = totals.get(group.id) or _empty_totals()
+        groups_stats.append({
+            'group': group,
+            'student_count': bucket['student_count'],
+            'avg_grade': _average(bucket['grades_sum'], bucket['grades_count']),
+            'grades_count': bucket['grades_count'],
+            'attendance': attendance.get(group.id),
+        })
+
+        total_students += bucket['student_count']
+        total_grades += bucket['grades_count']
+        total_sum += bucket['grades_sum']
+        if not group.curator_id:
+            groups_without_curator += 1
+
+    return {
+        'groups_stats': groups_stats,
+        'total_students': total_students,
+        'total_grades': total_grades,
+        'groups_without_curator': groups_without_curator,
+        'overall_avg': _average(total_sum, total_grades),
+    }
@@ -0,0 +1,38 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.models import Grade, ScheduleLesson, StudentGroup, StudentProfile
+
+from .overview import invalidate_grades_overview
+from .teacher_directory import invalidate_teacher_summaries
+
+
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+@receiver(post_save, sender=StudentProfile)
+@receiver(post_delete, sender=StudentProfile)
+@receiver(post_delete, sender=StudentGroup)
+def grades_overview_changed(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_grades_overview)
+
+
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+def teacher_grades_changed(sender, instance, **kwargs):
+    invalidate_teacher_summaries(instance.teacher_id)
+
+
+@receiver(post_save, sender=ScheduleLesson)
+@receiver(post_delete, sender=ScheduleLesson)
+def teacher_lessons_changed(sender, instance, **kwargs):
+    # Прежнего учителя урока запоминает pre_save в teacher_portal.signals
+    invalidate_teacher_summaries(instance.teacher_id, getattr(instance, '_old_teacher_id', None))
+
+
+@receiver(post_save, sender=StudentGroup)
+def teacher_group_renamed(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_teacher_summaries(*ScheduleLesson.objects.filter(
+            daily_schedule__student_group_id=instance.pk
+        ).values_list('teacher_id', flat=True).distinct())
@@ -0,0 +1,184 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Avg, Count, Max, Prefetch, Q
+
+from api.models import Grade, ScheduleLesson, StudentGroup, TeacherSubject
+from api.people_search import search_people
+
+
+TEACHER_SUMMARY_CACHE_TIMEOUT = getattr(settings, 'TEACHER_SUMMARY_CACHE_TIMEOUT', 600)
+
+TEACHERS_PER_PAGE = 20
+
+
+def _cache_key(teacher_id):
+    return f'teacher_summary:{teacher_id}'
+
+
+def invalidate_teacher_summaries(*teacher_ids):
+    """Сбрасывает строки справочника для указанных учителей"""
+    teacher_ids = [teacher_id for teacher_id in teacher_ids if teacher_id]
+    if teacher_ids:
+        cache.delete_many([_cache_key(teacher_id) for teacher_id in teacher_ids])
+
+
+def teachers_queryset(search_query=''):
+    """
+    Учителя (группа teacher или профиль учителя); с поиском - через
+    поисковые документы, по сходству с запросом
+    """
+    teachers = User.objects.filter(
+        Q(groups__name='teacher') | Q(teacher_profile__isnull=False)
+    ).distinct().order_by('last_name', 'first_name', 'id')
+    if search_query:
+        return search_people(search_query, queryset=teachers)
+    return teachers
+
+
+def _empty_summary():
+    return {
+        'teaching_groups': [],
+        'group_count': 0,
+        'lesson_count': 0,
+        'grades_total': 0,
+        'grades_avg': 0,
+        'grades_latest': None,
+        'unique_students': 0,
+    }
+
+
+def compute_teacher_summaries(teacher_ids):
+    """
+    Расписание и оценки для списка учителей тремя запросами на весь список:
+    уроки по (учитель, класс), сами классы и values('teacher').annotate()
+    по оценкам.
+
+    Возвращает {teacher_id: {...}} для каждого id из teacher_ids.
+    """
+    summaries = {teacher_id: _empty_summary() for teacher_id in teacher_ids}
+    if not summaries:
+        return summaries
+
+    lessons = list(
+        ScheduleLesson.objects.filter(
+            teacher_id__in=summaries
+        ).order_by().values(
+            'teacher_id', 'daily_schedule__student_group_id'
+        ).annotate(lessons=Count('id'))
+    )
+    groups = StudentGroup.objects.in_bulk(
+        {row['daily_schedule__student_group_id'] for row in lessons}
+    )
+
+    for row in lessons:
+        summary = summaries[row['teacher_id']]
+        summary['lesson_count'] += row['lessons']
+        group = groups.get(row['daily_schedule__student_group_id'])
+        if group is not None:
+            summary['teaching_groups'].append(group)
+
+    for summary in summaries.values():
+        summary['teaching_groups'].sort(key=lambda group: (group.year, group.name))
+        summary['group_count'] = len(summary['teaching_groups'])
+
+    for row in Grade.objects.filter(
+        teacher_id__in=summaries
+    ).order_by().values('teacher').annotate(
+        total=Count('id'),
+        avg=Avg('value'),
+        latest=Max('date'),
+        students=Count('student', distinct=True),
+    ):
+        summary = summaries[row['teacher']]
+        summary['grades_total'] = row['total']
+        summary['grades_avg'] = round(row['avg'], 1) if row['avg'] else 0
+        summary['grades_latest'] = row['latest']
+        summary['unique_students'] = row['students']
+
+    return summaries
+
+
+def get_teacher_summaries(teacher_ids):
+    """
+    Строки справочника из кэша (один get_many на страницу); недостающие
+    считаются compute_teacher_summaries() и кладутся в кэш.
+    """
+    teacher_ids = list(teacher_ids)
+    cached = cache.get_many([_cache_key(teacher_id) for teacher_id in teacher_ids])
+
+    summaries = {}
+    missing = []
+    for teacher_id in teacher_ids:
+        summary = cached.get(_cache_key(teacher_id))
+        if summary is None:
+            missing.append(teacher_id)
+        else:
+            summaries[teacher_id] = summary
+
+    if missing:
+        computed = compute_teacher_summaries(missing)
+        cache.set_many(
+            {_cache_key(teacher_id): summary for teacher_id, summary in computed.items()},
+            TEACHER_SUMMARY_CACHE_TIMEOUT,
+        )
+        summaries.update(computed)
+    return summaries
+
+
+def get_teacher_directory(search_query='', page_number=None):
+    """
+    Страница справочника учителей.
+
+    Профили и предметы учителей страницы загружаются вместе с ней
+    (select_related + Prefetch), остальное - из кэшированных строк (одним
+    get_many на всех найденных учителей), так что число запросов не
+    зависит от числа учителей.
+    """
+    teachers_qs = teachers_queryset(search_query)
+
+    paginator = Paginator(
+        teachers_qs.select_related('teacher_profile').prefetch_related(
+            Prefetch(
+                'teacher_profile__teacher_subjects',
+                queryset=TeacherSubject.objects.select_related('subject').order_by('subject__name'),
+                to_attr='subject_list',
+            )
+        ),
+        TEACHERS_PER_PAGE,
+    )
+    page_obj = paginator.get_page(page_number)
+    users = list(page_obj)
+    # Строки всех найденных учителей: из них же итог по оценкам - без
+    # count() по всей таблице оценок на каждый просмотр
+    teacher_ids = list(teachers_qs.values_list('pk', flat=True))
+    summaries = get_teacher_summaries(teacher_ids)
+
+    teachers_info = []
+    for user in users:
+        profile = getattr(user, 'teacher_profile', None)
+        subjects = profile.subject_list if profile else []
+
+        row = {
+            'id': user.id,
+            'user': user,
+            'profile': profile,
+            'patronymic': profile.patronymic if profile else '',
+            'phone': profile.phone if profile else '',
+            'qualification': profile.qualification if profile else '',
+            'birth_date': profile.birth_date if profile else None,
+            'subjects': subjects,
+            'subject_count': len(subjects),
+        }
+        row.update(summaries[user.id])
+        teachers_info.append(row)
+
+    return {
+        'teachers_info': teachers_info,
+        'page_obj': page_obj,
+        'total_teachers': paginator.count,
+        'active_teachers': teachers_qs.filter(is_active=True).count(),
+        'total_subjects': TeacherSubject.objects.filter(teacher_id__in=teacher_ids).count(),
+        'total_grades': sum(summary['grades_total'] for summary in summaries.values()),
+    }
@@ -1,5 +1,6 @@
 from django import template
-from django.contrib.auth.models import Group
+
+from MPTed_base.roles import get_user_roles
 
 register = template.Library()
 
@@ -12,11 +13,7 @@ def is_education_department(request):
     if not user.is_authenticated:
         return False
     
-    return (
-        user.is_superuser or 
-        user.groups.filter(name='admin').exists() or
-        user.groups.filter(name='education_department').exists()
-    )
+    return get_user_roles(user).has_education_department_access
 
 @register.filter(name='has_education_department_access')
 def has_education_department_access(user):
@@ -26,11 +23,7 @@ def has_education_department_access(user):
     if not user.is_authenticated:
         return False
     
-    return (
-        user.is_superuser or 
-        user.groups.filter(name='admin').exists() or
-        user.groups.filter(name='education_department').exists()
-    )
+    return get_user_roles(user).has_education_department_access
 
 @register.filter(name='is_admin')
 def is_admin(user):
@@ -40,7 +33,7 @@ def is_admin(user):
     if not user.is_authenticated:
         return False
     
-    return user.is_superuser or user.groups.filter(name='admin').exists()
+    return get_user_roles(user).is_admin
 
 @register.filter(name='is_teacher')
 def is_teacher(user):
@@ -50,7 +43,7 @@ def is_teacher(user):
     if not user.is_authenticated:
         return False
     
-    return user.groups.filter(name='teacher').exists()
+    return get_user_roles(user).is_teacher
 
 @register.filter(name='is_student')
 def is_student(user):
@@ -60,4 +53,4 @@ def is_student(user):
     if not user.is_authenticated:
         return False
     
-    return user.groups.filter(name='student').exists()
\ No newline at end of file
+    return get_user_roles(user).is_student
@@ -1,7 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, Avg, Sum, Max, Min
+from django.db.models import F, Count, Avg, Sum, Max, Min
 from django.core.paginator import Paginator
 from django.db.models.functions import TruncMonth, TruncYear  # Добавить эту строку!
 from django.utils import timezone
@@ -10,7 +10,7 @@ import json
 import calendar
 from django.http import HttpResponse
 from django.utils import timezone
-from django.db.models import Avg, Count, Q
+from django.db.models import Avg, Count
 from api.models import StudentGroup, StudentProfile, Grade, Subject
 
 
@@ -24,61 +24,20 @@ from django.contrib.auth.forms import PasswordChangeForm
 # Декораторы (скопируем из вашего декораторов.py)
 from MPTed_base.decorators import *
 
+from api.grade_summary import summary_aggregates, summary_average
+
+from .group_grades import build_grade_matrix, build_group_grades_detail, grade_matrix_table
+from .overview import get_grades_overview
+from .teacher_directory import get_teacher_directory
+
 
 # ===== ФУНКЦИИ ОЦЕНОК ПО ГРУППАМ (КОПИРУЕМ ИЗ ВАШЕГО ФАЙЛА) =====
 
 @login_required
 @education_department_required
 def group_grades_overview(request):
-    """Обзор оценок по группам (ТОЧНАЯ КОПИЯ ВАШЕЙ ФУНКЦИИ)"""
-    # Получаем все группы
-    groups = StudentGroup.objects.all().select_related('curator').order_by('year', 'name')
-    
-    # Статистика по группам
-    groups_stats = []
-    for group in groups:
-        # Количество учеников в группе
-        student_count = StudentProfile.objects.filter(student_group=group).count()
-        
-        # Средняя оценка по группе
-        avg_grade_result = Grade.objects.filter(
-            student__student_profile__student_group=group
-        ).aggregate(avg=Avg('value'))
-        avg_grade = round(avg_grade_result['avg'], 1) if avg_grade_result['avg'] else 0
-        
-        # Количество оценок
-        grades_count = Grade.objects.filter(
-            student__student_profile__student_group=group
-        ).count()
-        
-        groups_stats.append({
-            'group': group,
-            'student_count': student_count,
-            'avg_grade': avg_grade,
-            'grades_count': grades_count,
-        })
-    
-    context = {
-        'groups_stats': groups_stats,
-    }
-    # Итоги (правильные, без шаблонных костылей)
-    total_students = sum(s['student_count'] for s in groups_stats)
-    total_grades = sum(s['grades_count'] for s in groups_stats)
-
-    # Сколько групп без куратора
-    groups_without_curator = sum(1 for s in groups_stats if not s['group'].curator)
-
-    # Средний балл по всем оценкам (не среднее из средних!)
-    overall_avg_result = Grade.objects.aggregate(avg=Avg('value'))
-    overall_avg = round(overall_avg_result['avg'], 1) if overall_avg_result['avg'] else 0
-
-    context = {
-        'groups_stats': groups_stats,
-        'total_students': total_students,
-        'total_grades': total_grades,
-        'groups_without_curator': groups_without_curator,
-        'overall_avg': overall_avg,
-    }
+    """Обзор оценок по группам"""
+    context = get_grades_overview()
     return render(request, 'education_department/group_grades_overview.html', context)
 
     
@@ -87,196 +46,150 @@ def group_grades_overview(request):
 @login_required
 @education_department_required
 def group_grades_detail(request, group_id):
-    """Детальная статистика оценок по группе (ТОЧНАЯ КОПИЯ ВАШЕЙ ФУНКЦИИ)"""
-    group = get_object_or_404(StudentGroup, id=group_id)
-    
-    # Получаем предметы, которые есть у группы в расписании
-    subjects_in_schedule = Subject.objects.filter(
-        schedule_lessons__daily_schedule__student_group=group
-    ).distinct().order_by('name')
+    """Детальная статистика оценок по группе"""
+    group = get_object_or_404(StudentGroup.objects.select_related('curator'), id=group_id)
     
     # Получаем всех учеников группы
-    students = StudentProfile.objects.filter(
+    students = list(StudentProfile.objects.filter(
         student_group=group
-    ).select_related('user').order_by('user__last_name', 'user__first_name')
-    
-    # Статистика по предметам
-    subjects_stats = []
-    for subject in subjects_in_schedule:
-        # Учителя, которые ведут этот предмет в этой группе
-        teachers = User.objects.filter(
-            schedule_lessons__daily_schedule__student_group=group,
-            schedule_lessons__subject=subject
-        ).distinct()
-        
-        # Оценки по этому предмету в группе
-        grades = Grade.objects.filter(
-            student__student_profile__student_group=group,
-            subject=subject
-        )
-        
-        # Средняя оценка по предмету
-        avg_result = grades.aggregate(avg=Avg('value'))
-        avg_grade = round(avg_result['avg'], 1) if avg_result['avg'] else 0
-        
-        # Количество оценок
-        grades_count = grades.count()
-        
-        # Распределение оценок
-        grade_distribution = {}
-        for value in [5, 4, 3, 2]:
-            count = grades.filter(value=value).count()
-            if count > 0:
-                grade_distribution[value] = count
-        
-        subjects_stats.append({
-            'subject': subject,
-            'teachers': teachers,
-            'avg_grade': avg_grade,
-            'grades_count': grades_count,
-            'grade_distribution': grade_distribution,
-        })
-    
-    # Общая статистика по группе
-    all_grades = Grade.objects.filter(
-        student__student_profile__student_group=group
-    )
-    
-    total_grades = all_grades.count()
-    overall_avg_result = all_grades.aggregate(avg=Avg('value'))
-    overall_avg = round(overall_avg_result['avg'], 1) if overall_avg_result['avg'] else 0
+    ).select_related('user').order_by('user__last_name', 'user__first_name'))
     
-    # Статистика по типам оценок
-    grade_types_stats = []
-    for grade_type_code, grade_type_name in Grade.GradeType.choices:
-        count = all_grades.filter(grade_type=grade_type_code).count()
-        if count > 0:
-            avg_result = all_grades.filter(grade_type=grade_type_code).aggregate(avg=Avg('value'))
-            avg = round(avg_result['avg'], 1) if avg_result['avg'] else 0
-            grade_types_stats.append({
-                'type': grade_type_code,
-                'name': grade_type_name,
-                'count': count,
-                'avg': avg,
-            })
+    # Статистика по предметам и типам оценок - постоянное число запросов
+    context = build_group_grades_detail(group)
     
     # Последние оценки в группе
-    recent_grades = all_grades.select_related(
+    recent_grades = Grade.objects.filter(
+        student__student_profile__student_group=group
+    ).select_related(
         'student', 'subject', 'teacher'
     ).order_by('-date')[:10]
     
-    context = {
+    context.update({
         'group': group,
         'students': students,
-        'subjects_stats': subjects_stats,
-        'total_grades': total_grades,
-        'overall_avg': overall_avg,
-        'grade_types_stats': grade_types_stats,
         'recent_grades': recent_grades,
-        'student_count': students.count(),
-    }
+        'student_count': len(students),
+    })
     return render(request, 'education_department/group_grades_detail.html', context)
 
 
+def _grade_matrix_excel_response(group, subject, matrix):
+    """Журнал оценок класса по предмету в Excel"""
+    import openpyxl
+    from openpyxl.styles import Font
+    
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = f"{group.name}"[:31]
+    
+    for row in grade_matrix_table(matrix):
+        ws.append(row)
+    for cell in ws[1]:
+        cell.font = Font(bold=True)
+    ws.column_dimensions['A'].width = 35
+    
+    response = HttpResponse(
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    filename = f"grades_{group.id}_{subject.id}_{timezone.now().strftime('%Y%m%d')}.xlsx"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    wb.save(response)
+    return response
+
+
+def _grade_matrix_pdf_response(group, subject, matrix):
+    """Журнал оценок класса по предмету в PDF - та же таблица, что и в Excel"""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    
+    try:
+        pdfmetrics.registerFont(TTFont("Arial", os.path.join(settings.BASE_DIR, "static", "fonts", "ARIAL.TTF")))
+        base_font = "Arial"
+    except Exception:
+        base_font = "Helvetica"  # если шрифт не найден, кириллица может сломаться
+    
+    title = getSampleStyleSheet()["Heading2"]
+    title.fontName = base_font
+    
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=landscape(A4),
+        leftMargin=10 * mm,
+        rightMargin=10 * mm,
+        topMargin=10 * mm,
+        bottomMargin=10 * mm,
+        title=f"{subject.name} - {group.name}",
+    )
+    table = Table(grade_matrix_table(matrix), repeatRows=1)
+    table.setStyle(TableStyle([
+        ("FONTNAME", (0, 0), (-1, -1), base_font),
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#f2f4f7")),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#d0d5dd")),
+        ("ALIGN", (1, 0), (-1, -1), "CENTER"),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ]))
+    doc.build([
+        Paragraph(f"{subject.name}: оценки группы {group.name}", title),
+        Spacer(1, 6),
+        table,
+    ])
+    
+    response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
+    filename = f"grades_{group.id}_{subject.id}_{timezone.now().strftime('%Y%m%d')}.pdf"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @login_required
 @education_department_required
 def group_subject_grades(request, group_id, subject_id):
-    """Оценки по конкретному предмету в группе (ТОЧНАЯ КОПИЯ ВАШЕЙ ФУНКЦИИ)"""
+    """Оценки по конкретному предмету в группе"""
     group = get_object_or_404(StudentGroup, id=group_id)
     subject = get_object_or_404(Subject, id=subject_id)
     
-    # Проверяем, есть ли этот предмет в расписании группы
-    if not ScheduleLesson.objects.filter(
-        daily_schedule__student_group=group,
-        subject=subject
-    ).exists():
-        messages.error(request, f'Предмет "{subject.name}" не входит в расписание группы {group.name}')
-        return redirect('education_department:group_grades_detail', group_id=group_id)
-    
-    # Получаем всех учеников группы
-    students = StudentProfile.objects.filter(
-        student_group=group
-    ).select_related('user').order_by('user__last_name', 'user__first_name')
-    
-    # Получаем учителей, которые ведут этот предмет в группе
-    teachers = User.objects.filter(
+    # Учителя, которые ведут этот предмет в группе (заодно проверка расписания)
+    teachers = list(User.objects.filter(
         schedule_lessons__daily_schedule__student_group=group,
         schedule_lessons__subject=subject
-    ).distinct()
-    
-    # Собираем оценки по ученикам
-    students_grades = []
-    for student_profile in students:
-        grades = Grade.objects.filter(
-            student=student_profile.user,
-            subject=subject
-        ).order_by('-date')
-        
-        # Средняя оценка ученика по предмету
-        avg_result = grades.aggregate(avg=Avg('value'))
-        avg_grade = round(avg_result['avg'], 1) if avg_result['avg'] else 0
-        
-        # Количество оценок
-        grades_count = grades.count()
-        
-        # Последние 5 оценок
-        recent_grades = grades[:5]
-        
-        students_grades.append({
-            'student': student_profile,
-            'grades': grades,
-            'avg_grade': avg_grade,
-            'grades_count': grades_count,
-            'recent_grades': recent_grades,
-        })
+    ).distinct())
+    if not teachers:
+        messages.error(request, f'Предмет "{subject.name}" не входит в расписание группы {group.name}')
+        return redirect('education_department:group_grades_detail', group_id=group_id)
     
-    # Общая статистика по предмету в группе
-    all_grades = Grade.objects.filter(
-        student__student_profile__student_group=group,
-        subject=subject
+    # Необязательный период журнала
+    date_from = request.GET.get('date_from', '')
+    date_to = request.GET.get('date_to', '')
+    try:
+        date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+    except ValueError:
+        messages.error(request, 'Неверный формат даты')
+        date_from_obj = date_to_obj = None
+        date_from = date_to = ''
+    
+    # Журнал ученик x дата и вся статистика - из одного запроса оценок
+    matrix = build_grade_matrix(group, subject, date_from_obj, date_to_obj)
+    
+    if request.GET.get('export') == 'excel':
+        return _grade_matrix_excel_response(group, subject, matrix)
+    if request.GET.get('export') == 'pdf':
+        return _grade_matrix_pdf_response(group, subject, matrix)
+    
+    context = dict(
+        matrix,
+        group=group,
+        subject=subject,
+        teachers=teachers,
+        date_from=date_from,
+        date_to=date_to,
     )
-    
-    total_grades = all_grades.count()
-    overall_avg_result = all_grades.aggregate(avg=Avg('value'))
-    overall_avg = round(overall_avg_result['avg'], 1) if overall_avg_result['avg'] else 0
-    
-    # Распределение оценок
-    grade_distribution = {}
-    for value in [5, 4, 3, 2]:
-        count = all_grades.filter(value=value).count()
-        percentage = round((count / total_grades * 100), 1) if total_grades > 0 else 0
-        if count > 0:
-            grade_distribution[value] = {
-                'count': count,
-                'percentage': percentage
-            }
-    
-    # Статистика по типам оценок для этого предмета
-    grade_types_stats = []
-    for grade_type_code, grade_type_name in Grade.GradeType.choices:
-        count = all_grades.filter(grade_type=grade_type_code).count()
-        if count > 0:
-            avg_result = all_grades.filter(grade_type=grade_type_code).aggregate(avg=Avg('value'))
-            avg = round(avg_result['avg'], 1) if avg_result['avg'] else 0
-            percentage = round((count / total_grades * 100), 1) if total_grades > 0 else 0
-            grade_types_stats.append({
-                'type': grade_type_code,
-                'name': grade_type_name,
-                'count': count,
-                'avg': avg,
-                'percentage': percentage,
-            })
-    
-    context = {
-        'group': group,
-        'subject': subject,
-        'teachers': teachers,
-        'students_grades': students_grades,
-        'total_grades': total_grades,
-        'overall_avg': overall_avg,
-        'grade_distribution': grade_distribution,
-        'grade_types_stats': grade_types_stats,
-    }
     return render(request, 'education_department/group_subject_grades.html', context)
 
 
@@ -519,106 +432,20 @@ def teacher_full_detail(request, teacher_id):
 @login_required
 @education_department_required
 def teachers_overview(request):
-    """Обзорная страница учителей с подробной информацией (ТОЧНАЯ КОПИЯ ВАШЕЙ ФУНКЦИИ)"""
-    # Получаем всех учителей
-    teachers_qs = User.objects.filter(
-        Q(groups__name='teacher') | Q(teacher_profile__isnull=False)
-    ).distinct().order_by('last_name', 'first_name')
-    
-    # Фильтры
+    """Обзорная страница учителей с подробной информацией"""
     search_query = request.GET.get('search', '').strip()
-    if search_query:
-        teachers_qs = teachers_qs.filter(
-            Q(username__icontains=search_query) |
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query) |
-            Q(teacher_profile__patronymic__icontains=search_query)
-        ).distinct()
-    
-    # Подготавливаем детальную информацию об учителях
-    teachers_info = []
-    for user in teachers_qs:
-        try:
-            profile = user.teacher_profile
-            patronymic = profile.patronymic
-            phone = profile.phone
-            qualification = profile.qualification
-            birth_date = profile.birth_date
-        except TeacherProfile.DoesNotExist:
-            patronymic = ''
-            phone = ''
-            qualification = ''
-            birth_date = None
-        
-        # Получаем предметы учителя
-        subjects = TeacherSubject.objects.filter(
-            teacher__user=user
-        ).select_related('subject')
-        
-        # Группы, в которых преподает учитель
-        teaching_groups = StudentGroup.objects.filter(
-            daily_schedules__lessons__teacher=user
-        ).distinct().order_by('year', 'name')
-        
-        # Расписание учителя
-        schedule_lessons = ScheduleLesson.objects.filter(
-            teacher=user
-        ).select_related(
-            'daily_schedule', 'subject', 'daily_schedule__student_group'
-        ).order_by('daily_schedule__week_day', 'lesson_number')
-        
-        # Статистика по оценкам
-        grades_stats = Grade.objects.filter(
-            teacher=user
-        ).aggregate(
-            total=Count('id'),
-            avg=Avg('value'),
-            latest=Max('date')
-        )
-        
-        # Количество учеников у учителя (через оценки)
-        unique_students = Grade.objects.filter(
-            teacher=user
-        ).values('student').distinct().count()
-        
-        teachers_info.append({
-            'id': user.id,
-            'user': user,
-            'profile': profile if hasattr(user, 'teacher_profile') else None,
-            'patronymic': patronymic,
-            'phone': phone,
-            'qualification': qualification,
-            'birth_date': birth_date,
-            'subjects': subjects,
-            'teaching_groups': teaching_groups,
-            'schedule_lessons': schedule_lessons,
-            'grades_total': grades_stats['total'] or 0,
-            'grades_avg': round(grades_stats['avg'], 1) if grades_stats['avg'] else 0,
-            'grades_latest': grades_stats['latest'],
-            'unique_students': unique_students,
-            'subject_count': subjects.count(),
-            'group_count': teaching_groups.count(),
-            'lesson_count': schedule_lessons.count(),
-        })
     
-    # Общая статистика
-    total_teachers = teachers_qs.count()
-    active_teachers = teachers_qs.filter(is_active=True).count()
+    # Страница учителей со строками из кэша - фиксированное число запросов
+    context = get_teacher_directory(search_query, request.GET.get('page'))
     
     # Статистика по предметам среди учителей
-    subject_stats = Subject.objects.filter(
+    context['subject_stats'] = Subject.objects.filter(
         subject_teachers__isnull=False
     ).annotate(
         teacher_count=Count('subject_teachers', distinct=True)
     ).order_by('-teacher_count')[:10]
+    context['search_query'] = search_query
     
-    context = {
-        'teachers_info': teachers_info,
-        'search_query': search_query,
-        'total_teachers': total_teachers,
-        'active_teachers': active_teachers,
-        'subject_stats': subject_stats,
-    }
     return render(request, 'education_department/teachers_overview.html', context)
 
 
@@ -903,7 +730,7 @@ def schedule_management(request):
     messages.info(request, 'Управление расписанием находится в отдельном приложении')
     return redirect('schedule:dashboard')
 
-from django.db.models import Count, Avg, Q
+from django.db.models import Count, Avg
 from django.utils import timezone
 from datetime import timedelta
 
@@ -1028,35 +855,47 @@ def grades_school_report_pdf(request):
     # ====== агрегаты "по школе" ======
     total_groups = StudentGroup.objects.count()
     total_students = StudentProfile.objects.count()
-    total_grades = Grade.objects.count()
-
-    overall_avg_val = Grade.objects.aggregate(avg=Avg("value"))["avg"]
-    overall_avg = round(_safe_float(overall_avg_val, 0.0), 2) if overall_avg_val else 0
+    # итоги и распределение - одной агрегацией по сводкам оценок
+    totals = GradeSummary.objects.aggregate(**summary_aggregates())
+    total_grades = totals["grades_count"] or 0
+    overall_avg = summary_average(totals, digits=2)
 
     groups_without_curator = StudentGroup.objects.filter(curator__isnull=True).count()
 
     # распределение оценок (пример по целым: 5,4,3,2)
-    dist = {v: Grade.objects.filter(value=v).count() for v in [5, 4, 3, 2]}
+    dist = {v: totals[f"grades_{v}"] or 0 for v in [5, 4, 3, 2]}
 
-    # топ-5 предметов по количеству оценок (надёжно через Grade)
+    # топ-5 предметов по количеству оценок
     top_subjects = (
-        Grade.objects
+        GradeSummary.objects
         .values("subject__name")
-        .annotate(grades_cnt=Count("id"))
+        .annotate(grades_cnt=Sum("count"))
         .order_by("-grades_cnt", "subject__name")[:5]
     )
 
     # топ-5 групп по среднему баллу (где есть оценки)
-    groups_avg = (
-        StudentGroup.objects
-        .annotate(
-            grades_cnt=Count("students__user__grades", distinct=True),
-            avg_grade=Avg("students__user__grades__value"),
-            student_cnt=Count("students", distinct=True),
-        )
-        .filter(grades_cnt__gt=0)
-        .order_by("-avg_grade")[:5]
-    )
+    group_rows = sorted(
+        (
+            row for row in GradeSummary.objects
+            .filter(student__student_profile__student_group__isnull=False)
+            .order_by()
+            .values(group_id=F("student__student_profile__student_group"))
+            .annotate(**summary_aggregates())
+            # сводка без оценок средний балл не дает
+            if row["grades_count"]
+        ),
+        key=lambda row: row["grades_sum"] / row["grades_count"],
+        reverse=True,
+    )[:5]
+    groups_by_id = StudentGroup.objects.annotate(
+        student_cnt=Count("students")
+    ).in_bulk([row["group_id"] for row in group_rows])
+    groups_avg = []
+    for row in group_rows:
+        group = groups_by_id[row["group_id"]]
+        group.grades_cnt = row["grades_count"]
+        group.avg_grade = row["grades_sum"] / row["grades_count"]
+        groups_avg.append(group)
 
     # ====== PDF ======
     buffer = BytesIO()
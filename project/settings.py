@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api',
     'rest_framework',
     'rest_framework.authtoken',
@@ -70,6 +71,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'MPTed_base.middleware.UserRolesMiddleware',
+    'MPTed_base.middleware.AuditContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -112,6 +115,27 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'mpted',
+    }
+}
+
+# Сколько секунд хранить статистику учителя (страница "Статистика")
+TEACHER_STATISTICS_CACHE_TIMEOUT = 120
+
+# Сколько секунд хранить итоги по классам (страница "Оценки по группам").
+# Новые оценки сбрасывают итоги, но LocMemCache у каждого процесса свой:
+# в остальных процессах итоги обновятся не позже чем через этот таймаут
+GRADES_OVERVIEW_CACHE_TIMEOUT = 300
+
+# Сколько секунд хранить строку учителя в справочнике учебного отдела
+TEACHER_SUMMARY_CACHE_TIMEOUT = 600
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -164,4 +188,70 @@ SERVER_EMAIL = 'skolnikovaksenia64@gmail.com'
 
 # Настройки для бэкапов
 BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
-os.makedirs(BACKUP_DIR, exist_ok=True)
\ No newline at end of file
+os.makedirs(BACKUP_DIR, exist_ok=True)
+# Каталог с pg_dump/pg_restore/psql; None - искать в PATH
+BACKUP_PG_BIN_DIR = None
+# Формат копий: 'custom' - один сжатый файл, 'directory' - каталог,
+# таблицы которого выгружаются в BACKUP_JOBS потоков
+BACKUP_FORMAT = 'custom'
+BACKUP_JOBS = 4
+# Копии directory хранятся фрагментами с дедупликацией в BACKUP_DIR/store:
+# неизменившиеся таблицы не занимают место заново. Фрагменты сжимаются zlib
+# с уровнем BACKUP_STORE_COMPRESSION. Экономится только место: pg_dump
+# каждый раз пишет всю базу без сжатия во временный каталог, и он заново
+# читается целиком. После сбоя ссылки на фрагменты пересчитывает
+# gc_backup_store
+BACKUP_STORE = False
+BACKUP_STORE_COMPRESSION = 6
+# Скачивание копий: None - файл отдает приложение (gunicorn/uwsgi передают
+# его через sendfile), 'x-accel-redirect' - nginx по internal-location
+# BACKUP_ACCEL_REDIRECT_PREFIX, указывающему на BACKUP_DIR, 'x-sendfile' -
+# Apache (mod_xsendfile) или lighttpd. Это касается только копий одним
+# файлом (BACKUP_FORMAT='custom'): каталоги и копии из хранилища
+# отдаются tar-архивом, который собирает приложение
+BACKUP_DOWNLOAD_OFFLOAD = None
+BACKUP_ACCEL_REDIRECT_PREFIX = '/protected-backups/'
+# Сжатие pg_dump -Z: уровень gzip 0-9 или, для pg_dump 16+, 'zstd:3'
+BACKUP_COMPRESSION = '6'
+# Создание и восстановление копий выполняются фоновыми заданиями: True -
+# в потоке процесса сайта, False - только командой run_backup_worker
+BACKUP_RUN_IN_PROCESS = True
+# Как часто run_backup_worker проверяет очередь, с
+BACKUP_WORKER_POLL_SECONDS = 5
+# Планировщик (run_backup_scheduler): наибольший интервал проверки
+# расписаний, с, и наибольший сдвиг запуска расписания, чтобы копии
+# на одно время не запускались разом, с
+BACKUP_SCHEDULER_POLL_SECONDS = 30
+BACKUP_SCHEDULE_JITTER_SECONDS = 300
+
+# Секционирование посещаемости (по учебным годам) и журнала аудита (по
+# месяцам), только PostgreSQL. Если включить до миграции api.0008, таблицы
+# будут секционированы при миграции; уже развернутую базу переводит
+# manage_partitions --convert
+DB_PARTITIONING_ENABLED = False
+# Сколько будущих секций держать созданными заранее
+DB_PARTITIONS_AHEAD = 2
+# Схема, куда manage_partitions --detach-before переносит старые секции
+DB_PARTITION_ARCHIVE_SCHEMA = 'archive'
+
+# Журнал аудита: события пишутся фоновым потоком пакетами по
+# AUDIT_BATCH_SIZE или раз в AUDIT_FLUSH_INTERVAL_MS мс; пока база
+# недоступна, события копятся в AUDIT_SPILL_PATH. События, которые база
+# отвергла, откладываются в AUDIT_SPILL_PATH.rejected для разбора вручную
+AUDIT_ENABLED = True
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL_MS = 500
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_SPILL_PATH = os.path.join(BASE_DIR, 'audit_spill.jsonl')
+# Счетчики страницы аудита досчитывает команда refresh_audit_facets: с
+# --loop - раз в AUDIT_FACETS_REFRESH_SECONDS секунд. Сама страница только
+# читает их и журнал не блокирует
+AUDIT_FACETS_REFRESH_SECONDS = 60
+# Очистка журнала аудита (purge_audit_logs и кнопка на странице аудита):
+# пакеты по AUDIT_PURGE_BATCH_SIZE id с паузой AUDIT_PURGE_PAUSE_MS мс,
+# перед удалением - выгрузка в BACKUP_DIR/audit_archive. AUDIT_RETENTION_DAYS -
+# срок хранения для запуска purge_audit_logs по расписанию (None - не задан)
+AUDIT_RETENTION_DAYS = None
+AUDIT_PURGE_BATCH_SIZE = 5000
+AUDIT_PURGE_PAUSE_MS = 100
+AUDIT_PURGE_ARCHIVE = True
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TeacherPortalConfig(AppConfig):
     name = 'teacher_portal'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,177 @@
+from collections import defaultdict
+
+from django.db import transaction
+
+from api.attendance_rollup import refresh_attendance_rollups
+from api.audit import record
+from api.models import Attendance, AuditLog, ScheduleLesson, StudentProfile
+
+from .statistics import invalidate_teacher_statistics
+
+
+VALID_STATUSES = frozenset(Attendance.Status.values)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_group_rosters(group_ids):
+    """Возвращает {id класса: множество id учеников} одним запросом"""
+    rosters = defaultdict(set)
+    if group_ids:
+        for user_id, group_id in StudentProfile.objects.filter(
+            student_group_id__in=group_ids
+        ).values_list('user_id', 'student_group_id'):
+            rosters[group_id].add(user_id)
+    return rosters
+
+
+def save_attendance_batch(teacher, date, attendance_data):
+    """
+    Сохраняет посещаемость за день пакетом.
+
+    attendance_data - {lesson_id: {student_id: status}}, как его отправляет
+    страница посещаемости. Уроки и составы классов загружаются двумя
+    запросами, все записи пишутся одним bulk_create с upsert по
+    (student, schedule_lesson, date) внутри одной транзакции.
+
+    Возвращает список результатов по каждой строке:
+    {'lesson_id', 'student_id', 'status', 'saved', 'error'}.
+    """
+    results = []
+    lesson_ids = {_to_int(lesson_id) for lesson_id in attendance_data} - {None}
+
+    # Группа каждого урока (только уроки этого учителя)
+    lesson_groups = dict(
+        ScheduleLesson.objects.filter(
+            id__in=lesson_ids,
+            teacher=teacher,
+        ).values_list('id', 'daily_schedule__student_group_id')
+    )
+    rosters = load_group_rosters(set(lesson_groups.values()))
+
+    records = {}
+    for raw_lesson_id, student_statuses in attendance_data.items():
+        lesson_id = _to_int(raw_lesson_id)
+        if not isinstance(student_statuses, dict):
+            results.append({
+                'lesson_id': raw_lesson_id,
+                'student_id': None,
+                'status': None,
+                'saved': False,
+                'error': 'Неверный формат данных',
+            })
+            continue
+
+        lesson_error = None if lesson_id in lesson_groups else 'Урок не найден'
+        roster = rosters.get(lesson_groups.get(lesson_id), set())
+
+        for raw_student_id, status in student_statuses.items():
+            student_id = _to_int(raw_student_id)
+            error = lesson_error
+            if error is None:
+                if student_id not in roster:
+                    error = 'Ученик не состоит в классе урока'
+                elif not isinstance(status, str) or status not in VALID_STATUSES:
+                    error = 'Неверный статус'
+
+            row = {
+                'lesson_id': raw_lesson_id,
+                'student_id': raw_student_id,
+                'status': status,
+                'saved': error is None,
+                'error': error,
+            }
+            results.append(row)
+
+            if error is None:
+                # Повтор той же пары в запросе - побеждает последнее значение
+                records[(student_id, lesson_id)] = Attendance(
+                    student_id=student_id,
+                    schedule_lesson_id=lesson_id,
+                    date=date,
+                    status=status,
+                )
+
+    if records:
+        with transaction.atomic():
+            Attendance.objects.bulk_create(
+                list(records.values()),
+                update_conflicts=True,
+                unique_fields=['student', 'schedule_lesson', 'date'],
+                update_fields=['status'],
+            )
+            # bulk_create не отправляет post_save - сводки пересчитываем сами,
+            # одним пакетом на всю отправку
+            refresh_attendance_rollups(
+                dates=[date],
+                student_ids={student_id for student_id, _ in records},
+                group_ids={lesson_groups[lesson_id] for _, lesson_id in records},
+            )
+        invalidate_teacher_statistics(teacher.id)
+        # Одно событие аудита на всю отправку - bulk_create без сигналов
+        record(
+            AuditLog.ActionType.UPDATE, 'Attendance',
+            new_values={
+                'date': date,
+                'lessons': sorted({lesson_id for _, lesson_id in records}),
+                'marks': {
+                    f'{lesson_id}:{student_id}': mark.status
+                    for (student_id, lesson_id), mark in records.items()
+                },
+            },
+            user=teacher,
+        )
+
+    return results
+
+
+def load_attendance_grid(lessons, date):
+    """
+    Строит матрицу урок x ученик для страницы посещаемости.
+
+    Составы всех классов дня и отметки за дату загружаются двумя запросами
+    независимо от числа уроков. Возвращает список {'lesson', 'students'}
+    для шаблона.
+    """
+    lessons = list(lessons)
+    group_ids = {lesson.daily_schedule.student_group_id for lesson in lessons}
+
+    rosters = defaultdict(list)
+    if group_ids:
+        for profile in StudentProfile.objects.filter(
+            student_group_id__in=group_ids
+        ).select_related('user').order_by('user__last_name', 'user__first_name'):
+            rosters[profile.student_group_id].append(profile)
+
+    records = {}
+    if lessons:
+        for attendance in Attendance.objects.filter(
+            schedule_lesson_id__in=[lesson.id for lesson in lessons],
+            date=date,
+        ):
+            records[(attendance.schedule_lesson_id, attendance.student_id)] = attendance
+
+    attendance_data = []
+    for lesson in lessons:
+        lesson_students = []
+        for profile in rosters.get(lesson.daily_schedule.student_group_id, []):
+            attendance = records.get((lesson.id, profile.user_id))
+            status = attendance.status if attendance else None
+            lesson_students.append({
+                'student': profile.user,
+                'profile': profile,
+                'attendance': attendance,
+                'status': status,
+            })
+
+        attendance_data.append({
+            'lesson': lesson,
+            'students': lesson_students,
+        })
+
+    return attendance_data
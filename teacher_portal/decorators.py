@@ -3,6 +3,8 @@ from django.shortcuts import redirect
 from django.contrib import messages
 from functools import wraps
 
+from MPTed_base.roles import get_user_roles
+
 def teacher_required(view_func):
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
@@ -11,7 +13,7 @@ def teacher_required(view_func):
             return redirect('login_page')
         
         # Проверяем, что пользователь - учитель
-        if not (request.user.groups.filter(name='teacher').exists() or 
+        if not (get_user_roles(request.user).is_teacher or 
                 hasattr(request.user, 'teacher_profile')):
             messages.error(request, 'Доступ только для учителей')
             return redirect('dashboard_page')
@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api.models import Attendance, Grade, Homework, ScheduleLesson
+
+from .statistics import invalidate_teacher_statistics
+from .submissions import sync_submission_grade
+
+
+@receiver(post_save, sender=Grade)
+@receiver(post_delete, sender=Grade)
+def grade_changed(sender, instance, **kwargs):
+    invalidate_teacher_statistics(instance.teacher_id)
+
+
+@receiver(post_save, sender=Grade)
+def grade_submission_synced(sender, instance, raw=False, **kwargs):
+    # Работу, за которую выставлена оценка, можно передать в _submission
+    if not raw:
+        sync_submission_grade(instance, getattr(instance, '_submission', None))
+
+
+def _lesson_teacher_id(lesson_id):
+    return ScheduleLesson.objects.filter(pk=lesson_id).values_list('teacher_id', flat=True).first()
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+@receiver(post_save, sender=Homework)
+@receiver(post_delete, sender=Homework)
+def lesson_activity_changed(sender, instance, **kwargs):
+    invalidate_teacher_statistics(_lesson_teacher_id(instance.schedule_lesson_id))
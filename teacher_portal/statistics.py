@@ -0,0 +1,201 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, F, Q, Sum, When
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from api.models import Attendance, Grade, Homework
+
+
+STATISTICS_CACHE_TIMEOUT = getattr(settings, 'TEACHER_STATISTICS_CACHE_TIMEOUT', 120)
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 365
+WEEKS = 5
+
+
+def parse_days(value):
+    """Период статистики в днях: целое число от 1 до MAX_DAYS"""
+    try:
+        days = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_DAYS
+    return min(max(days, 1), MAX_DAYS)
+
+
+def _version_key(teacher_id):
+    return f'teacher_statistics_version:{teacher_id}'
+
+
+def invalidate_teacher_statistics(*teacher_ids):
+    """
+    Делает устаревшей закэшированную статистику учителей.
+    Меняется только номер версии - старые ключи истекут сами.
+    """
+    for teacher_id in teacher_ids:
+        if teacher_id:
+            cache.set(_version_key(teacher_id), timezone.now().timestamp(), None)
+
+
+def _week_start(value):
+    if isinstance(value, datetime):
+        value = timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value
+
+
+def empty_grade_stats():
+    return {'total': 0, 'average': None, 'excellent': 0, 'good': 0, 'satisfactory': 0, 'poor': 0}
+
+
+def empty_attendance_stats():
+    return {'total': 0, 'present': 0, 'absent': 0, 'late': 0, 'present_percentage': 0}
+
+
+def _percentage(part, total):
+    return round((part / total) * 100, 1) if total else 0
+
+
+def compute_teacher_statistics(teacher, days, end_date=None):
+    """
+    Считает статистику учителя за период: по одному запросу на таблицу
+    оценок, посещаемости и ДЗ. Каждая таблица группируется по предмету
+    или классу и неделе (TruncWeek), разбивки по периоду и по неделям
+    собираются из одного результата условной агрегацией.
+    """
+    end_date = end_date or timezone.now().date()
+    start_date = end_date - timedelta(days=days)
+
+    # Последние WEEKS календарных недель, включая текущую
+    last_week = end_date - timedelta(days=end_date.weekday())
+    weeks = [last_week - timedelta(weeks=i) for i in range(WEEKS - 1, -1, -1)]
+    range_start = min(start_date, weeks[0])
+
+    in_period = Q(date__gte=start_date)
+
+    # Оценки: предмет x неделя
+    subjects = {}
+    week_grades = {}
+    total_grades = 0
+    graded_hw = 0
+    for row in Grade.objects.filter(
+        teacher=teacher,
+        date__range=[range_start, end_date],
+    ).order_by().values('subject_id', week=TruncWeek('date')).annotate(
+        count=Count('id'),
+        period_total=Count(Case(When(in_period, then=1))),
+        period_sum=Sum(Case(When(in_period, then='value'))),
+        excellent=Count(Case(When(in_period & Q(value__gte=4.5), then=1))),
+        good=Count(Case(When(in_period & Q(value__gte=3.5, value__lt=4.5), then=1))),
+        satisfactory=Count(Case(When(in_period & Q(value__gte=2.5, value__lt=3.5), then=1))),
+        poor=Count(Case(When(in_period & Q(value__lt=2.5), then=1))),
+        hw=Count(Case(When(in_period & Q(grade_type='HW'), then=1))),
+    ):
+        week = _week_start(row['week'])
+        week_grades[week] = week_grades.get(week, 0) + row['count']
+
+        bucket = subjects.setdefault(row['subject_id'], dict(empty_grade_stats(), sum=0))
+        bucket['total'] += row['period_total']
+        bucket['sum'] += row['period_sum'] or 0
+        for key in ('excellent', 'good', 'satisfactory', 'poor'):
+            bucket[key] += row[key]
+
+        total_grades += row['period_total']
+        graded_hw += row['hw']
+
+    for bucket in subjects.values():
+        total = bucket['total']
+        bucket['average'] = bucket.pop('sum') / total if total else None
+
+    # Посещаемость: класс x неделя
+    groups = {}
+    week_attendance = {}
+    total_attendance = {'total': 0, 'present': 0}
+    for row in Attendance.objects.filter(
+        schedule_lesson__teacher=teacher,
+        date__range=[range_start, end_date],
+    ).order_by().values(
+        group_id=F('schedule_lesson__daily_schedule__student_group_id'),
+        week=TruncWeek('date'),
+    ).annotate(
+        count=Count('id'),
+        period_total=Count(Case(When(in_period, then=1))),
+        present=Count(Case(When(in_period & Q(status='P'), then=1))),
+        absent=Count(Case(When(in_period & Q(status='A'), then=1))),
+        late=Count(Case(When(in_period & Q(status='L'), then=1))),
+    ):
+        week = _week_start(row['week'])
+        week_attendance[week] = week_attendance.get(week, 0) + row['count']
+
+        bucket = groups.setdefault(row['group_id'], empty_attendance_stats())
+        bucket['total'] += row['period_total']
+        for key in ('present', 'absent', 'late'):
+            bucket[key] += row[key]
+
+        total_attendance['total'] += row['period_total']
+        total_attendance['present'] += row['present']
+
+    for bucket in groups.values():
+        bucket['present_percentage'] = _percentage(bucket['present'], bucket['total'])
+
+    # Домашние задания: неделя
+    tz = timezone.get_current_timezone()
+    period_start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    homework_stats = {'total': 0, 'with_submissions': 0, 'graded': graded_hw}
+    week_homework = {}
+    for row in Homework.objects.filter(
+        schedule_lesson__teacher=teacher,
+        created_at__gte=timezone.make_aware(datetime.combine(range_start, time.min), tz),
+        created_at__lt=timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz),
+    ).order_by().values(week=TruncWeek('created_at')).annotate(
+        count=Count('id', distinct=True),
+        period_total=Count(Case(When(created_at__gte=period_start, then='id')), distinct=True),
+        with_submissions=Count(
+            Case(When(created_at__gte=period_start, submissions__isnull=False, then='id')),
+            distinct=True,
+        ),
+    ):
+        week = _week_start(row['week'])
+        week_homework[week] = week_homework.get(week, 0) + row['count']
+        homework_stats['total'] += row['period_total']
+        homework_stats['with_submissions'] += row['with_submissions']
+
+    weekly_activity = [
+        {
+            'week': f'{week:%d.%m} - {week + timedelta(days=6):%d.%m}',
+            'grades': week_grades.get(week, 0),
+            'attendance': week_attendance.get(week, 0),
+            'homework': week_homework.get(week, 0),
+        }
+        for week in weeks
+    ]
+
+    return {
+        'start': start_date,
+        'end': end_date,
+        'subjects': subjects,
+        'groups': groups,
+        'homework_stats': homework_stats,
+        'weekly_activity': weekly_activity,
+        'total_grades': total_grades,
+        'total_attendance': total_attendance,
+        'avg_attendance': _percentage(total_attendance['present'], total_attendance['total']),
+    }
+
+
+def get_teacher_statistics(teacher, days):
+    """
+    Статистика учителя за days дней с коротким кэшем на (учитель, период).
+    Кэш сбрасывается, когда учитель ставит оценки, отмечает посещаемость
+    или меняет ДЗ (см. invalidate_teacher_statistics).
+    """
+    today = timezone.now().date()
+    version = cache.get(_version_key(teacher.id), 0)
+    key = f'teacher_statistics:{teacher.id}:{days}:{today.isoformat()}:{version}'
+
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_teacher_statistics(teacher, days, end_date=today)
+        cache.set(key, stats, STATISTICS_CACHE_TIMEOUT)
+    return stats
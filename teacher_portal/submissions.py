@@ -0,0 +1,60 @@
+from api.models import HomeworkSubmission
+
+
+def match_submission_grades(submissions):
+    """
+    Сопоставляет сданные работы с оценками за ДЗ.
+
+    Оценка хранится прямо в HomeworkSubmission.grade, поэтому при загрузке
+    работ с select_related('grade') дополнительных запросов нет.
+
+    Возвращает {submission_id: Grade}.
+    """
+    return {
+        submission.id: submission.grade
+        for submission in submissions
+        if submission.grade_id
+    }
+
+
+def pending_submissions(teacher):
+    """Работы учеников, которые ждут проверки у учителя (частичный индекс по grade IS NULL)"""
+    return HomeworkSubmission.objects.filter(
+        homework__schedule_lesson__teacher=teacher,
+        grade__isnull=True,
+    )
+
+
+def sync_submission_grade(grade, submission=None):
+    """
+    Поддерживает связь оценки с работой после ее создания или изменения.
+    Вызывается сигналом post_save оценки - для оценок из любого места
+    (журнал учителя, api, админка).
+
+    submission - работа, за которую выставлена оценка (проверка работы).
+    Без нее оценка HW привязывается к последней непроверенной работе
+    ученика по этому предмету, сданной не позже даты оценки. Если тип
+    оценки сменился с HW, связь снимается.
+    """
+    linked = HomeworkSubmission.objects.filter(grade=grade)
+
+    if grade.grade_type != 'HW':
+        linked.update(grade=None)
+        return None
+
+    if submission is not None:
+        linked.exclude(pk=submission.pk).update(grade=None)
+    else:
+        submission = linked.first()
+    if submission is None:
+        submission = HomeworkSubmission.objects.filter(
+            student_id=grade.student_id,
+            homework__schedule_lesson__subject_id=grade.subject_id,
+            grade__isnull=True,
+            submitted_at__date__lte=grade.date,
+        ).order_by('-submitted_at').first()
+
+    if submission is not None and submission.grade_id != grade.pk:
+        submission.grade = grade
+        submission.save(update_fields=['grade'])
+    return submission
@@ -0,0 +1,81 @@
+from django.db.models import Exists, OuterRef, Q
+
+from api.models import ScheduleLesson, StudentGroup, TeacherProfile, TeacherSubject
+
+
+class TeacherContext:
+    """
+    Компактное описание "мира" учителя: профиль, классы и предметы.
+    Хранит неизменяемые множества id, чтобы views фильтровали по ним
+    вместо повторного построения подзапросов.
+    """
+
+    def __init__(self, user_id, profile, groups, subjects):
+        self.user_id = user_id
+        self.profile = profile
+        self.all_groups = tuple(groups)
+        self.subjects = tuple(subjects)
+
+        self.group_ids = frozenset(group.id for group in self.all_groups)
+        self.curator_group_ids = frozenset(
+            group.id for group in self.all_groups if group.curator_id == user_id
+        )
+        self.teaching_group_ids = frozenset(
+            group.id for group in self.all_groups if group.is_teaching
+        )
+        self.subject_ids = frozenset(subject.id for subject in self.subjects)
+
+    @property
+    def curator_groups(self):
+        return [group for group in self.all_groups if group.id in self.curator_group_ids]
+
+    @property
+    def teaching_groups(self):
+        return [group for group in self.all_groups if group.id in self.teaching_group_ids]
+
+    def __repr__(self):
+        return (
+            f'<TeacherContext {self.user_id}: '
+            f'{len(self.group_ids)} groups, {len(self.subject_ids)} subjects>'
+        )
+
+
+def build_teacher_context(user):
+    """Собирает контекст учителя напрямую из БД (профиль + классы + предметы)"""
+    profile = TeacherProfile.objects.filter(user_id=user.id).first()
+
+    # Классы, где учитель - классный руководитель или ведет уроки, одним запросом
+    teaches = ScheduleLesson.objects.filter(
+        teacher_id=user.id,
+        daily_schedule__student_group=OuterRef('pk'),
+    )
+    groups = StudentGroup.objects.annotate(
+        is_teaching=Exists(teaches)
+    ).filter(
+        Q(curator_id=user.id) | Q(is_teaching=True)
+    ).order_by('year', 'name')
+
+    # Предметы учителя (teacher_id у TeacherSubject совпадает с id пользователя)
+    subjects = [
+        teacher_subject.subject
+        for teacher_subject in TeacherSubject.objects.filter(
+            teacher_id=user.id
+        ).select_related('subject').order_by('subject__name')
+    ]
+
+    return TeacherContext(user.id, profile, list(groups), subjects)
+
+
+def get_teacher_context(user):
+    """
+    Возвращает контекст учителя. Он строится один раз за запрос и
+    запоминается на объекте пользователя. Между запросами не кэшируется:
+    по group_ids решается доступ к ученикам, а кэш по умолчанию
+    (LocMemCache) у каждого процесса свой - сброс в одном процессе не
+    достал бы до остальных.
+    """
+    context = getattr(user, '_teacher_context', None)
+    if context is None:
+        context = build_teacher_context(user)
+        user._teacher_context = context
+    return context
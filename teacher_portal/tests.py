@@ -1,3 +1,79 @@
+import unittest
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
 
-# Create your tests here.
+from api.models import (
+    Attendance, AttendanceDaily, DailySchedule, ScheduleLesson, StudentGroup, StudentProfile, Subject,
+)
+
+from .attendance import save_attendance_batch
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Сводки посещаемости блокируются средствами PostgreSQL')
+class SaveAttendanceBatchTests(TestCase):
+    """Пакетная запись посещаемости со страницы учителя"""
+
+    DAY = date(2025, 10, 6)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create(username='batch_teacher')
+        other_teacher = User.objects.create(username='batch_other')
+        subject = Subject.objects.create(name='История')
+        group = StudentGroup.objects.create(name='9В', year=9)
+        other_group = StudentGroup.objects.create(name='9Г', year=9)
+
+        cls.students = []
+        for number, student_group in enumerate((group, group, other_group)):
+            user = User.objects.create(username=f'batch{number}')
+            StudentProfile.objects.create(user=user, patronymic='', course=1, student_group=student_group)
+            cls.students.append(user)
+
+        schedule = DailySchedule.objects.create(student_group=group, week_day='MON')
+        cls.lesson = ScheduleLesson.objects.create(
+            daily_schedule=schedule, lesson_number=1, subject=subject, teacher=cls.teacher,
+        )
+        cls.foreign_lesson = ScheduleLesson.objects.create(
+            daily_schedule=schedule, lesson_number=2, subject=subject, teacher=other_teacher,
+        )
+
+    def save(self, attendance_data):
+        results = save_attendance_batch(self.teacher, self.DAY, attendance_data)
+        return {(row['lesson_id'], row['student_id']): row for row in results}
+
+    def test_marks_are_upserted(self):
+        first, second, _ = self.students
+        self.save({str(self.lesson.pk): {str(first.pk): 'P', str(second.pk): 'A'}})
+        results = self.save({str(self.lesson.pk): {str(first.pk): 'L'}})
+
+        self.assertTrue(results[(str(self.lesson.pk), str(first.pk))]['saved'])
+        self.assertEqual(
+            dict(Attendance.objects.filter(date=self.DAY).values_list('student_id', 'status')),
+            {first.pk: 'L', second.pk: 'A'},
+        )
+        # bulk_create идет без сигналов - сводки пересчитаны самим пакетом
+        self.assertEqual(
+            AttendanceDaily.objects.get(student=first, date=self.DAY).late, 1,
+        )
+
+    def test_invalid_rows_are_reported_not_saved(self):
+        first, _, outsider = self.students
+        lesson_id = str(self.lesson.pk)
+        results = self.save({
+            lesson_id: {str(first.pk): ['P'], str(outsider.pk): 'P', 'abc': 'P'},
+            str(self.foreign_lesson.pk): {str(first.pk): 'P'},
+            '999999': {str(first.pk): 'P'},
+            'broken': 'P',
+        })
+
+        self.assertEqual(results[(lesson_id, str(first.pk))]['error'], 'Неверный статус')
+        self.assertEqual(results[(lesson_id, str(outsider.pk))]['error'], 'Ученик не состоит в классе урока')
+        self.assertEqual(results[(lesson_id, 'abc')]['error'], 'Ученик не состоит в классе урока')
+        self.assertEqual(results[(str(self.foreign_lesson.pk), str(first.pk))]['error'], 'Урок не найден')
+        self.assertEqual(results[('999999', str(first.pk))]['error'], 'Урок не найден')
+        self.assertEqual(results[('broken', None)]['error'], 'Неверный формат данных')
+        self.assertFalse(any(row['saved'] for row in results.values()))
+        self.assertFalse(Attendance.objects.exists())
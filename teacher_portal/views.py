@@ -3,57 +3,28 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.utils import timezone
 from datetime import datetime, timedelta, date
-from django.db.models import Q, Count, Avg, Sum, Case, When, Value, IntegerField, Max
+from django.db.models import Count, Avg, Sum, Case, When, Value, IntegerField
 from django.core.paginator import Paginator
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
+from django.db import transaction
 import json
 
 from api.models import *
+from api.people_search import search_people
+from api.student_stats import count_active_students, get_student_stats
+from .attendance import load_attendance_grid, save_attendance_batch
 from .decorators import teacher_required
+from .statistics import (
+    DEFAULT_DAYS, empty_attendance_stats, empty_grade_stats, get_teacher_statistics, parse_days,
+)
+from .submissions import match_submission_grades, pending_submissions
+from .teacher_context import get_teacher_context
 
 # teacher_portal/views.py
 def get_teacher_info(user):
-    """Получает информацию о учителе и его группах"""
-    try:
-        profile = TeacherProfile.objects.get(user=user)
-    except TeacherProfile.DoesNotExist:
-        profile = None
-    
-    # Группы, где учитель - классный руководитель
-    curator_groups = StudentGroup.objects.filter(curator=user)
-    
-    # Группы, которые учитель ведет
-    teaching_groups = StudentGroup.objects.filter(
-        daily_schedules__lessons__teacher=user
-    ).distinct()
-    
-    # Все группы учителя (классный руководитель + преподает)
-    # Используем union вместо оператора |
-    all_groups_qs = StudentGroup.objects.filter(
-        id__in=curator_groups.values_list('id', flat=True)
-    ).union(
-        StudentGroup.objects.filter(
-            id__in=teaching_groups.values_list('id', flat=True)
-        )
-    )
-    
-    # Конвертируем union QuerySet в список для удобства
-    all_groups = list(all_groups_qs)
-    
-    # Предметы, которые ведет учитель
-    subjects = Subject.objects.filter(
-        subject_teachers__teacher__user=user
-    ).distinct()
-    
-    return {
-        'profile': profile,
-        'curator_groups': curator_groups,
-        'teaching_groups': teaching_groups,
-        'all_groups': all_groups,
-        'subjects': subjects,
-    }
-
+    """Получает информацию о учителе и его группах (из кэша TeacherContext)"""
+    return get_teacher_context(user)
 
 
 @teacher_required
@@ -64,7 +35,7 @@ def dashboard(request):
     
     # Статистика
     total_students = StudentProfile.objects.filter(
-        student_group__in=teacher_info['all_groups']
+        student_group_id__in=teacher_info.group_ids
     ).count()
     
     # Оценки за сегодня
@@ -85,32 +56,17 @@ def dashboard(request):
         due_date__gte=today
     ).count()
     
-    # Ожидающие проверки работы
-    recent_submissions = HomeworkSubmission.objects.filter(
-        homework__schedule_lesson__teacher=request.user,
+    # Ожидающие проверки работы (по недавним ДЗ и еще без оценки)
+    pending_count = pending_submissions(request.user).filter(
         homework__due_date__gte=today - timedelta(days=7)
-    )
-
-    # Получаем все домашние задания, по которым есть отправки
-    submitted_homework_ids = recent_submissions.values_list('homework_id', flat=True)
-
-    # Получаем работы, по которым еще нет оценок типа 'HW'
-    pending_submissions = recent_submissions.filter(
-        ~Q(id__in=Grade.objects.filter(
-            grade_type='HW',
-            subject__in=Subject.objects.filter(
-                schedule_lessons__homeworks__id__in=submitted_homework_ids
-            ),
-            student__in=recent_submissions.values_list('student_id', flat=True)
-        ).values_list('student_id', flat=True))
     ).count()
     
     # Расписание на сегодня
     today_schedule = []
-    if teacher_info['all_groups']:
+    if teacher_info.group_ids:
         week_day = today.strftime('%a').upper()[:3]
         today_schedule = ScheduleLesson.objects.filter(
-            daily_schedule__student_group__in=teacher_info['all_groups'],
+            daily_schedule__student_group_id__in=teacher_info.group_ids,
             daily_schedule__week_day=week_day,
             daily_schedule__is_active=True,
             daily_schedule__is_weekend=False,
@@ -136,7 +92,7 @@ def dashboard(request):
             'today_grades': today_grades,
             'today_attendance': today_attendance,
             'active_homework': active_homework,
-            'pending_submissions': pending_submissions,
+            'pending_submissions': pending_count,
         },
         'today_schedule': today_schedule,
         'upcoming_homework': upcoming_homework,
@@ -208,10 +164,10 @@ def manage_grades(request):
     )
     
     # Данные для фильтров
-    groups = teacher_info['all_groups']
-    subjects = teacher_info['subjects']
+    groups = teacher_info.all_groups
+    subjects = teacher_info.subjects
     students = User.objects.filter(
-        student_profile__student_group__in=teacher_info['all_groups']
+        student_profile__student_group_id__in=teacher_info.group_ids
     ).distinct().order_by('last_name', 'first_name')
     
     context = {
@@ -279,17 +235,19 @@ def add_grade(request):
                 if lesson_id:
                     schedule_lesson = ScheduleLesson.objects.get(id=lesson_id)
                 
-                # Создаем оценку
-                grade = Grade.objects.create(
-                    student=student,
-                    subject=subject,
-                    schedule_lesson=schedule_lesson,
-                    teacher=request.user,
-                    value=value,
-                    grade_type=grade_type,
-                    date=grade_date,
-                    comment=comment
-                )
+                # Создаем оценку: сводка GradeSummary и связь с работой
+                # обновляются сигналами в той же транзакции
+                with transaction.atomic():
+                    Grade.objects.create(
+                        student=student,
+                        subject=subject,
+                        schedule_lesson=schedule_lesson,
+                        teacher=request.user,
+                        value=value,
+                        grade_type=grade_type,
+                        date=grade_date,
+                        comment=comment
+                    )
                 
                 messages.success(request, f'Оценка {value} успешно выставлена для {student.get_full_name()}')
                 return redirect('teacher_portal:grades')  # Исправлено!
@@ -299,10 +257,10 @@ def add_grade(request):
     
     # Данные для формы
     students = User.objects.filter(
-        student_profile__student_group__in=teacher_info['all_groups']
+        student_profile__student_group_id__in=teacher_info.group_ids
     ).distinct().order_by('last_name', 'first_name')
     
-    subjects = teacher_info['subjects']
+    subjects = teacher_info.subjects
     
     # Исправленная строка - убираем фильтрацию по дате
     recent_lessons = ScheduleLesson.objects.filter(
@@ -358,7 +316,8 @@ def edit_grade(request, grade_id):
                 grade.value = value
                 grade.grade_type = grade_type
                 grade.comment = comment
-                grade.save()
+                with transaction.atomic():
+                    grade.save()
                 
                 messages.success(request, 'Оценка успешно обновлена')
                 return redirect('teacher_portal:grades')  # Исправлено!
@@ -440,44 +399,12 @@ def manage_attendance(request):
     if subject_id:
         lessons = lessons.filter(subject_id=subject_id)
     
-    # Получаем учеников для каждого урока
-    attendance_data = []
-    for lesson in lessons:
-        # Получаем учеников группы
-        students = StudentProfile.objects.filter(
-            student_group=lesson.daily_schedule.student_group
-        ).select_related('user').order_by('user__last_name', 'user__first_name')
-        
-        # Получаем посещаемость для этого урока
-        attendance_records = {
-            record.student_id: record 
-            for record in Attendance.objects.filter(
-                schedule_lesson=lesson,
-                date=selected_date_obj
-            )
-        }
-        
-        lesson_data = {
-            'lesson': lesson,
-            'students': [],
-        }
-        
-        for student_profile in students:
-            student = student_profile.user
-            attendance = attendance_records.get(student.id)
-            
-            lesson_data['students'].append({
-                'student': student,
-                'profile': student_profile,
-                'attendance': attendance,
-                'status': attendance.status if attendance else None,
-            })
-        
-        attendance_data.append(lesson_data)
+    # Ученики и отметки всех уроков дня - двумя запросами
+    attendance_data = load_attendance_grid(lessons, selected_date_obj)
     
     # Данные для фильтров
-    groups = teacher_info['all_groups']
-    subjects = teacher_info['subjects']
+    groups = teacher_info.all_groups
+    subjects = teacher_info.subjects
     
     context = {
         'teacher_info': teacher_info,
@@ -500,108 +427,43 @@ def manage_attendance(request):
 @teacher_required
 def save_attendance(request):
     """Сохранение посещаемости"""
-    print(f"DEBUG: save_attendance called by {request.user.username}")
-    
     try:
-        # Читаем тело запроса
-        body = request.body.decode('utf-8')
-        print(f"DEBUG: Request body: {body}")
-        
-        data = json.loads(body)
-        print(f"DEBUG: Parsed data: {data}")
+        data = json.loads(request.body.decode('utf-8'))
         
         date_str = data.get('date')
         attendance_data = data.get('attendance', {})
         
-        print(f"DEBUG: Date: {date_str}")
-        print(f"DEBUG: Attendance data: {attendance_data}")
-        
         if not date_str:
-            print("DEBUG: No date provided")
             return JsonResponse({
                 'success': False,
                 'error': 'Дата не указана'
             }, status=400)
         
+        if not isinstance(attendance_data, dict):
+            return JsonResponse({
+                'success': False,
+                'error': 'Неверный формат данных'
+            }, status=400)
+        
         date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-        saved_count = 0
         
-        # Обрабатываем каждый урок
-        for lesson_id, student_statuses in attendance_data.items():
-            print(f"DEBUG: Processing lesson {lesson_id}")
-            try:
-                lesson = ScheduleLesson.objects.get(id=lesson_id, teacher=request.user)
-                print(f"DEBUG: Found lesson: {lesson.id} - {lesson.subject.name}")
-                
-                # Проверяем, что урок существует и учитель ведет его
-                if lesson.teacher != request.user:
-                    print(f"DEBUG: Lesson teacher mismatch")
-                    continue
-                
-                # Обрабатываем каждого ученика в уроке
-                for student_id, status in student_statuses.items():
-                    print(f"DEBUG: Processing student {student_id} with status {status}")
-                    try:
-                        student = User.objects.get(id=student_id)
-                        print(f"DEBUG: Found student: {student.get_full_name()}")
-                        
-                        # Проверяем, что ученик в группе урока
-                        if not StudentProfile.objects.filter(
-                            user=student,
-                            student_group=lesson.daily_schedule.student_group
-                        ).exists():
-                            print(f"DEBUG: Student not in lesson group")
-                            continue
-                        
-                        # Проверяем корректность статуса
-                        valid_statuses = ['P', 'A', 'L']
-                        if status not in valid_statuses:
-                            print(f"DEBUG: Invalid status: {status}")
-                            continue
-                        
-                        print(f"DEBUG: Saving attendance for {student.get_full_name()}")
-                        
-                        # Обновляем или создаем запись посещаемости
-                        attendance, created = Attendance.objects.update_or_create(
-                            student=student,
-                            schedule_lesson=lesson,
-                            date=date_obj,
-                            defaults={'status': status}
-                        )
-                        
-                        saved_count += 1
-                        print(f"DEBUG: Saved count: {saved_count}")
-                        
-                    except User.DoesNotExist:
-                        print(f"DEBUG: Student {student_id} does not exist")
-                        continue
-                    except Exception as e:
-                        print(f"DEBUG: Error saving attendance for student {student_id}: {str(e)}")
-                        continue
-                        
-            except ScheduleLesson.DoesNotExist:
-                print(f"DEBUG: Lesson {lesson_id} does not exist")
-                continue
-            except Exception as e:
-                print(f"DEBUG: Error processing lesson {lesson_id}: {str(e)}")
-                continue
+        # Все отметки за день сохраняются одним пакетом
+        results = save_attendance_batch(request.user, date_obj, attendance_data)
+        saved_count = sum(1 for row in results if row['saved'])
         
-        print(f"DEBUG: Total saved: {saved_count}")
         return JsonResponse({
             'success': True,
-            'message': f'Посещаемость для {saved_count} учеников сохранена'
+            'message': f'Посещаемость для {saved_count} учеников сохранена',
+            'saved_count': saved_count,
+            'results': results,
         })
         
-    except json.JSONDecodeError as e:
-        print(f"DEBUG: JSON decode error: {str(e)}")
+    except (json.JSONDecodeError, UnicodeDecodeError, ValueError):
         return JsonResponse({
             'success': False,
             'error': 'Неверный формат данных'
         }, status=400)
     except Exception as e:
-        print(f"DEBUG: General exception: {str(e)}")
-        import traceback
-        print(f"DEBUG: Traceback: {traceback.format_exc()}")
         return JsonResponse({
             'success': False,
             'error': str(e)
@@ -660,7 +522,7 @@ def edit_homework(request, homework_id):
         'daily_schedule__week_day', 'lesson_number'
     )[:50]
     
-    groups = teacher_info['all_groups']
+    groups = teacher_info.all_groups
     
     context = {
         'teacher_info': teacher_info,
@@ -708,27 +570,32 @@ def manage_homework(request):
     paginator = Paginator(homework_qs, 20)
     page_obj = paginator.get_page(page_number)
     
-    # Считаем статистику по каждому ДЗ
+    # Считаем статистику по ДЗ на странице: сданные и проверенные работы
+    page_homework_ids = [homework.id for homework in page_obj]
+    submission_counts = {
+        row['homework']: row
+        for row in HomeworkSubmission.objects.filter(
+            homework_id__in=page_homework_ids
+        ).values('homework').annotate(
+            total=Count('id'),
+            graded=Count(Case(When(grade__isnull=False, then=1))),
+        )
+    }
+    group_sizes = dict(
+        StudentProfile.objects.filter(
+            student_group_id__in={homework.student_group_id for homework in page_obj}
+        ).values('student_group').annotate(total=Count('user')).values_list('student_group', 'total')
+    )
+    
     for homework in page_obj:
-        homework.submission_count = HomeworkSubmission.objects.filter(
-            homework=homework
-        ).count()
-        
-        # ВРЕМЕННО УБИРАЕМ ЭТУ СТРОКУ - НЕТ СВЯЗИ МЕЖДУ GRADE И HOMEWORKSUBMISSION
-        # homework.graded_count = Grade.objects.filter(
-        #     homework_submission__homework=homework,
-        #     grade_type='HW'
-        # ).count()
-        
-        homework.graded_count = 0  # Показываем 0, пока не настроим связь
-        
-        homework.total_students = StudentProfile.objects.filter(
-            student_group=homework.student_group
-        ).count()
+        counts = submission_counts.get(homework.id, {})
+        homework.submission_count = counts.get('total', 0)
+        homework.graded_count = counts.get('graded', 0)
+        homework.total_students = group_sizes.get(homework.student_group_id, 0)
     
     # Данные для фильтров
-    groups = teacher_info['all_groups']
-    subjects = teacher_info['subjects']
+    groups = teacher_info.all_groups
+    subjects = teacher_info.subjects
     
     context = {
         'teacher_info': teacher_info,
@@ -837,7 +704,7 @@ def create_homework(request, homework_id=None):
         'daily_schedule__week_day', 'lesson_number'
     )[:50]
     
-    groups = teacher_info['all_groups']
+    groups = teacher_info.all_groups
     
     context = {
         'teacher_info': teacher_info,
@@ -858,56 +725,35 @@ def homework_submissions(request, homework_id):
     teacher_info = get_teacher_info(request.user)
     
     # Получаем все отправки
-    submissions = HomeworkSubmission.objects.filter(
+    submissions = list(HomeworkSubmission.objects.filter(
         homework=homework
-    ).select_related('student').order_by('submitted_at')
+    ).select_related('student', 'grade').order_by('submitted_at'))
     
-    # Получаем оценки за домашние работы
-    submission_grades = {}
-    for submission in submissions:
-        # Ищем оценку для этого ученика по этому предмету с типом HW
-        grade = Grade.objects.filter(
-            student=submission.student,
-            subject=homework.schedule_lesson.subject,
-            grade_type='HW',
-            date__gte=submission.submitted_at.date()
-        ).order_by('-date').first()
-        
-        if grade:
-            submission_grades[submission.id] = grade
+    # Оценки за домашние работы хранятся в самих работах
+    submission_grades = match_submission_grades(submissions)
+    submissions_by_student = {submission.student_id: submission for submission in submissions}
     
     # Получаем всех учеников группы
-    all_students = StudentProfile.objects.filter(
+    all_students = list(StudentProfile.objects.filter(
         student_group=homework.student_group
-    ).select_related('user').order_by('user__last_name', 'user__first_name')
+    ).select_related('user').order_by('user__last_name', 'user__first_name'))
     
     # Создаем полный список
     students_data = []
     for student_profile in all_students:
-        student = student_profile.user
-        
-        # Ищем отправку
-        submission = None
-        for sub in submissions:
-            if sub.student == student:
-                submission = sub
-                break
-        
-        # Ищем оценку
-        grade = None
-        if submission and submission.id in submission_grades:
-            grade = submission_grades[submission.id]
+        submission = submissions_by_student.get(student_profile.user_id)
+        grade = submission_grades.get(submission.id) if submission else None
         
         students_data.append({
-            'student': student,
+            'student': student_profile.user,
             'profile': student_profile,
             'submission': submission,
             'grade': grade,
         })
     
     # Статистика
-    total_students = all_students.count()
-    submitted_count = submissions.count()
+    total_students = len(all_students)
+    submitted_count = len(submissions)
     graded_count = len([s for s in students_data if s['grade']])
     pending_review = submitted_count - graded_count
     missing_count = total_students - submitted_count
@@ -974,17 +820,12 @@ def student_submission_detail(request, homework_id, student_id):
     submission = HomeworkSubmission.objects.filter(
         homework=homework,
         student=student
-    ).first()
+    ).select_related('grade').first()
     
     # Получаем оценку (если есть)
     grade = None
     if submission:
-        grade = Grade.objects.filter(
-            student=student,
-            subject=homework.schedule_lesson.subject,
-            grade_type='HW',
-            date__gte=submission.submitted_at.date()
-        ).order_by('-date').first()
+        grade = submission.grade
     
     from django.urls import reverse
     
@@ -1025,13 +866,8 @@ def find_grade_id(request):
         if submission.homework.schedule_lesson.teacher != request.user:
             return JsonResponse({'error': 'Доступ запрещен'}, status=403)
         
-        # Ищем оценку за эту домашнюю работу
-        grade = Grade.objects.filter(
-            student_id=student_id,
-            subject=submission.homework.schedule_lesson.subject,
-            grade_type='HW',
-            date__gte=submission.submitted_at.date()
-        ).order_by('-date').first()
+        # Оценка за эту домашнюю работу
+        grade = submission.grade
         
         if grade:
             return JsonResponse({
@@ -1131,8 +967,8 @@ def grade_submission(request, submission_id):
         if value < 1 or value > 5:
             return JsonResponse({'error': 'Оценка должна быть от 1 до 5'}, status=400)
         
-        # Создаем оценку, но не связываем с homework_submission (пока нет поля)
-        grade = Grade.objects.create(
+        # Создаем оценку; с работой ее связывает сигнал post_save
+        grade = Grade(
             student=submission.student,
             subject=submission.homework.schedule_lesson.subject,
             schedule_lesson=submission.homework.schedule_lesson,
@@ -1141,8 +977,9 @@ def grade_submission(request, submission_id):
             grade_type='HW',
             date=timezone.now().date(),
             comment=comment
-            # Нет поля homework_submission!
         )
+        grade._submission = submission
+        grade.save()
         
         return JsonResponse({
             'success': True,
@@ -1218,7 +1055,7 @@ def view_schedule(request):
     context = {
         'teacher_info': teacher_info,
         'schedule_by_day': schedule_by_day,
-        'groups': teacher_info['all_groups'],
+        'groups': teacher_info.all_groups,
         'selected_group': group_id,
         # Статистические данные
         'total_lessons': total_lessons,
@@ -1277,7 +1114,7 @@ def edit_announcement(request, announcement_id):
     context = {
         'teacher_info': teacher_info,
         'announcement': announcement,
-        'groups': teacher_info['all_groups'],
+        'groups': teacher_info.all_groups,
         'edit_mode': True,  # Флаг для шаблона
     }
     
@@ -1337,7 +1174,7 @@ def manage_announcements(request):
     context = {
         'teacher_info': teacher_info,
         'page_obj': page_obj,
-        'groups': teacher_info['all_groups'],
+        'groups': teacher_info.all_groups,
         'filters': {
             'group_id': group_id,
             'status_filter': status_filter,
@@ -1393,7 +1230,7 @@ def create_announcement(request):
     
     context = {
         'teacher_info': teacher_info,
-        'groups': teacher_info['all_groups'],
+        'groups': teacher_info.all_groups,
     }
     
     return render(request, 'teacher_portal/announcement_form.html', context)
@@ -1410,7 +1247,7 @@ def view_students(request):
     
     # Базовый запрос учеников
     students_qs = StudentProfile.objects.filter(
-        student_group__in=teacher_info['all_groups']
+        student_group_id__in=teacher_info.group_ids
     ).select_related('user', 'student_group').order_by('user__last_name', 'user__first_name')
     
     # Применяем фильтры
@@ -1418,63 +1255,34 @@ def view_students(request):
         students_qs = students_qs.filter(student_group_id=group_id)
     
     if search_query:
-        students_qs = students_qs.filter(
-            Q(user__first_name__icontains=search_query) |
-            Q(user__last_name__icontains=search_query) |
-            Q(patronymic__icontains=search_query) |
-            Q(user__username__icontains=search_query)
-        )
+        students_qs = search_people(search_query, queryset=students_qs)
     
     # Пагинация
     page_number = request.GET.get('page', 1)
     paginator = Paginator(students_qs, 30)
     page_obj = paginator.get_page(page_number)
     
-    # Для каждого ученика получаем статистику
+    # Статистика по всем ученикам страницы - двумя сгруппированными запросами
     total_attendance_stats = {'present': 0, 'total': 0}
     total_grade_stats = {'sum': 0, 'count': 0}
     
+    page_stats = get_student_stats(
+        [student_profile.user_id for student_profile in page_obj],
+        teacher=request.user,
+    )
+    
     for student_profile in page_obj:
-        student = student_profile.user
-        
-        # Статистика оценок
-        grade_stats = Grade.objects.filter(
-            student=student,
-            teacher=request.user
-        ).aggregate(
-            total=Count('id'),
-            average=Avg('value'),
-            latest=Max('date'),
-        )
+        student_stats = page_stats[student_profile.user_id]
+        grade_stats = student_stats['grade_stats']
+        attendance_stats = student_stats['attendance_stats']
         
         student_profile.grade_stats = grade_stats
+        student_profile.attendance_stats = attendance_stats
         
         if grade_stats['total'] and grade_stats['average']:
             total_grade_stats['sum'] += grade_stats['average'] * grade_stats['total']
             total_grade_stats['count'] += grade_stats['total']
         
-        # Статистика посещаемости
-        attendance_stats = Attendance.objects.filter(
-            student=student,
-            schedule_lesson__teacher=request.user
-        ).aggregate(
-            total=Count('id'),
-            present=Count(Case(When(status='P', then=1))),
-            absent=Count(Case(When(status='A', then=1))),
-            late=Count(Case(When(status='L', then=1))),
-        )
-        
-        student_profile.attendance_stats = attendance_stats
-        
-        # Рассчитываем процент присутствия
-        if attendance_stats['total'] and attendance_stats['total'] > 0:
-            attendance_stats['present_percentage'] = round(
-                (attendance_stats['present'] / attendance_stats['total']) * 100, 
-                1
-            )
-        else:
-            attendance_stats['present_percentage'] = 0
-        
         total_attendance_stats['present'] += attendance_stats['present'] or 0
         total_attendance_stats['total'] += attendance_stats['total'] or 0
     
@@ -1487,18 +1295,13 @@ def view_students(request):
         attendance_rate = 0
     
     # Считаем активных учеников (тех, у кого были оценки или посещаемость в последние 30 дней)
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    active_students = User.objects.filter(
-        id__in=students_qs.values_list('user_id', flat=True)
-    ).filter(
-        Q(grades__teacher=request.user, grades__date__gte=thirty_days_ago) |
-        Q(attendances__schedule_lesson__teacher=request.user, attendances__date__gte=thirty_days_ago)
-    ).distinct().count()
+    thirty_days_ago = timezone.now().date() - timedelta(days=30)
+    active_students = count_active_students(students_qs, thirty_days_ago, teacher=request.user)
     
     context = {
         'teacher_info': teacher_info,
         'page_obj': page_obj,
-        'groups': teacher_info['all_groups'],
+        'groups': teacher_info.all_groups,
         'filters': {
             'group_id': group_id,
             'search_query': search_query,
@@ -1518,7 +1321,7 @@ def student_detail(request, student_id):
     
     # Проверяем, что ученик в группе учителя
     teacher_info = get_teacher_info(request.user)
-    if student_profile.student_group not in teacher_info['all_groups']:
+    if student_profile.student_group_id not in teacher_info.group_ids:
         messages.error(request, 'Доступ запрещен')
         return redirect('teacher_students')
     
@@ -1585,135 +1388,42 @@ def view_statistics(request):
     """Статистика для учителя"""
     teacher_info = get_teacher_info(request.user)
     
-    # Получаем период из GET-параметров (по умолчанию 30 дней)
-    days = int(request.GET.get('days', 30))
-    end_date = timezone.now().date()
-    start_date = end_date - timedelta(days=days)
+    # Получаем период из GET-параметров (по умолчанию 30 дней, не больше года)
+    days = parse_days(request.GET.get('days', DEFAULT_DAYS))
+    stats = get_teacher_statistics(request.user, days)
     
     # Статистика по оценкам
-    grade_stats_by_subject = []
-    for subject in teacher_info['subjects']:
-        stats = Grade.objects.filter(
-            teacher=request.user,
-            subject=subject,
-            date__range=[start_date, end_date]
-        ).aggregate(
-            total=Count('id'),
-            average=Avg('value'),
-            excellent=Count(Case(When(value__gte=4.5, then=1))),
-            good=Count(Case(When(value__gte=3.5, value__lt=4.5, then=1))),
-            satisfactory=Count(Case(When(value__gte=2.5, value__lt=3.5, then=1))),
-            poor=Count(Case(When(value__lt=2.5, then=1))),
-        )
-        
-        grade_stats_by_subject.append({
+    grade_stats_by_subject = [
+        {
             'subject': subject,
-            'stats': stats,
-        })
+            'stats': stats['subjects'].get(subject.id, empty_grade_stats()),
+        }
+        for subject in teacher_info.subjects
+    ]
     
     # Статистика по посещаемости
-    attendance_stats_by_group = []
-    for group in teacher_info['all_groups']:
-        stats = Attendance.objects.filter(
-            schedule_lesson__teacher=request.user,
-            schedule_lesson__daily_schedule__student_group=group,
-            date__range=[start_date, end_date]
-        ).aggregate(
-            total=Count('id'),
-            present=Count(Case(When(status='P', then=1))),
-            absent=Count(Case(When(status='A', then=1))),
-            late=Count(Case(When(status='L', then=1))),
-        )
-        
-        if stats['total'] > 0:
-            stats['present_percentage'] = round((stats['present'] / stats['total']) * 100, 1)
-        else:
-            stats['present_percentage'] = 0
-        
-        attendance_stats_by_group.append({
+    attendance_stats_by_group = [
+        {
             'group': group,
-            'stats': stats,
-        })
-    
-    # Статистика по ДЗ
-    homework_stats = Homework.objects.filter(
-        schedule_lesson__teacher=request.user,
-        created_at__range=[start_date, end_date]
-    ).aggregate(
-        total=Count('id'),
-        with_submissions=Count(Case(When(submissions__isnull=False, then=1), distinct=True)),
-    )
-    
-    # Добавляем отдельный запрос для проверенных работ
-    graded_hw_count = Grade.objects.filter(
-        teacher=request.user,
-        grade_type='HW',
-        date__range=[start_date, end_date]
-    ).count()
-    
-    homework_stats['graded'] = graded_hw_count
-    
-    # Еженедельная активность
-    weekly_activity = []
-    for i in range(4, -1, -1):  # Последние 5 недель
-        week_start = end_date - timedelta(days=(i * 7) + 6)
-        week_end = end_date - timedelta(days=i * 7)
-        
-        grades_count = Grade.objects.filter(
-            teacher=request.user,
-            date__range=[week_start, week_end]
-        ).count()
-        
-        attendance_count = Attendance.objects.filter(
-            schedule_lesson__teacher=request.user,
-            date__range=[week_start, week_end]
-        ).count()
-        
-        homework_count = Homework.objects.filter(
-            schedule_lesson__teacher=request.user,
-            created_at__range=[week_start, week_end]
-        ).count()
-        
-        weekly_activity.append({
-            'week': f'{week_start:%d.%m} - {week_end:%d.%m}',
-            'grades': grades_count,
-            'attendance': attendance_count,
-            'homework': homework_count,
-        })
-    
-    # Считаем общее количество оценок
-    total_grades = Grade.objects.filter(
-        teacher=request.user,
-        date__range=[start_date, end_date]
-    ).count()
-    
-    # Считаем среднюю посещаемость
-    total_attendance = Attendance.objects.filter(
-        schedule_lesson__teacher=request.user,
-        date__range=[start_date, end_date]
-    ).aggregate(
-        total=Count('id'),
-        present=Count(Case(When(status='P', then=1))),
-    )
-    
-    if total_attendance['total'] > 0:
-        avg_attendance = round((total_attendance['present'] / total_attendance['total']) * 100, 1)
-    else:
-        avg_attendance = 0
+            'stats': stats['groups'].get(group.id, empty_attendance_stats()),
+        }
+        for group in teacher_info.all_groups
+    ]
     
     context = {
         'teacher_info': teacher_info,
         'period': {
-            'start': start_date,
-            'end': end_date,
+            'start': stats['start'],
+            'end': stats['end'],
         },
         'grade_stats_by_subject': grade_stats_by_subject,
         'attendance_stats_by_group': attendance_stats_by_group,
-        'homework_stats': homework_stats,
-        'weekly_activity': weekly_activity,
+        'homework_stats': stats['homework_stats'],
+        'weekly_activity': stats['weekly_activity'],
         'days': days,
-        'total_grades': total_grades,
-        'avg_attendance': avg_attendance,
+        'total_grades': stats['total_grades'],
+        'total_attendance': stats['total_attendance'],
+        'avg_attendance': stats['avg_attendance'],
     }
     
     return render(request, 'teacher_portal/statistics.html', context)